@@ -10,6 +10,13 @@ import interface
 import traceback
 from states.client_state import client_state
 from states.file_state import file_state
+from states.game import game_session_manager
+from states.game_journal import game_journal
+from utils.disk_io import disk_io
+from utils.capture import CaptureSocket, packet_capture
+from utils import metrics, tracing
+from utils.profiler import profiler
+from states.transfer_manager import transfer_manager
 from client_logger import client_logger
 from queue import Queue
 
@@ -21,31 +28,52 @@ def initialize_sockets(port):
   global UNICAST_SOCKET
   global BROADCAST_SOCKET
 
-  UNICAST_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  socket_class = CaptureSocket if config.CAPTURE_ENABLED else socket.socket
+  UNICAST_SOCKET = socket_class(socket.AF_INET, socket.SOCK_DGRAM)
   UNICAST_SOCKET.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
   UNICAST_SOCKET.bind((config.CLIENT_IP, port))
 
-  BROADCAST_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  BROADCAST_SOCKET = socket_class(socket.AF_INET, socket.SOCK_DGRAM)
   BROADCAST_SOCKET.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
   BROADCAST_SOCKET.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
   BROADCAST_SOCKET.bind(('0.0.0.0', port))
 
+def register_gauges(recv_queue: Queue):
+  """Registers the gauges shown by STATS, each is only read when the metrics are shown"""
+  state_sizes = lambda name: lambda: client_state.get_state_sizes()[name]
+  metrics.metrics.gauge("peers", "Known peers", state_sizes("peers"))
+  metrics.metrics.gauge("followers", "Followers", state_sizes("followers"))
+  metrics.metrics.gauge("following", "Peers followed", state_sizes("following"))
+  metrics.metrics.gauge("groups", "Groups this client is a member of", state_sizes("groups"))
+  metrics.metrics.gauge("recent_messages", "Recent messages held, sent and received",
+                        lambda: sum(client_state.get_state_sizes()[k] for k in ("recent_received", "recent_sent")))
+  metrics.metrics.gauge("pending_transfers", "Incoming file transfers not yet complete", lambda: len(file_state.get_pending_transfers()))
+  metrics.metrics.gauge("outgoing_transfers", "Outgoing file transfers listed by TRANSFERS", lambda: len(transfer_manager.get_transfers()))
+  metrics.metrics.gauge("active_games", "TicTacToe games in progress", lambda: game_session_manager.get_session_counts()["active"])
+  metrics.metrics.gauge("recv_queue_depth", "Received datagrams waiting to be processed", recv_queue.qsize)
+  metrics.metrics.gauge("log_queue_depth", "Log records waiting to be written", client_logger.pending)
+  metrics.metrics.gauge("disk_io_queue_depth", "Received files waiting to be written", disk_io.pending)
+  metrics.metrics.gauge("capture_queue_depth", "Datagrams waiting to be written to the packet capture", packet_capture.pending)
+
 def run_threads():
   recv_queue = Queue()
+  register_gauges(recv_queue)
+  if config.METRICS_PORT:
+    metrics.start_export_server(metrics.metrics, config.METRICS_PORT)
 
   # Thread: socket listener, only receives and puts into queue
   def unicast_receive_loop():
     client_logger.debug("INIT THREAD: unicast_receive_loop()")
     while True:
       data, address = UNICAST_SOCKET.recvfrom(config.BUFSIZE)
-      recv_queue.put((data, address))
+      recv_queue.put((data, address, time.perf_counter()))
   threading.Thread(target=unicast_receive_loop, daemon=True).start()
 
   def broadcast_receive_loop():
     client_logger.debug("INIT THREAD: broadcast_receive_loop()")
     while True:
       data, address = BROADCAST_SOCKET.recvfrom(config.BUFSIZE)
-      recv_queue.put((data, address))
+      recv_queue.put((data, address, time.perf_counter()))
   threading.Thread(target=broadcast_receive_loop, daemon=True).start()
 
   def add_peer_if_none(message, address, port):
@@ -63,15 +91,23 @@ def run_threads():
   def message_process_loop():
     client_logger.debug("INIT THREAD: unicast_process_loop()")
     while True:
-      data, address = recv_queue.get()  # blocks until item available
+      data, address, received_at = recv_queue.get()  # blocks until item available
+      dequeued_at = time.perf_counter()
+      metrics.queue_wait_seconds.observe(dequeued_at - received_at)
+      tracing.record("recv_queue_wait", received_at, dequeued_at)
       try:
-        received_msg = router.recv_message(data, address)
-        if received_msg is not None:
-          client_state.add_recent_message_received(received_msg)
-          interface.print_message(received_msg)
-          add_peer_if_none(received_msg, address[0], address[1]) 
+        with tracing.span("process_message", peer=address[0]):
+          with tracing.span("recv_message"):
+            received_msg = router.recv_message(data, address)
+          if received_msg is not None:
+            with tracing.span("add_recent_message_received"):
+              client_state.add_recent_message_received(received_msg)
+            with tracing.span("print_message"):
+              interface.print_message(received_msg)
+            with tracing.span("add_peer_if_none"):
+              add_peer_if_none(received_msg, address[0], address[1])
       except Exception as e:
-          client_logger.error(f"Error processing message from {address}:\n{e}")
+          client_logger.error("Error processing message from {0}:\n{1}", address, e, source=address[0])
   threading.Thread(target=message_process_loop, daemon=True).start()
 
   # Concurrent Thread for broadcasting every 300s:
@@ -92,12 +128,12 @@ def run_threads():
     client_logger.debug("INIT THREAD: update_states()")
     while True:
       expired_messages = client_state.cleanup_expired_messages()
-      file_state.complete_transfers()
       expired_file_offer_ids = []
       for msg in expired_messages:
         if msg.type == "FILE_OFFER":
           expired_file_offer_ids.append(msg.fileid)
       file_state.remove_transfers(expired_file_offer_ids)
+      game_session_manager.reap()
       time.sleep(5)
   threading.Thread(target=update_states, daemon=True).start()
 
@@ -120,6 +156,9 @@ def main():
   parser.add_argument("--subnet", type=int, help="Subnet Mask of the network in prefix form")
   parser.add_argument("--ipaddress", type=str, help="Ip address of the network")
   parser.add_argument("--verbose", action="store_true", help="Enable verbose mode")
+  parser.add_argument("--capture", action="store_true", help="Record every datagram sent and received under CAPTURE_DIR")
+  parser.add_argument("--metrics-port", type=int, help="Serve metrics for Prometheus on this loopback port")
+  parser.add_argument("--trace", type=str, help="Write pipeline stage timings to this Chrome trace JSON file")
   args = parser.parse_args()
 
   # Update config with compile arguments
@@ -129,6 +168,12 @@ def main():
     config.SUBNET_MASK = args.subnet
   if args.verbose:
     config.VERBOSE = args.verbose
+  if args.capture:
+    config.CAPTURE_ENABLED = True
+  if args.metrics_port:
+    config.METRICS_PORT = args.metrics_port
+  if args.trace:
+    config.TRACE_FILE = args.trace
   if args.ipaddress:
     ip_override = ipaddress.ip_address(args.ipaddress)
     config.CLIENT_IP = str(ip_override)
@@ -137,6 +182,9 @@ def main():
   # Setup logging with verbose flag
   client_logger.set_verbose(config.VERBOSE)
 
+  # Record pipeline stage timings for chrome://tracing
+  trace_sink = tracing.start_chrome_trace(config.TRACE_FILE) if config.TRACE_FILE else None
+
   # Socket initialization
   initialize_sockets(config.PORT)
 
@@ -146,6 +194,9 @@ def main():
   # Set client UserID
   client_state.set_user_id(interface.get_user_id())
 
+  # Rebuild this user's games interrupted by the last exit
+  game_session_manager.restore_games(client_state.get_user_id())
+
   # Run Threads
   run_threads()
   
@@ -182,6 +233,18 @@ def main():
     elif user_input is None:
       break
 
+  # Keep the samples of a profile still running at exit
+  if profiler.is_running():
+    profiler.stop()
+
+  # Let received files that are still being written reach the disk
+  disk_io.shutdown()
+  game_journal.flush()
+  packet_capture.flush()
+  if trace_sink is not None:
+    tracing.stop_chrome_trace(trace_sink)
+  client_logger.flush()
+
 if __name__ == "__main__":
   main()
 
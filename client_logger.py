@@ -1,5 +1,9 @@
-import logging
+import atexit
+import queue
+import sys
 import threading
+import time
+import config
 
 class Color:
     OK = "\033[92m"    # Green
@@ -10,7 +14,38 @@ class Color:
     PROMPT = "\033[95m"  # Magenta
     RESET = "\033[0m"
 
+DIVIDER = "-" * 50
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+# Rate limited categories: (level, prefix, console prefix, color) used for their suppression summaries
+RATE_LIMITED = {
+    "DROP": (DEBUG, "DROP ! ", "", Color.ERR),
+    "ERROR": (ERROR, "", "ERROR: ", Color.ERR),
+}
+
 class ClientLogger:
+    """
+    Logs to app.log and the console without making the caller wait on either.
+    Each call only puts a record on a bounded queue; a background thread formats the records and writes them
+    in batches. When the queue is full, debug-level records are dropped (and counted in the log) while records
+    the user needs to see wait for room.
+
+    Messages may be templates formatted with str.format on the writer thread, e.g.
+    `client_logger.send("MESSAGE: {0.payload} TO {1}", message, dest)`. A call below the cached effective
+    level returns before anything is formatted, so hot paths should pass templates rather than f-strings.
+
+    drop() and error() are rate limited per `source` (e.g. the sending IP) and per category, over windows of
+    LOG_RATE_WINDOW seconds. What a window suppressed is summarized once it ends, so a flood of junk datagrams
+    costs one counter update per packet instead of a log line. An error() without a source is a local or
+    user-facing one and is never suppressed.
+    """
+
     _instance = None
     _lock = threading.RLock()
 
@@ -23,82 +58,190 @@ class ClientLogger:
         return cls._instance
 
     def _initialize(self, verbose: bool = False):
-        self._verbose_mode = verbose
         self._log_lock = threading.Lock()
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler("app.log", mode="w"),
-            ]
-        )
+        self._set_levels(verbose)
+        self._queue: queue.Queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        self._dropped = 0  # records discarded since the last batch because the queue was full
+        self._window_end = time.time() + config.LOG_RATE_WINDOW
+        self._rate_counts = {}  # (category, source) -> calls this window
+        self._category_counts = {}  # category -> calls this window
+        self._suppressed = {}  # (category, source) -> calls not logged this window
+        self._file = open("app.log", "w", encoding="utf-8")
+        threading.Thread(target=self._write_loop, name="client_logger", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _set_levels(self, verbose: bool):
+        self._verbose_mode = verbose
+        # Verbose mode shows debug records on the console and writes them to app.log
+        self._console_level = DEBUG if verbose else INFO
+        self._file_level = DEBUG if verbose else LEVELS[config.LOG_FILE_LEVEL]
+        self._level = min(self._console_level, self._file_level)
 
     def set_verbose(self, verbose: bool):
         with self._log_lock:
-            self._verbose_mode = verbose
-
-    def _print_divider(self, color:Color=Color.RESET):
-        width = 50
-        divider = "-" * width
-        print(f"{color}{divider}{Color.RESET}")
-        
-
-    def _print_log(self, message: str, color: Color, non_verbose=False):
-        if self._verbose_mode or non_verbose:
-            print(f"{color}{message}{Color.RESET}")
+            self._set_levels(verbose)
 
-    def error(self, message: str):
-        with self._log_lock:
-            logging.error(message)
-            self._print_log(f"ERROR: {message}", Color.ERR, True)
+    def pending(self) -> int:
+        return self._queue.qsize()
 
-    def warn(self, message: str):
-        with self._log_lock:
-            logging.warning(message)
-            self._print_log(f"WARNING: {message}", Color.WARN, True)
+    def flush(self):
+        """Waits until every queued record is written, called before the client exits"""
+        self._queue.join()
 
-    def process(self, message: str):
-        with self._log_lock:
-            logging.info(message)
-            self._print_log(f"PROCESS: {message}", Color.WARN, True)
-
-    def success(self, message: str):
-        with self._log_lock:
-            logging.info(message)
-            self._print_log(f"{message}", Color.OK, True)
-
-    def info(self, message: str):
-        with self._log_lock:
-            logging.info(message)
-            self._print_divider()
-            self._print_log(f"{message}", Color.INFO, True)
-
-    def debug(self, message: str):
-        with self._log_lock:
-            logging.debug(message)
-            self._print_log(f"{message}", Color.INFO)
+    def _record(self, level: int, prefix: str, message: str, args: tuple, console_prefix: str, color: str, divider: bool = False):
+        return (
+            time.time(), level, prefix, message, args,
+            level >= self._file_level,
+            console_prefix if level >= self._console_level else None,
+            color, divider
+        )
 
-    def send(self, message: str):
+    def _log(self, level: int, prefix: str, message: str, args: tuple, console_prefix: str, color: str, divider: bool = False):
+        if level < self._level:
+            return
+        record = self._record(level, prefix, message, args, console_prefix, color, divider)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if level >= INFO:
+                self._queue.put(record)
+            else:
+                with self._log_lock:
+                    self._dropped += 1
+
+    def _allow(self, category: str, source) -> bool:
+        """Counts a rate limited call, returns False if it is over its source's or its category's limit this window"""
+        key = (category, source)
         with self._log_lock:
-            logging.debug(f"SEND > {message}")
-            self._print_log(f"SEND > {message}", Color.OK)
-
-    def receive(self, message: str):
+            count = self._rate_counts.get(key, 0) + 1
+            self._rate_counts[key] = count
+            category_count = self._category_counts.get(category, 0) + 1
+            self._category_counts[category] = category_count
+            if count <= config.LOG_RATE_PER_SOURCE and category_count <= config.LOG_RATE_PER_CATEGORY:
+                return True
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+
+    def _end_rate_window(self, now: float) -> list:
+        """Starts a new rate limit window once the current one is over, returns records summarizing what it suppressed"""
         with self._log_lock:
-            logging.debug(f"RECV < {message}")
-            self._print_log(f"RECV < {message}", Color.RECV)
-
-    def drop(self, message: str):
-        with self._log_lock:
-            logging.debug(f"DROP ! {message}")
-            self._print_log(f"DROP ! {message}", Color.ERR)
+            if now < self._window_end:
+                return []
+            suppressed = self._suppressed
+            self._rate_counts = {}
+            self._category_counts = {}
+            self._suppressed = {}
+            self._window_end = now + config.LOG_RATE_WINDOW
+        by_category = {}
+        for (category, source), count in suppressed.items():
+            by_category.setdefault(category, []).append((count, source))
+        records = []
+        for category, counts in by_category.items():
+            level, prefix, console_prefix, color = RATE_LIMITED[category]
+            if level < self._level:
+                continue
+            counts.sort(key=lambda c: c[0], reverse=True)
+            for count, source in counts[:config.LOG_RATE_SUMMARY_SOURCES]:
+                records.append(self._record(
+                    level, prefix, "Suppressed {0} similar messages from {1} in the last {2}s",
+                    (count, source, config.LOG_RATE_WINDOW), console_prefix, color
+                ))
+            rest = counts[config.LOG_RATE_SUMMARY_SOURCES:]
+            if rest:
+                records.append(self._record(
+                    level, prefix, "Suppressed {0} similar messages from {1} other sources in the last {2}s",
+                    (sum(c[0] for c in rest), len(rest), config.LOG_RATE_WINDOW), console_prefix, color
+                ))
+        return records
+
+    def _format_message(self, message, args: tuple) -> str:
+        if not args:
+            return f"{message}"
+        try:
+            return message.format(*args)
+        except Exception as e:
+            return f"{message} {args} (format failed: {e})"
+
+    def _format_time(self, created: float) -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)) + f",{int(created * 1000) % 1000:03d}"
+
+    def _write_loop(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=max(0.0, self._window_end - time.time()))]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            queued = len(batch)
+            batch.extend(self._end_rate_window(time.time()))
+            if not batch:
+                continue
+            try:
+                file_lines = []
+                console_lines = []
+                with self._log_lock:
+                    dropped, self._dropped = self._dropped, 0
+                if dropped:
+                    file_lines.append(f"{self._format_time(time.time())} - WARNING - Log queue full, dropped {dropped} records\n")
+                for created, level, prefix, message, args, to_file, console_prefix, color, divider in batch:
+                    text = self._format_message(message, args)
+                    if to_file:
+                        file_lines.append(f"{self._format_time(created)} - {LEVEL_NAMES[level]} - {prefix}{text}\n")
+                    if console_prefix is not None:
+                        if divider:
+                            console_lines.append(f"{Color.RESET}{DIVIDER}{Color.RESET}\n")
+                        console_lines.append(f"{color}{console_prefix}{prefix}{text}{Color.RESET}\n")
+                self._file.write("".join(file_lines))
+                self._file.flush()
+                if console_lines:
+                    sys.stdout.write("".join(console_lines))
+                    sys.stdout.flush()
+            except Exception as e:
+                sys.stderr.write(f"client_logger failed to write {len(batch)} records: {e}\n")
+            finally:
+                for _ in range(queued):
+                    self._queue.task_done()
+
+    def error(self, message: str, *args, source=None):
+        if source is None or self._allow("ERROR", source):
+            self._log(ERROR, "", message, args, "ERROR: ", Color.ERR)
+
+    def warn(self, message: str, *args):
+        self._log(WARNING, "", message, args, "WARNING: ", Color.WARN)
+
+    def process(self, message: str, *args):
+        self._log(INFO, "", message, args, "PROCESS: ", Color.WARN)
+
+    def success(self, message: str, *args):
+        self._log(INFO, "", message, args, "", Color.OK)
+
+    def info(self, message: str, *args):
+        self._log(INFO, "", message, args, "", Color.INFO, divider=True)
+
+    def debug(self, message: str, *args):
+        self._log(DEBUG, "", message, args, "", Color.INFO)
+
+    def send(self, message: str, *args):
+        self._log(DEBUG, "SEND > ", message, args, "", Color.OK)
+
+    def receive(self, message: str, *args):
+        self._log(DEBUG, "RECV < ", message, args, "", Color.RECV)
+
+    def drop(self, message: str, *args, source=None):
+        if DEBUG >= self._level and self._allow("DROP", source):
+            self._log(DEBUG, "DROP ! ", message, args, "", Color.ERR)
 
     def input(self, prompt: str) -> str:
-        with self._log_lock:
-            self._print_divider()
-            user_input = input(f"{Color.PROMPT}{prompt}{Color.RESET}")
-            logging.info(f"INPUT: {user_input}")
-            return user_input
+        # Anything still queued belongs above the prompt
+        self.flush()
+        print(f"{Color.RESET}{DIVIDER}{Color.RESET}")
+        user_input = input(f"{Color.PROMPT}{prompt}{Color.RESET}")
+        self._log(INFO, "INPUT: ", user_input, (), None, Color.RESET)
+        return user_input
 
 # Global singleton instance
 client_logger = ClientLogger()
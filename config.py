@@ -41,6 +41,43 @@ CLIENT_IP = get_ip()
 BROADCAST_IP = get_broadcast_ip(SUBNET_MASK)
 VERBOSE = False
 DEFAULT_TTL = 300
+GAME_UNDO_DEPTH = 2  # moves per TicTacToe game that can be rolled back
+GAME_IDLE_TTL = 3600  # seconds without a move before an unfinished game is dropped
+GAME_FINISHED_TTL = 300  # seconds a finished game is kept for display before it is dropped
+GAME_JOURNAL_DIR = "game_journal"  # move journals of unfinished games, replayed on startup
+GROUP_DELTA_LOG = 512  # membership changes kept per group to answer GROUP_SYNC_REQUESTs with a delta
+GROUP_HISTORY_DEPTH = 200  # messages kept per group for the HISTORY command
+GROUP_HISTORY_PAGE = 20  # messages shown per HISTORY page
 MESSAGES_DIR = "messages"
 BUFSIZE = 4096
 KEEP_ALIVE = 30
+FILE_COMPRESSION = True  # offer zlib compressed chunks for compressible FILETYPEs
+FILE_COMPRESSION_LEVEL = 6
+TRANSFER_WORKERS = 4  # threads negotiating outgoing FILE_OFFERs
+TRANSFER_QUANTUM = 4096  # bytes each active transfer may send per round robin turn
+TRANSFER_HISTORY = 600  # seconds finished transfers stay listed
+TRANSFER_MEMORY_BUDGET = 32 * 1024 * 1024  # bytes of received chunks kept in memory, the rest spools to disk
+DISK_IO_WORKERS = 2  # threads spooling, hashing and writing received files
+DISK_IO_QUEUE = 16  # disk I/O tasks that may wait for a worker, one per transfer receiving chunks plus files being saved
+PACE_PEER_RATE = 2 * 1024 * 1024  # bytes/sec of FILE_CHUNK data sent to a single peer, 0 disables
+PACE_GLOBAL_RATE = 4 * 1024 * 1024  # bytes/sec of FILE_CHUNK data sent to all peers combined, 0 disables
+PACE_BURST = 64 * 1024  # bytes that may be sent back to back before pacing kicks in
+PACE_PRUNE_INTERVAL = 60  # seconds between dropping the pacing buckets of peers no longer sent to
+LOG_QUEUE_SIZE = 10000  # log records waiting for the writer thread before debug records are dropped
+LOG_RATE_WINDOW = 10  # seconds per log rate limiting window
+LOG_RATE_PER_SOURCE = 20  # DROP/ERROR lines logged per source (sending IP) per window, the rest are summarized
+LOG_RATE_PER_CATEGORY = 200  # DROP/ERROR lines logged from all sources combined per window
+LOG_RATE_SUMMARY_SOURCES = 5  # sources named individually in a window's suppression summary
+LOG_DROP_PREVIEW = 256  # bytes of a dropped datagram included in its DROP line
+LOG_FILE_LEVEL = "INFO"  # lowest level written to app.log (DEBUG, INFO, WARNING or ERROR), verbose mode writes DEBUG too
+CAPTURE_ENABLED = False  # record every datagram sent and received, also enabled by --capture
+CAPTURE_DIR = "captures"  # packet capture segments, read them with python -m utils.capture
+CAPTURE_SEGMENT_BYTES = 16 * 1024 * 1024  # size of one capture segment file
+CAPTURE_SEGMENTS = 8  # newest segments kept, older ones are deleted
+CAPTURE_QUEUE = 4096  # datagrams waiting to be written before new ones are dropped from the capture
+METRICS_PORT = 0  # serve metrics for Prometheus at http://127.0.0.1:METRICS_PORT/metrics, 0 disables it, also set by --metrics-port
+TRACE_FILE = ""  # write pipeline stage spans to this Chrome trace JSON file, empty disables tracing, also set by --trace
+TRACE_QUEUE = 65536  # spans waiting to be written before new ones are dropped from the trace
+PROF_DIR = "profiles"  # output of prof_start/prof_stop
+PROF_INTERVAL = 0.005  # seconds between stack samples of every thread while profiling
+PROF_FORMAT = "both"  # "collapsed" stacks for flame graphs, "pstats" for python -m pstats, or "both"
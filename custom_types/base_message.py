@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 import socket
 from utils import msg_format
+from utils.metrics import messages_sent
 
 class BaseMessage(ABC):
   """
@@ -26,6 +27,7 @@ class BaseMessage(ABC):
     """Sends this message using the provided socket"""
     msg = msg_format.serialize_message(self.payload)
     socket.sendto(msg.encode(encoding), (ip, port))
+    messages_sent.inc(self.TYPE)
     return (ip, port)
 
   @classmethod
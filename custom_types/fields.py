@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from utils import msg_format
+from utils import msg_format, tracing
 from enum import Enum
 import ipaddress
 import secrets
@@ -278,19 +278,20 @@ class Token:
   
   @classmethod
   def validate_token(cls, token, *, expected_user_id: UserID, expected_scope):
-    if not isinstance(token, cls):
-      raise TypeError(f"In function validate_token {token} is not of type Token")
-    elif not isinstance(expected_user_id, UserID):
-      raise TypeError(f"In function validate_token {expected_user_id} is not of type UserID")
-    elif not isinstance(expected_scope, cls.Scope):
-      raise TypeError(f"In function validate_token {expected_scope} is not of type Token.Scope")
+    with tracing.span("validate_token"):
+      if not isinstance(token, cls):
+        raise TypeError(f"In function validate_token {token} is not of type Token")
+      elif not isinstance(expected_user_id, UserID):
+        raise TypeError(f"In function validate_token {expected_user_id} is not of type UserID")
+      elif not isinstance(expected_scope, cls.Scope):
+        raise TypeError(f"In function validate_token {expected_scope} is not of type Token.Scope")
     
-    if token.user_id != expected_user_id:
-      raise ValueError("Invalid Token: user_id mismatch")
-    if token.valid_until.is_expired():
-      raise ValueError("Invalid Token: expired")
-    if token.scope != expected_scope:
-      raise ValueError(f"Invalid Token: expected scope '{expected_scope}', got '{token.scope}'")
+      if token.user_id != expected_user_id:
+        raise ValueError("Invalid Token: user_id mismatch")
+      if token.valid_until.is_expired():
+        raise ValueError("Invalid Token: expired")
+      if token.scope != expected_scope:
+        raise ValueError(f"Invalid Token: expected scope '{expected_scope}', got '{token.scope}'")
   
   @classmethod
   def parse(cls, raw: str) -> "Token":
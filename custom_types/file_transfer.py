@@ -1,18 +1,154 @@
+import os
+import hashlib
+
 class FileTransfer:
-  def __init__(self, filename: str, filesize: int, filetype: str, total_chunks: int = 0):
+  def __init__(self, filename: str, filesize: int, filetype: str, total_chunks: int = 0,
+               from_user=None, token=None, features: list[str] = None, digest: str = ""):
     self.filename = filename
     self.filesize = filesize
     self.filetype = filetype
     self.total_chunks = total_chunks
-    self.received_chunks = [None] * total_chunks
+    self.chunk_size = 0  # length of every chunk but the last, learned from the first such chunk received
+    # chunk index -> bytes held in memory, or (offset, length) of a chunk spilled to the spool file
+    self.received_chunks: dict[int, bytes | tuple[int, int]] = {}
     self.received_count = 0
+    self.memory_bytes = 0
+    self.spooled_bytes = 0
+    self.spool_path = None
+    self._spool = None
+    self._unspooled: list[int] = []  # chunks held in memory until a disk I/O worker appends them to the spool file
+    self.unspooled_bytes = 0
+    self.io_scheduled = False  # a disk I/O worker is spooling or hashing chunks, it alone uses the spool file
+    self.discarded = False
+    self.on_status = None  # called with (from_user, file id, FILE_RECEIVED status) once the transfer is verified
+    # Offer details needed to accept chunks that don't repeat them (binary frames)
+    self.from_user = from_user
+    self.token = token
+    self.features = features or []
+    # Whole-file SHA-256 from the offer, checked incrementally as chunks become contiguous
+    self.digest = digest
+    self._hasher = hashlib.sha256()
+    self._hashed_count = 0
+    self.status = None  # FILE_RECEIVED status, set once every chunk is in and the digest was checked
     self._validate()
 
   def set_total_chunks(self, total_chunks: int):
+    if self.received_count > 0:
+      raise ValueError(f"Cannot change total_chunks of {self.filename} after chunks were received")
     self.total_chunks = total_chunks
-    self.received_chunks = [None] * self.total_chunks
     self._validate()
 
+  def chunk_length_range(self, chunk_index: int) -> tuple[int, int]:
+    """
+    Returns the (min, max) uncompressed length chunk `chunk_index` can have. Every chunk but the last is
+    `chunk_size` long, so once that is known the length is exact; before, FILESIZE and TOTAL_CHUNKS bound it.
+    """
+    if self.total_chunks <= 1:
+      return (self.filesize, self.filesize)
+    last = chunk_index == self.total_chunks - 1
+    if self.chunk_size:
+      length = self.filesize - (self.total_chunks - 1) * self.chunk_size if last else self.chunk_size
+      return (length, length)
+    # (total_chunks - 1) full chunks leave at least one byte for the last
+    shortest = -(-self.filesize // self.total_chunks)
+    longest = (self.filesize - 1) // (self.total_chunks - 1)
+    if last:
+      return (self.filesize - (self.total_chunks - 1) * longest, self.filesize - (self.total_chunks - 1) * shortest)
+    return (shortest, longest)
+
+  def check_chunk_length(self, chunk_index: int, length: int):
+    low, high = self.chunk_length_range(chunk_index)
+    if not low <= length <= high:
+      raise ValueError(f"chunk {chunk_index} is {length} bytes, expected {low}" + (f"-{high}" if high != low else ""))
+
+  def has_chunk(self, chunk_index: int) -> bool:
+    return chunk_index in self.received_chunks
+
+  def store_chunk(self, chunk_index: int, data: bytes, spool: bool = False):
+    """Keeps the chunk in memory. With `spool`, only until write_spool() has moved it to the spool file"""
+    if chunk_index < self.total_chunks - 1:
+      self.chunk_size = len(data)
+    self.received_chunks[chunk_index] = data
+    self.memory_bytes += len(data)
+    if spool:
+      self._unspooled.append(chunk_index)
+      self.unspooled_bytes += len(data)
+    self.received_count += 1
+
+  def take_unspooled(self) -> list[tuple[int, bytes]]:
+    """Returns the chunks store_chunk() set aside for the spool file since the last call"""
+    chunks = [(chunk_index, self.received_chunks[chunk_index]) for chunk_index in self._unspooled]
+    self._unspooled = []
+    return chunks
+
+  def write_spool(self, chunks: list[tuple[int, bytes]], spool_path: str) -> list[tuple[int, int, int]]:
+    """Appends `chunks` to the spool file, creating it at `spool_path`. Returns (chunk index, offset, length) of each"""
+    if self._spool is None:
+      self.spool_path = spool_path
+      self._spool = open(spool_path, "w+b")
+    offset = self._spool.seek(0, os.SEEK_END)
+    locations = []
+    for chunk_index, data in chunks:
+      self._spool.write(data)
+      locations.append((chunk_index, offset, len(data)))
+      offset += len(data)
+    return locations
+
+  def spooled(self, locations: list[tuple[int, int, int]]) -> int:
+    """Points the chunks write_spool() wrote at the spool file instead of memory, returning the bytes freed"""
+    freed = 0
+    for chunk_index, offset, length in locations:
+      self.received_chunks[chunk_index] = (offset, length)
+      freed += length
+    self.memory_bytes -= freed
+    self.unspooled_bytes -= freed
+    self.spooled_bytes += freed
+    return freed
+
+  def chunk_data(self, chunk_index: int) -> bytes:
+    chunk = self.received_chunks[chunk_index]
+    if isinstance(chunk, tuple):
+      offset, length = chunk
+      self._spool.seek(offset)
+      return self._spool.read(length)
+    return chunk
+
+  def stored_bytes(self) -> int:
+    return self.memory_bytes + self.spooled_bytes
+
+  def discard(self):
+    """Drops the received chunks, the spool file is left to close_spool()"""
+    self.discarded = True
+    self.received_chunks = {}
+    self._unspooled = []
+    self.unspooled_bytes = 0
+    self.memory_bytes = 0
+    self.spooled_bytes = 0
+
+  def close_spool(self):
+    """Closes and deletes the spool file, if any"""
+    if self._spool is not None:
+      self._spool.close()
+      self._spool = None
+      os.remove(self.spool_path)
+
+  def has_unhashed(self) -> bool:
+    return self._hashed_count < self.total_chunks and self.has_chunk(self._hashed_count)
+
+  def update_digest(self):
+    """Feeds the run of chunks following the last hashed one into the running digest"""
+    while not self.discarded and self.has_unhashed():
+      self._hasher.update(self.chunk_data(self._hashed_count))
+      self._hashed_count += 1
+
+  def verify(self) -> str:
+    """Returns the FILE_RECEIVED status of a complete transfer: VERIFIED, CORRUPTED or COMPLETE (no digest offered)"""
+    if not self.digest:
+      return "COMPLETE"
+    if self._hashed_count != self.total_chunks:
+      raise ValueError(f"Cannot verify {self.filename}: only {self._hashed_count}/{self.total_chunks} chunks hashed")
+    return "VERIFIED" if self._hasher.hexdigest() == self.digest else "CORRUPTED"
+
   def _validate(self):
     if not isinstance(self.filename, str):
       raise ValueError(f"Invalid FileTransfer: filename {self.filename} is not of type str")
@@ -22,6 +158,8 @@ class FileTransfer:
       raise ValueError(f"Invalid FileTransfer: filetype {self.filetype} is not of type str")
     if not isinstance(self.total_chunks, int):
       raise ValueError(f"Invalid FileTransfer: total_chunks {self.total_chunks} is not of type int")
+    if not isinstance(self.digest, str):
+      raise ValueError(f"Invalid FileTransfer: digest {self.digest} is not of type str")
 
   def __eq__(self, other):
     if not isinstance(other, FileTransfer):
@@ -40,7 +178,9 @@ class FileTransfer:
       f"filesize={self.filesize}, "
       f"filetype='{self.filetype}', "
       f"received_chunks='{self.received_count}', "
-      f"total_chunks={self.total_chunks})"
+      f"total_chunks={self.total_chunks}, "
+      f"memory_bytes={self.memory_bytes}, "
+      f"spooled_bytes={self.spooled_bytes})"
     )
 
   def __str__(self):
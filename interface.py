@@ -1,10 +1,16 @@
 import os
 import config
 import inspect
-from custom_types.fields import UserID, Token, Timestamp, TTL
+from custom_types.fields import UserID, Token, Timestamp, TTL, MessageID
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
 from states.file_state import file_state
+from states.transfer_manager import transfer_manager
+from states.game import game_session_manager
+from messages import file_received
+from utils.disk_io import disk_io
+from utils import metrics
+from utils.profiler import profiler
 from client_logger import client_logger
 
 type_parsers = {
@@ -36,8 +42,14 @@ def display_help(valid_commands: list):
   help_prompt.append("\nAdditional Commands:")
   help_prompt.append("info:\t\tshows client details")
   help_prompt.append("recent:\t\tshows received messages")
-  help_prompt.append("accept:\t\taccepts a received file_offer")
-  help_prompt.append("reject:\t\trejects a received file_offer")
+  help_prompt.append("history <groupid> [before]:shows a group's messages before a timestamp (default: newest)")
+  help_prompt.append("accept [fileid]:accepts a received file_offer (default: most recent)")
+  help_prompt.append("reject [fileid]:rejects a received file_offer (default: most recent)")
+  help_prompt.append("transfers:\tlists outgoing and incoming file transfers")
+  help_prompt.append("stats:\t\tshows message counters, latency histograms and queue/state sizes")
+  help_prompt.append("prof_start:\tstarts sampling the stacks of every thread")
+  help_prompt.append("prof_stop:\tstops sampling and writes flame graph/pstats files under PROF_DIR")
+  help_prompt.append("cancel <fileid>:cancels an outgoing or incoming file transfer")
   help_prompt.append("verbose:\ttoggles verbose mode settings")
   help_prompt.append("cls:\t\tclears the screen")
   help_prompt.append("help:\t\tshows available commands")
@@ -61,6 +73,8 @@ def debug_info():
   config_info.append(f"DEFAULT_TTL: {config.DEFAULT_TTL}")
   config_info.append(f"MESSAGES_DIR: {config.MESSAGES_DIR}")
   config_info.append(f"BUFSIZE: {config.BUFSIZE}")
+  config_info.append(f"FILE_COMPRESSION: {config.FILE_COMPRESSION} (level {config.FILE_COMPRESSION_LEVEL})")
+  config_info.append(f"PACING: {config.PACE_PEER_RATE} B/s per peer, {config.PACE_GLOBAL_RATE} B/s global, burst {config.PACE_BURST} B")
 
   client_state_info.append("CLIENT_STATE VARIABLES\n")
   client_state_info.append(f"UserID: {client_state.get_user_id()}")
@@ -73,10 +87,18 @@ def debug_info():
   file_state_info.append(f"Recent: {file_state.get_recent()}")
   file_state_info.append(f"Accepted Files: {file_state.get_accepted_files()}")
   file_state_info.append(f"Pending Transfers: {file_state.get_pending_transfers()}")
+  memory_used, spooled, unspooled = file_state.get_memory_usage()
+  file_state_info.append(f"Saving: {list(file_state.get_saving_transfers().keys())} ({disk_io.pending()} queued for disk I/O)")
+  file_state_info.append(f"Transfer Memory: {memory_used}/{config.TRANSFER_MEMORY_BUDGET} bytes, {spooled} bytes spooled to disk, {unspooled} waiting to be spooled")
 
   client_logger.info(format_prompt(config_info))
   client_logger.info(format_prompt(client_state_info))
   client_logger.info(format_prompt(file_state_info))
+
+  game_info = ["GAME_STATE VARIABLES\n"]
+  counts = game_session_manager.get_session_counts()
+  game_info.append(f"Sessions: {counts['active']} active, {counts['finished']} finished, {counts['reaped']} reaped")
+  client_logger.info(format_prompt(game_info))
   
 def toggle_verbose():
   if config.VERBOSE:
@@ -89,7 +111,9 @@ def toggle_verbose():
 
 def get_command(valid_msg_commands: list):
   while True:
-    command = input().upper().strip()
+    parts = input().strip().split()
+    command = parts[0].upper() if parts else ""
+    args = parts[1:]
     if command in valid_msg_commands:
       return command
     elif command == "":
@@ -104,14 +128,41 @@ def get_command(valid_msg_commands: list):
       show_client_details()
     elif command == "RECENT":
       show_recent_messages()
+    elif command == "HISTORY":
+      try:
+        show_group_history(args)
+      except Exception as e:
+        client_logger.warn(e)
     elif command == "ACCEPT":
       try:
-        file_state.accept_file()
+        file_state.accept_file(parse_file_id(args))
       except Exception as e:
         client_logger.warn(e)
     elif command == "REJECT":
       try:
-        file_state.reject_file()
+        file_state.reject_file(parse_file_id(args))
+      except Exception as e:
+        client_logger.warn(e)
+    elif command == "TRANSFERS":
+      show_transfers()
+    elif command == "STATS":
+      show_stats()
+    elif command == "PROF_START":
+      try:
+        profiler.start()
+      except Exception as e:
+        client_logger.warn(e)
+    elif command == "PROF_STOP":
+      try:
+        profiler.stop()
+      except Exception as e:
+        client_logger.warn(e)
+    elif command == "CANCEL":
+      try:
+        file_id = parse_file_id(args)
+        if file_id is None:
+          raise ValueError("Usage: cancel <fileid>")
+        cancel_transfer(file_id)
       except Exception as e:
         client_logger.warn(e)
     elif command == "DEBUG":
@@ -145,6 +196,89 @@ def show_recent_messages():
   client_logger.info("Recent Messages received:")
   client_logger.info(format_prompt(recent_received))
 
+def show_group_history(args: list):
+  if not args:
+    raise ValueError("Usage: history <groupid> [before]")
+  group_id = args[0]
+  before = int(args[1]) if len(args) > 1 else None
+  page = client_state.get_group_history(group_id, before, config.GROUP_HISTORY_PAGE)
+  lines = [f"[{timestamp}] {message.info(config.VERBOSE)}" for timestamp, message in page]
+  client_logger.info(f"History of group {group_id}:")
+  client_logger.info(format_prompt(lines))
+  if len(page) >= config.GROUP_HISTORY_PAGE:
+    client_logger.info(f"Older messages: history {group_id} {page[0][0]}")
+
+def parse_file_id(args: list):
+  """Returns the FILEID given as the first command argument, or None to use the most recent offer"""
+  if not args:
+    return None
+  return MessageID.parse(args[0].lower())
+
+def cancel_transfer(file_id: MessageID):
+  """Cancels an incoming or outgoing transfer and tells the peer, so it drops the transfer too"""
+  peer = file_state.cancel_incoming(file_id)
+  if peer is not None:
+    client_logger.info(f"Cancelled incoming file transfer {file_id}")
+  else:
+    peer = transfer_manager.cancel(file_id)
+  file_received.send_status(peer, file_id, "CANCELLED")
+
+def show_transfers():
+  outgoing = []
+  incoming = []
+  for transfer in transfer_manager.get_transfers():
+    outgoing.append(f"{transfer}")
+  for file_id, transfer in list(file_state.get_pending_transfers().items()):
+    accepted = "accepted" if file_state.is_file_accepted(file_id) else "awaiting accept"
+    incoming.append(
+      f"{file_id} {transfer.filename} <- {transfer.from_user}: "
+      f"{transfer.received_count}/{transfer.total_chunks} chunks, {accepted}"
+    )
+  client_logger.info("Outgoing Transfers:")
+  client_logger.info(format_prompt(outgoing))
+  client_logger.info("Incoming Transfers:")
+  client_logger.info(format_prompt(incoming))
+
+def format_seconds(seconds: float) -> str:
+  if seconds == float("inf"):
+    return "inf"
+  return f"{seconds * 1000:.2f}ms"
+
+def show_stats():
+  counter_lines = ["MESSAGES (received / sent / retransmitted / dropped)\n"]
+  received = metrics.messages_received.values()
+  sent = metrics.messages_sent.values()
+  retransmitted = metrics.messages_retransmitted.values()
+  dropped = {}
+  drop_reasons = {}
+  for (msg_type, reason), count in metrics.messages_dropped.values().items():
+    dropped[msg_type] = dropped.get(msg_type, 0) + count
+    drop_reasons[reason] = drop_reasons.get(reason, 0) + count
+  for msg_type in sorted(set(received) | set(sent) | set(retransmitted) | set(dropped)):
+    counter_lines.append(
+      f"{msg_type}: {received.get(msg_type, 0)} / {sent.get(msg_type, 0)} / "
+      f"{retransmitted.get(msg_type, 0)} / {dropped.get(msg_type, 0)}"
+    )
+  if drop_reasons:
+    counter_lines.append(f"\nDropped by reason: {drop_reasons}")
+
+  histogram_lines = ["LATENCY (count, avg, p50, p99)\n"]
+  for histogram in metrics.metrics.get_histograms():
+    for labels, (buckets, total, count) in sorted(histogram.snapshot().items()):
+      name = f"{histogram.name}{{{labels}}}" if labels else histogram.name
+      histogram_lines.append(
+        f"{name}: {count}, {format_seconds(total / count)}, "
+        f"{format_seconds(histogram.quantile(buckets, count, 0.5))}, {format_seconds(histogram.quantile(buckets, count, 0.99))}"
+      )
+
+  gauge_lines = ["GAUGES\n"]
+  for gauge in metrics.metrics.get_gauges():
+    gauge_lines.append(f"{gauge.name}: {gauge.value()}")
+
+  client_logger.info(format_prompt(counter_lines))
+  client_logger.info(format_prompt(histogram_lines))
+  client_logger.info(format_prompt(gauge_lines))
+
 def show_client_details():
   client_logger.info(f"UserID: {client_state.get_user_id()}")
   client_logger.info(f"Using port: {config.PORT}")
@@ -2,6 +2,7 @@ from custom_types.fields import MessageID
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
 from utils import msg_format
+from utils.metrics import ack_timer
 import socket
 
 class Ack(BaseMessage):
@@ -11,20 +12,26 @@ class Ack(BaseMessage):
         "TYPE": TYPE,
         "MESSAGE_ID": {"type": MessageID, "required": True},
         "STATUS": {"type": str, "required": True},
+        "FEATURES": {"type": str, "required": False},
     }
 
     @property
     def payload(self) -> dict:
-        return {
+        payload = {
             "TYPE": self.TYPE,
             "MESSAGE_ID": self.message_id,
             "STATUS": self.status,
         }
+        # Only present when acknowledging an offer that advertised FEATURES
+        if self.features:
+            payload["FEATURES"] = self.features
+        return payload
 
-    def __init__(self, message_id: str, status: str = "RECEIVED"):
+    def __init__(self, message_id: str, status: str = "RECEIVED", features: str = ""):
         self.type = self.TYPE
         self.message_id = message_id
         self.status = status
+        self.features = features
 
     @classmethod
     def parse(cls, data: dict) -> "Ack":
@@ -32,6 +39,7 @@ class Ack(BaseMessage):
         new_obj.type = data["TYPE"]
         new_obj.message_id = MessageID.parse(data["MESSAGE_ID"])
         new_obj.status = data["STATUS"]
+        new_obj.features = data.get("FEATURES", "")
 
         msg_format.validate_message(new_obj.payload, new_obj.__schema__)
         return new_obj
@@ -46,6 +54,7 @@ class Ack(BaseMessage):
         received = cls.parse(msg_format.deserialize_message(raw))
         if client_state.get_message_by_id(received.message_id) == None:
             raise ValueError("MessageID unknown for ACK")
+        ack_timer.acked(received.message_id)
         return received
     
     def info(self, verbose: bool = False) -> str:
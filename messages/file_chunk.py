@@ -3,8 +3,10 @@ from custom_types.base_message import BaseMessage
 from states.client_state import client_state
 from states.file_state import file_state
 from client_logger import client_logger
-from messages.file_received import FileReceived
+from messages.file_received import send_status
+from messages.file_resend import FileResend
 from utils import msg_format
+from utils.msg_file_transfer import ChunkFramer, BinaryChunkFramer, BINARY_CHUNK_HEADER
 import socket
 import base64
 import client
@@ -14,6 +16,7 @@ class FileChunk(BaseMessage):
     TYPE = "FILE_CHUNK"
     SCOPE = Token.Scope.FILE
     __hidden__ = True
+    __frame__ = 0x01  # binary frame kind, used when both peers negotiated the BINARY feature
     __schema__ = {
         "TYPE": TYPE,
         "FROM": {"type": UserID, "required": True},
@@ -23,12 +26,13 @@ class FileChunk(BaseMessage):
         "TOTAL_CHUNKS": {"type": int, "required": True},
         "CHUNK_SIZE": {"type": int, "required": True},
         "TOKEN": {"type": Token, "required": True},
+        "CRC": {"type": str, "required": False},
         "DATA": {"type": str, "required": True}
     }
 
     @property
     def payload(self) -> dict:
-        return {
+        payload = {
             "TYPE": self.TYPE,
             "FROM": self.from_user,
             "TO": self.to_user,
@@ -36,12 +40,16 @@ class FileChunk(BaseMessage):
             "CHUNK_INDEX": self.chunk_index,
             "TOTAL_CHUNKS": self.total_chunks,
             "CHUNK_SIZE": self.chunk_size,
-            "TOKEN": self.token,
-            "DATA": self.data
+            "TOKEN": self.token
         }
+        # Only sent when the receiver accepted the CRC feature
+        if self.crc is not None:
+            payload["CRC"] = f"{self.crc:08x}"
+        payload["DATA"] = self.data
+        return payload
 
     def __init__(self, to: UserID, fileid: MessageID, chunk_index: int, total_chunks: int, 
-                 chunk_size: int, token: Token, data: bytes):
+                 chunk_size: int, token: Token, data: bytes, crc: int = None):
         self.type = self.TYPE
         self.from_user = client_state.get_user_id()
         self.to_user = to
@@ -50,6 +58,7 @@ class FileChunk(BaseMessage):
         self.total_chunks = total_chunks
         self.chunk_size = chunk_size
         self.token = token
+        self.crc = crc
         self.data = base64.b64encode(data).decode('utf-8')
 
     @classmethod
@@ -63,12 +72,49 @@ class FileChunk(BaseMessage):
         new_obj.total_chunks = int(data["TOTAL_CHUNKS"])
         new_obj.chunk_size = int(data["CHUNK_SIZE"])
         new_obj.token = Token.parse(data["TOKEN"])
+        new_obj.crc = int(data["CRC"], 16) if "CRC" in data else None
         new_obj.data = data["DATA"]
 
         Token.validate_token(new_obj.token, expected_scope=cls.SCOPE, expected_user_id=new_obj.from_user)
         msg_format.validate_message(new_obj.payload, new_obj.__schema__)
         return new_obj
 
+    @classmethod
+    def framer(cls, to: UserID, fileid: MessageID, total_chunks: int, chunk_size: int,
+               token: Token, encoding: str = "utf-8", crc: bool = False) -> ChunkFramer:
+        """
+        Returns a ChunkFramer that produces the same wire format as send() for every chunk of one file,
+        serializing the fields shared by all chunks only once.
+        """
+        index_slot, data_slot, crc_slot = "\x00", "\x01", "\x02"
+        fields = {
+            "TYPE": cls.TYPE,
+            "FROM": client_state.get_user_id(),
+            "TO": to,
+            "FILEID": fileid,
+            "CHUNK_INDEX": index_slot,
+            "TOTAL_CHUNKS": total_chunks,
+            "CHUNK_SIZE": chunk_size,
+            "TOKEN": token
+        }
+        if crc:
+            fields["CRC"] = crc_slot
+        fields["DATA"] = data_slot
+        template = msg_format.serialize_message(fields)
+        head, rest = template.split(index_slot)
+        middle, tail = rest.split(data_slot)
+        crc_middle = None
+        if crc:
+            middle, crc_middle = middle.split(crc_slot)
+            crc_middle = crc_middle.encode(encoding)
+        return ChunkFramer(head.encode(encoding), middle.encode(encoding), tail.encode(encoding),
+                           total_chunks, chunk_size, crc_middle)
+
+    @classmethod
+    def binary_framer(cls, handle: int, total_chunks: int, chunk_size: int) -> BinaryChunkFramer:
+        """Returns a BinaryChunkFramer for a transfer whose receiver accepted the BINARY feature"""
+        return BinaryChunkFramer(msg_format.BINARY_MAGIC, cls.__frame__, handle, total_chunks, chunk_size)
+
     def send(self, socket: socket.socket, ip: str="default", port: int=50999, encoding: str="utf-8") -> tuple[str, int]:
         if ip == "default":
             ip = self.to_user.get_ip()
@@ -79,21 +125,53 @@ class FileChunk(BaseMessage):
         received = cls.parse(msg_format.deserialize_message(raw))
         if received.to_user != client_state.get_user_id():
             raise ValueError("Message is not intended for this client")
+        return cls._store(received)
+
+    @classmethod
+    def receive_frame(cls, raw: bytes, address: tuple[str, int]) -> "FileChunk":
+        """
+        Receives a binary chunk frame. The frame only carries a transfer handle, so the sender,
+        token and file id are taken from the FILE_OFFER that registered the handle.
+        """
+        _, _, handle, chunk_index, total_chunks, crc = BINARY_CHUNK_HEADER.unpack_from(raw)
+        fileid, transfer = file_state.get_transfer_by_handle(handle)
+        if address[0] != transfer.from_user.get_ip():
+            raise ValueError(f"Binary chunk for {fileid} received from unexpected address {address[0]}")
+        Token.validate_token(transfer.token, expected_scope=cls.SCOPE, expected_user_id=transfer.from_user)
+
+        received = cls.__new__(cls)
+        received.type = cls.TYPE
+        received.from_user = transfer.from_user
+        received.to_user = client_state.get_user_id()
+        received.fileid = fileid
+        received.chunk_index = chunk_index
+        received.total_chunks = total_chunks
+        received.chunk_size = len(raw) - BINARY_CHUNK_HEADER.size
+        received.token = transfer.token
+        received.crc = crc if "CRC" in transfer.features else None
+        received.data = raw[BINARY_CHUNK_HEADER.size:]
+        return cls._store(received)
 
-        # Add chunk and check if complete
+    @classmethod
+    def _store(cls, received: "FileChunk") -> "FileChunk":
+        # Add chunk, FILE_RECEIVED is sent once a disk I/O worker has verified the complete file
         is_complete = file_state.add_chunk(
             received.fileid,
             received.chunk_index,
             received.data,
-            received.total_chunks
+            received.total_chunks,
+            received.crc,
+            send_status
         )
 
+        corrupt_chunks = file_state.pop_corrupt_chunks(received.fileid)
+        if corrupt_chunks:
+            client.initialize_sockets(config.PORT)
+            resend = FileResend(received.from_user, received.fileid, ",".join(str(i) for i in corrupt_chunks))
+            resend.send(client.get_unicast_socket())
+
         if is_complete:
             client_logger.debug(f"ALL CHUNKS RECEIVED")
-            client.initialize_sockets(config.PORT)
-            socket = client.get_unicast_socket()
-            new_msg = FileReceived(received.to_user, received.fileid)
-            new_msg.send(socket)
 
         return received
 
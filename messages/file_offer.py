@@ -3,21 +3,29 @@ from custom_types.fields import UserID, Token, Timestamp, TTL, MessageID
 from custom_types.file_transfer import FileTransfer
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
-from utils.msg_file_transfer import chunk_file, get_file_info
+from utils.msg_file_transfer import read_chunks_into, read_chunk, get_file_info, file_digest, transfer_handle, is_compressible, compress_chunk
 from utils import msg_format
 import socket
 from client_logger import client_logger
 from states.file_state import file_state
+from states.transfer_manager import transfer_manager
+from utils.pacer import pacer
+from utils.metrics import messages_sent, messages_retransmitted, ack_timer
+from typing import Generator
 from messages.ack import Ack
 from messages.file_chunk import FileChunk
 import time
 import math
+import zlib
+import threading
 import config
 import client
 
 class FileOffer(BaseMessage):
     TYPE = "FILE_OFFER"
     SCOPE = Token.Scope.FILE
+    # Optional transfer features this client can negotiate through FEATURES in FILE_OFFER and its ACK
+    SUPPORTED_FEATURES = ["BINARY", "ZLIB", "CRC"]
     __hidden__ = False
     __schema__ = {
         "TYPE": TYPE,
@@ -29,7 +37,9 @@ class FileOffer(BaseMessage):
         "FILEID": {"type": MessageID, "required": True},
         "DESCRIPTION": {"type": str, "required": True},
         "TIMESTAMP": {"type": Timestamp, "required": True},
-        "TOKEN": {"type": Token, "required": True}
+        "TOKEN": {"type": Token, "required": True},
+        "FEATURES": {"type": str, "required": False},
+        "DIGEST": {"type": str, "required": False}  # SHA-256 of the whole file
     }
 
     @property
@@ -46,6 +56,11 @@ class FileOffer(BaseMessage):
             "TIMESTAMP": self.timestamp,
             "TOKEN": self.token
         }
+        # Extension fields are omitted for peers that don't understand them, see send()
+        if self.features:
+            payload["FEATURES"] = self.features
+            if self.digest:
+                payload["DIGEST"] = self.digest
         return payload
 
     def __init__(self, to: UserID, filepath: str, description: str = " ", chunk_size: int = 256, ttl: TTL = 3600):
@@ -65,6 +80,7 @@ class FileOffer(BaseMessage):
         self.filename = filename
         self.filesize = filesize
         self.filetype = filetype
+        self.digest = ""  # hashing a large file takes a while, negotiate() does it on a transfer worker
         self.total_chunks = math.ceil(self.filesize / self.chunk_size)
         self.fileid = MessageID.generate()
         if description == " ":
@@ -73,6 +89,11 @@ class FileOffer(BaseMessage):
             self.description = description
         self.timestamp = Timestamp(unix_now)
         self.token = Token(self.from_user, self.timestamp + ttl, self.SCOPE)
+        features = list(self.SUPPORTED_FEATURES)
+        if not (config.FILE_COMPRESSION and is_compressible(self.filename, self.filetype)):
+            client_logger.debug(f"Not offering compression for {self.filename} ({self.filetype})")
+            features.remove("ZLIB")
+        self.features = ",".join(features)
 
     @classmethod
     def parse(cls, data: dict) -> "FileOffer":
@@ -87,6 +108,8 @@ class FileOffer(BaseMessage):
         new_obj.description = data.get("DESCRIPTION", "")
         new_obj.timestamp = Timestamp.parse(int(data["TIMESTAMP"]))
         new_obj.token = Token.parse(data["TOKEN"])
+        new_obj.features = data.get("FEATURES", "")
+        new_obj.digest = data.get("DIGEST", "")
         new_obj.filepath = None
         
         Token.validate_token(new_obj.token, expected_scope=cls.SCOPE, expected_user_id=new_obj.from_user)
@@ -94,16 +117,25 @@ class FileOffer(BaseMessage):
         return new_obj
 
     def send(self, socket: socket.socket, ip: str="default", port: int=50999, encoding: str="utf-8") -> tuple[str, int]:
+        """Hands the offer to the transfer manager, which negotiates and streams it without blocking the caller"""
         if ip == "default":
             ip = self.to_user.get_ip()
+        transfer_manager.submit(self, socket, ip, port, encoding)
+        return (ip, port)
 
+    def negotiate(self, socket: socket.socket, ip: str, port: int=50999, encoding: str="utf-8") -> bool:
+        """Sends the offer until it is acknowledged. Returns False if the receiver never sent an ACK"""
         retries = 0
-        dest = ("failed", port)
+        if not self.digest:
+            self.digest = file_digest(self.filepath)
         client_logger.process(f"Waiting for {self.to_user}")
         client_state.add_recent_message_sent(self)
         while retries < 3:
             # Send message
-            dest = super().send(socket, ip, port, encoding)
+            super().send(socket, ip, port, encoding)
+            ack_timer.sent(self.fileid, self.TYPE)
+            if retries > 0:
+                messages_retransmitted.inc(self.TYPE)
             client_logger.debug(f"Send file_offer {self.fileid}, attempt {retries + 1}")
 
             # Wait a bit for ACK
@@ -113,30 +145,87 @@ class FileOffer(BaseMessage):
             if client_state.get_ack_message(self.fileid) is not None:
                 client_logger.debug(f"Received ACK for file {self.fileid}")
                 break
-
             retries += 1
-        if client_state.get_ack_message(self.fileid) is None:
+        ack = client_state.get_ack_message(self.fileid)
+        if ack is None:
             client_logger.warn(f"No ACK received for file {self.fileid} after {retries} attempts.")
             client_logger.warn(f"Aborting FILE_OFFER.")
             client_state.remove_recent_message_sent(self)
-            return dest
+            return False
+
+        self._prepare_chunks(msg_format.string_to_list(ack.features), encoding)
+        file_state.add_outgoing_transfer(self.fileid, self)
+        return True
 
+    def stream_chunks(self, port: int=50999) -> Generator[int, None, None]:
+        """Sends the file one chunk per iteration, yielding the payload bytes put on the wire for that chunk"""
         client.initialize_sockets(config.PORT)
         client_logger.process(f"Sending file chunks to {self.to_user}...")
         start_time = time.time()
         prev_time = start_time
-        for i, chunk in enumerate(chunk_file(self.filepath, self.chunk_size)):
-            chunk_msg = FileChunk(self.to_user, self.fileid, i, self.total_chunks, self.chunk_size, self.token, chunk)
-            chunk_msg.send(client.get_unicast_socket())
-            client_logger.debug(f"Sent chunk {i+1}/{self.total_chunks}")
-            client_logger.send(f"{chunk_msg.payload}")
+        chunk_socket = client.get_unicast_socket()
+        chunk_dest = (self.to_user.get_ip(), port)
+        wire_bytes = 0
+        for i, chunk in enumerate(read_chunks_into(self.filepath, self.chunk_size)):
+            sent = self._send_chunk(chunk_socket, chunk_dest, i, chunk)
+            wire_bytes += sent
+            client_logger.debug("Sent chunk {0}/{1}", i + 1, self.total_chunks)
             current_time = time.time()
             if current_time - prev_time >= 3:
-                client_logger.process(f"completion {(i / self.total_chunks) * 100:.2f}%...")
+                client_logger.process(f"{self.filename}: completion {(i / self.total_chunks) * 100:.2f}%...")
                 prev_time = current_time
-        client_logger.success(f"Sent all {self.total_chunks} chunks to {self.to_user}!")
+            yield sent
+        client_logger.success(f"Sent all {self.total_chunks} chunks of {self.filename} to {self.to_user}!")
+        if self._compress and wire_bytes > 0:
+            # At the measured wire rate, the uncompressed file would have taken filesize / rate to send
+            elapsed = time.time() - start_time
+            saved = elapsed * (self.filesize / wire_bytes - 1)
+            client_logger.info(
+                f"Compressed {self.filesize} -> {wire_bytes} bytes (ratio {self.filesize / wire_bytes:.2f}x), "
+                f"sent in {elapsed:.2f}s, est. {saved:.2f}s saved"
+            )
+
+    def abort(self):
+        """Stops serving FILE_RESEND requests for a cancelled or failed transfer"""
+        file_state.remove_outgoing_transfer(self.fileid)
+
+    def _prepare_chunks(self, features: list[str], encoding: str):
+        """Sets up chunk framing for the features the receiver accepted in its ACK"""
+        self._compress = "ZLIB" in features
+        self._crc = "CRC" in features
+        self._send_lock = threading.Lock()  # the framer buffer is shared with resend_chunks()
+        if "BINARY" in features:
+            client_logger.debug(f"Using binary chunk frames for file {self.fileid}")
+            self._framer = FileChunk.binary_framer(transfer_handle(self.fileid), self.total_chunks, self.chunk_size)
+        else:
+            self._framer = FileChunk.framer(self.to_user, self.fileid, self.total_chunks, self.chunk_size,
+                                            self.token, encoding, self._crc)
 
-        return dest
+    def _send_chunk(self, socket: socket.socket, dest: tuple[str, int], chunk_index: int, chunk) -> int:
+        """Frames and sends one chunk, returning the number of payload bytes put on the wire"""
+        crc = zlib.crc32(chunk) if self._crc else None
+        if self._compress:
+            chunk = compress_chunk(chunk, config.FILE_COMPRESSION_LEVEL)
+        with self._send_lock:
+            datagram = self._framer.frame(chunk_index, chunk, crc)
+            socket.sendto(datagram, dest)
+            pacer.consume(dest[0], len(datagram))
+        messages_sent.inc(FileChunk.TYPE)
+        return len(chunk)
+
+    def resend_chunks(self, socket: socket.socket, chunk_indexes: list[int], port: int = 50999):
+        """
+        Sends the requested chunks again, in answer to a FILE_RESEND from the receiver.
+        Runs on a transfer worker (see TransferManager.resend) and waits on the pacer like the first send.
+        """
+        dest = (self.to_user.get_ip(), port)
+        for chunk_index in chunk_indexes:
+            if file_state.get_outgoing_transfer(self.fileid) is None:
+                return  # cancelled or failed meanwhile
+            while (delay := pacer.delay(dest[0])) > 0:
+                time.sleep(delay)
+            self._send_chunk(socket, dest, chunk_index, read_chunk(self.filepath, chunk_index, self.chunk_size))
+            messages_retransmitted.inc(FileChunk.TYPE)
 
     @classmethod
     def receive(cls, raw: str) -> "FileOffer":
@@ -144,13 +233,20 @@ class FileOffer(BaseMessage):
         if received.to_user != client_state.get_user_id():
             raise ValueError("Message is not intended to be received by this client")
     
+        # Accept the offered features this client also supports
+        features = [f for f in msg_format.string_to_list(received.features) if f in cls.SUPPORTED_FEATURES]
+        new_transfer = FileTransfer(received.filename, received.filesize, received.filetype,
+                                    from_user=received.from_user, token=received.token, features=features,
+                                    digest=received.digest)
+        file_state.add_pending_transfer(received.fileid, new_transfer)
+        if "BINARY" in features and not file_state.register_handle(transfer_handle(received.fileid), received.fileid):
+            client_logger.debug(f"Transfer handle for {received.fileid} in use, falling back to text chunks")
+            features.remove("BINARY")
+
         client.initialize_sockets(config.PORT)
-        ack = Ack(message_id=received.fileid)
+        ack = Ack(message_id=received.fileid, features=",".join(features))
         dest = ack.send(socket=client.get_unicast_socket(), ip=received.from_user.get_ip(), port=config.PORT)
         client_logger.debug(f"ACK SENT TO {dest}")
-        
-        new_transfer = FileTransfer(received.filename, received.filesize, received.filetype)
-        file_state.add_pending_transfer(received.fileid, new_transfer)
 
         return received
 
@@ -2,8 +2,13 @@ from datetime import datetime, timezone
 from custom_types.fields import UserID, Timestamp, MessageID
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
+from states.file_state import file_state
+from states.transfer_manager import transfer_manager
+from client_logger import client_logger
 from utils import msg_format
 import socket
+import client
+import config
 
 class FileReceived(BaseMessage):
     TYPE = "FILE_RECEIVED"
@@ -60,11 +65,46 @@ class FileReceived(BaseMessage):
         received = cls.parse(msg_format.deserialize_message(raw))
         if received.to_user != client_state.get_user_id():
             raise ValueError("Message is not intended to be received by this client")
+
+        # CANCELLED comes from either side of a transfer that the peer stopped, both sides then drop it
+        if received.status == "CANCELLED":
+            cls._cancelled(received)
+            return received
+        # STATUS is VERIFIED when the receiver matched the offered DIGEST, COMPLETE when no digest was checked
+        if received.status == "CORRUPTED":
+            client_logger.warn(f"{received.from_user} received file {received.fileid} but it failed the integrity check")
+        else:
+            client_logger.success(f"{received.from_user} received file {received.fileid} ({received.status})")
+        file_state.remove_outgoing_transfer(received.fileid)
         return received
 
+    @classmethod
+    def _cancelled(cls, received: "FileReceived"):
+        if file_state.cancel_incoming(received.fileid, received.from_user) is not None:
+            client_logger.warn(f"{received.from_user} cancelled sending file {received.fileid}")
+            return
+        offer = file_state.get_outgoing_transfer(received.fileid)
+        if offer is None or offer.to_user != received.from_user:
+            raise ValueError(f"No transfer {received.fileid} with {received.from_user} to cancel")
+        try:
+            transfer_manager.cancel(received.fileid)
+        except ValueError:
+            pass  # every chunk was already sent, only FILE_RESEND was still being served
+        file_state.remove_outgoing_transfer(received.fileid)
+        client_logger.warn(f"{received.from_user} cancelled receiving file {received.fileid}")
+
     def info(self, verbose: bool = False) -> str:
         if verbose:
             return f"{self.payload}"
         return ""  # Don't print anything as per spec
 
+def send_status(to: UserID, fileid: MessageID, status: str):
+    """
+    Tells the other side of transfer `fileid` how it ended. CANCELLED makes it free its state too.
+    Also passed to FileState.add_chunk, which calls it from a disk I/O worker once the file is verified.
+    """
+    client.initialize_sockets(config.PORT)
+    FileReceived(to, fileid, status).send(client.get_unicast_socket())
+
+
 __message__ = FileReceived
\ No newline at end of file
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+from custom_types.fields import UserID, Token, Timestamp, MessageID, TTL
+from custom_types.base_message import BaseMessage
+from states.client_state import client_state
+from states.file_state import file_state
+from states.transfer_manager import transfer_manager
+from client_logger import client_logger
+from utils import msg_format
+import socket
+import client
+import config
+
+class FileResend(BaseMessage):
+    """
+    Sent by the receiver of a file to request chunks again, e.g. when they failed their CRC check.
+    """
+
+    TYPE = "FILE_RESEND"
+    SCOPE = Token.Scope.FILE
+    __hidden__ = True
+    __schema__ = {
+        "TYPE": TYPE,
+        "FROM": {"type": UserID, "required": True},
+        "TO": {"type": UserID, "required": True},
+        "FILEID": {"type": MessageID, "required": True},
+        "CHUNKS": {"type": str, "required": True},  # comma-separated chunk indexes
+        "TIMESTAMP": {"type": Timestamp, "required": True},
+        "TOKEN": {"type": Token, "required": True}
+    }
+
+    @property
+    def payload(self) -> dict:
+        return {
+            "TYPE": self.TYPE,
+            "FROM": self.from_user,
+            "TO": self.to_user,
+            "FILEID": self.fileid,
+            "CHUNKS": self.chunks,
+            "TIMESTAMP": self.timestamp,
+            "TOKEN": self.token
+        }
+
+    def __init__(self, to: UserID, fileid: MessageID, chunks: str, ttl: TTL = 3600):
+        unix_now = int(datetime.now(timezone.utc).timestamp())
+        self.type = self.TYPE
+        self.from_user = client_state.get_user_id()
+        self.to_user = to
+        self.fileid = fileid
+        self.chunks = chunks
+        self.timestamp = Timestamp(unix_now)
+        self.token = Token(self.from_user, self.timestamp + ttl, self.SCOPE)
+
+    @classmethod
+    def parse(cls, data: dict) -> "FileResend":
+        new_obj = cls.__new__(cls)
+        new_obj.type = data["TYPE"]
+        new_obj.from_user = UserID.parse(data["FROM"])
+        new_obj.to_user = UserID.parse(data["TO"])
+        new_obj.fileid = MessageID.parse(data["FILEID"])
+        new_obj.chunks = str(data["CHUNKS"])
+        new_obj.timestamp = Timestamp.parse(int(data["TIMESTAMP"]))
+        new_obj.token = Token.parse(data["TOKEN"])
+
+        Token.validate_token(new_obj.token, expected_scope=cls.SCOPE, expected_user_id=new_obj.from_user)
+        msg_format.validate_message(new_obj.payload, new_obj.__schema__)
+        return new_obj
+
+    def send(self, socket: socket.socket, ip: str="default", port: int=50999, encoding: str="utf-8") -> tuple[str, int]:
+        if ip == "default":
+            ip = self.to_user.get_ip()
+        return super().send(socket, ip, port, encoding)
+
+    @classmethod
+    def receive(cls, raw: str) -> "FileResend":
+        received = cls.parse(msg_format.deserialize_message(raw))
+        if received.to_user != client_state.get_user_id():
+            raise ValueError("Message is not intended to be received by this client")
+
+        offer = file_state.get_outgoing_transfer(received.fileid)
+        if offer is None:
+            raise ValueError(f"No outgoing transfer {received.fileid} to resend chunks from")
+        if offer.to_user != received.from_user:
+            raise ValueError(f"{received.from_user} is not the receiver of {received.fileid}")
+
+        # Each index is resent at most once per request, and all of them must belong to the file
+        chunk_indexes = list(dict.fromkeys(int(i) for i in msg_format.string_to_list(received.chunks)))
+        for chunk_index in chunk_indexes:
+            if not (0 <= chunk_index < offer.total_chunks):
+                raise ValueError(f"Chunk index {chunk_index} out of range for file {received.fileid}")
+        client_logger.debug(f"Resending chunks {chunk_indexes} of {received.fileid} to {received.from_user}")
+        client.initialize_sockets(config.PORT)
+        transfer_manager.resend(offer, client.get_unicast_socket(), chunk_indexes, config.PORT)
+        return received
+
+    def info(self, verbose: bool = False) -> str:
+        if verbose:
+            return f"{self.payload}"
+        return ""
+
+__message__ = FileResend
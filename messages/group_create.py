@@ -12,6 +12,7 @@ from custom_types.base_message import BaseMessage
 from custom_types.fields import UserID, Token, Timestamp, TTL
 from datetime import datetime, timezone
 from utils import msg_format
+from utils.metrics import messages_sent
 from client_logger import client_logger
 
 
@@ -117,6 +118,7 @@ class GroupCreate(BaseMessage):
                     uid = UserID.parse(str(uid))
                 dst_ip = uid.get_ip()
                 socket.sendto(msg.encode(encoding), (dst_ip, port))
+                messages_sent.inc(self.TYPE)
                 client_logger.debug(f"Sent GROUP_CREATE to {uid} at {dst_ip}:{port}")
                 last_ip = dst_ip
             except Exception as e:
@@ -130,13 +132,13 @@ class GroupCreate(BaseMessage):
     def receive(cls, raw: str) -> "GroupCreate":
         """
         If the receiver is in MEMBERS → create and store full group in _groups.
-        If not → only store group_id in _group_ids.
+        If not → only remember group_id as known.
         DROP if group_id already known (idempotent / uniqueness).
         """
         received = cls.parse(msg_format.deserialize_message(raw))
 
         # 1) Drop duplicates (already known group_id)
-        if received.group_id in client_state.get_group_ids():
+        if client_state.is_known_group_id(received.group_id):
             client_logger.debug(f"Ignoring GROUP_CREATE '{received.group_id}': group_id already known")
             return received
 
@@ -4,6 +4,7 @@ from custom_types.fields import UserID, Token, Timestamp, MessageID, TTL
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
 from utils import msg_format
+from utils.metrics import messages_sent
 from client_logger import client_logger
 
 class GroupMessage(BaseMessage):
@@ -72,25 +73,24 @@ class GroupMessage(BaseMessage):
     def send(self, socket: socket.socket, ip: str = "default", port: int = 50999, encoding: str = "utf-8"):
         """Send the group message to all members of the group"""
         # Get the group members
-        group = client_state.get_group(self.group_id)
-        if not group:
+        members = client_state.get_group_members(self.group_id)
+        if not members:
             client_logger.error(f"Cannot send message: Group '{self.group_id}' does not exist")
             return (ip, port)
 
-        msg = msg_format.serialize_message(self.payload)
+        data = msg_format.serialize_message(self.payload).encode(encoding)
         # Send to all group members except self
-        for member in group["members"]:
+        for member in members:
             if member != self.from_user:
                 try:
-                    # Extract IP address from UserID (format is username@ip)
-                    member_ip = str(member).split('@')[1]
-                    socket.sendto(msg.encode(encoding), (member_ip, port))
-                    client_logger.debug(f"Sent group message to member {member} at {member_ip}:{port}")
+                    socket.sendto(data, (member.get_ip(), port))
+                    messages_sent.inc(self.TYPE)
+                    client_logger.debug(f"Sent group message to member {member} at {member.get_ip()}:{port}")
                 except Exception as e:
                     client_logger.error(f"Error sending to {member}: {str(e)}")
 
-        # Add to client state's recent messages
-        client_state.add_recent_message_sent(self)
+        # The main loop records it as a recent message sent, the group keeps its own history
+        client_state.add_group_history(self)
         return (ip, port)
 
     @classmethod
@@ -101,7 +101,7 @@ class GroupMessage(BaseMessage):
         # Verify the group exists and receiving user is a member
         current_user = client_state.get_user_id()
         if client_state.is_group_member(received.group_id, current_user):
-            client_state.add_recent_message_received(received)
+            client_state.add_group_history(received)
             client_logger.debug(f"Received group message in group {received.group_id} from {received.from_user}")
         else:
             client_logger.debug(f"Dropped message: Not a member of group {received.group_id}")
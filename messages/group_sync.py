@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from custom_types.fields import UserID, Token, Timestamp, TTL
+from custom_types.base_message import BaseMessage
+from states.client_state import client_state
+from client_logger import client_logger
+from utils import msg_format
+from messages.group_sync_request import request_sync
+import socket
+
+
+class GroupSync(BaseMessage):
+    """
+    Answers a GROUP_SYNC_REQUEST with only the membership changes between the requester's version (BASE)
+    and the current VERSION. BASE 0 means ADD is the full member list, sent when the requester is further
+    behind than the delta log reaches. DIGEST lets the requester check the result.
+    """
+
+    TYPE = "GROUP_SYNC"
+    SCOPE = Token.Scope.GROUP
+    __hidden__ = True
+    __schema__ = {
+        "TYPE": TYPE,
+        "FROM": {"type": UserID, "required": True},
+        "TO": {"type": UserID, "required": True},
+        "GROUP_ID": {"type": str, "required": True},
+        "BASE": {"type": int, "required": True},
+        "VERSION": {"type": int, "required": True},
+        "ADD": {"type": str, "required": False},
+        "REMOVE": {"type": str, "required": False},
+        "DIGEST": {"type": str, "required": True},
+        "TIMESTAMP": {"type": Timestamp, "required": True},
+        "TOKEN": {"type": Token, "required": True}
+    }
+
+    @property
+    def payload(self) -> dict:
+        p = {
+            "TYPE": self.TYPE,
+            "FROM": self.from_user,
+            "TO": self.to_user,
+            "GROUP_ID": self.group_id,
+            "BASE": self.base,
+            "VERSION": self.version,
+            "DIGEST": self.digest,
+            "TIMESTAMP": self.timestamp,
+            "TOKEN": self.token
+        }
+        if self.add:
+            p["ADD"] = self.add
+        if self.remove:
+            p["REMOVE"] = self.remove
+        return p
+
+    def __init__(self, to: UserID, group_id: str, have: int, ttl: TTL = 3600):
+        """Builds the answer for `to`, who has version `have` of the group"""
+        unix_now = int(datetime.now(timezone.utc).timestamp())
+        base, version, add, remove, digest = client_state.get_group_delta(group_id, have)
+        self.type = self.TYPE
+        self.from_user = client_state.get_user_id()
+        self.to_user = to
+        self.group_id = str(group_id)
+        self.base = base
+        self.version = version
+        self.add = ",".join(str(u) for u in add)
+        self.remove = ",".join(str(u) for u in remove)
+        self.digest = digest
+        self.timestamp = Timestamp(unix_now)
+        self.token = Token(self.from_user, self.timestamp + ttl, self.SCOPE)
+
+    @classmethod
+    def parse(cls, data: dict) -> "GroupSync":
+        new_obj = cls.__new__(cls)
+        new_obj.type = data["TYPE"]
+        new_obj.from_user = UserID.parse(data["FROM"])
+        new_obj.to_user = UserID.parse(data["TO"])
+        new_obj.group_id = data["GROUP_ID"]
+        new_obj.base = int(data["BASE"])
+        new_obj.version = int(data["VERSION"])
+        new_obj.add = data.get("ADD", "") or ""
+        new_obj.remove = data.get("REMOVE", "") or ""
+        new_obj.digest = data["DIGEST"]
+        new_obj.timestamp = Timestamp.parse(int(data["TIMESTAMP"]))
+        new_obj.token = Token.parse(data["TOKEN"])
+
+        Token.validate_token(new_obj.token, expected_scope=cls.SCOPE, expected_user_id=new_obj.from_user)
+        msg_format.validate_message(new_obj.payload, new_obj.__schema__)
+        return new_obj
+
+    def send(self, socket: socket.socket, ip: str="default", port: int=50999, encoding: str="utf-8") -> tuple[str, int]:
+        if ip == "default":
+            ip = self.to_user.get_ip()
+        return super().send(socket, ip, port, encoding)
+
+    @classmethod
+    def receive(cls, raw: str) -> "GroupSync":
+        received = cls.parse(msg_format.deserialize_message(raw))
+        if received.to_user != client_state.get_user_id():
+            raise ValueError("Message is not intended to be received by this client")
+
+        current = client_state.get_group_version(received.group_id)
+        if current is None:
+            raise ValueError(f"Not a member of group {received.group_id}")
+        if received.version < current[0]:
+            client_logger.debug(f"Ignoring stale GROUP_SYNC of {received.group_id} at version {received.version}")
+            return received
+        if received.base > current[0]:
+            # The delta starts after the version we have, only a full member list can fix that
+            request_sync(received.from_user, received.group_id, 0)
+            return received
+
+        add_members = [UserID.parse(u) for u in msg_format.string_to_list(received.add)]
+        remove_members = [UserID.parse(u) for u in msg_format.string_to_list(received.remove)]
+        digest = client_state.apply_group_sync(received.group_id, received.base, received.version, add_members, remove_members)
+        if digest != received.digest:
+            if received.base != 0:
+                request_sync(received.from_user, received.group_id, 0)
+            else:
+                client_logger.warn(f"Group {received.group_id} membership still differs from {received.from_user} after a full sync")
+        return received
+
+    def info(self, verbose: bool = False) -> str:
+        if verbose:
+            return f"{self.payload}"
+        return ""
+
+
+__message__ = GroupSync
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from custom_types.fields import UserID, Token, Timestamp, TTL
+from custom_types.base_message import BaseMessage
+from states.client_state import client_state
+from client_logger import client_logger
+from utils import msg_format
+import socket
+import client
+import config
+
+
+class GroupSyncRequest(BaseMessage):
+    """
+    Sent by a group member that noticed it missed membership changes (a GROUP_UPDATE skipped a version,
+    or the membership digest didn't match) to a member that has them. VERSION is the group version the
+    requester has, 0 asks for the full member list.
+    """
+
+    TYPE = "GROUP_SYNC_REQUEST"
+    SCOPE = Token.Scope.GROUP
+    __hidden__ = True
+    __schema__ = {
+        "TYPE": TYPE,
+        "FROM": {"type": UserID, "required": True},
+        "TO": {"type": UserID, "required": True},
+        "GROUP_ID": {"type": str, "required": True},
+        "VERSION": {"type": int, "required": True},
+        "TIMESTAMP": {"type": Timestamp, "required": True},
+        "TOKEN": {"type": Token, "required": True}
+    }
+
+    @property
+    def payload(self) -> dict:
+        return {
+            "TYPE": self.TYPE,
+            "FROM": self.from_user,
+            "TO": self.to_user,
+            "GROUP_ID": self.group_id,
+            "VERSION": self.version,
+            "TIMESTAMP": self.timestamp,
+            "TOKEN": self.token
+        }
+
+    def __init__(self, to: UserID, group_id: str, version: int, ttl: TTL = 3600):
+        unix_now = int(datetime.now(timezone.utc).timestamp())
+        self.type = self.TYPE
+        self.from_user = client_state.get_user_id()
+        self.to_user = to
+        self.group_id = str(group_id)
+        self.version = int(version)
+        self.timestamp = Timestamp(unix_now)
+        self.token = Token(self.from_user, self.timestamp + ttl, self.SCOPE)
+
+    @classmethod
+    def parse(cls, data: dict) -> "GroupSyncRequest":
+        new_obj = cls.__new__(cls)
+        new_obj.type = data["TYPE"]
+        new_obj.from_user = UserID.parse(data["FROM"])
+        new_obj.to_user = UserID.parse(data["TO"])
+        new_obj.group_id = data["GROUP_ID"]
+        new_obj.version = int(data["VERSION"])
+        new_obj.timestamp = Timestamp.parse(int(data["TIMESTAMP"]))
+        new_obj.token = Token.parse(data["TOKEN"])
+
+        Token.validate_token(new_obj.token, expected_scope=cls.SCOPE, expected_user_id=new_obj.from_user)
+        msg_format.validate_message(new_obj.payload, new_obj.__schema__)
+        return new_obj
+
+    def send(self, socket: socket.socket, ip: str="default", port: int=50999, encoding: str="utf-8") -> tuple[str, int]:
+        if ip == "default":
+            ip = self.to_user.get_ip()
+        return super().send(socket, ip, port, encoding)
+
+    @classmethod
+    def receive(cls, raw: str) -> "GroupSyncRequest":
+        # Imported here, GROUP_SYNC itself asks for a full sync when a delta doesn't add up
+        from messages.group_sync import GroupSync
+
+        received = cls.parse(msg_format.deserialize_message(raw))
+        if received.to_user != client_state.get_user_id():
+            raise ValueError("Message is not intended to be received by this client")
+        if not client_state.is_group_member(received.group_id, received.from_user):
+            raise ValueError(f"{received.from_user} is not a member of group {received.group_id}")
+
+        client.initialize_sockets(config.PORT)
+        GroupSync(received.from_user, received.group_id, received.version).send(client.get_unicast_socket())
+        return received
+
+    def info(self, verbose: bool = False) -> str:
+        if verbose:
+            return f"{self.payload}"
+        return ""
+
+
+def request_sync(to: UserID, group_id: str, version: int):
+    """Asks `to` for the membership changes of `group_id` after `version` (0 for the full member list)"""
+    client_logger.debug(f"Requesting sync of group {group_id} from version {version} from {to}")
+    client.initialize_sockets(config.PORT)
+    GroupSyncRequest(to, group_id, version).send(client.get_unicast_socket())
+
+
+__message__ = GroupSyncRequest
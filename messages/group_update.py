@@ -4,8 +4,10 @@ import socket
 from custom_types.fields import UserID, Token, Timestamp, TTL
 from custom_types.base_message import BaseMessage
 from utils import msg_format
+from utils.metrics import messages_sent
 from states.client_state import client_state
 from client_logger import client_logger
+from messages.group_sync_request import request_sync
 
 
 class GroupUpdate(BaseMessage):
@@ -18,6 +20,8 @@ class GroupUpdate(BaseMessage):
         "GROUP_ID": {"type": str, "required": True},
         "ADD": {"type": str, "required": False},
         "REMOVE": {"type": str, "required": False},
+        "VERSION": {"type": int, "required": False},  # group version this update produces
+        "DIGEST": {"type": str, "required": False},  # membership digest at VERSION
         "TIMESTAMP": {"type": Timestamp, "required": True},
         "TOKEN": {"type": Token, "required": True},
     }
@@ -36,6 +40,9 @@ class GroupUpdate(BaseMessage):
             p["ADD"] = self.add
         if self.remove:
             p["REMOVE"] = self.remove
+        if self.version is not None:
+            p["VERSION"] = self.version
+            p["DIGEST"] = self.digest
         return p
 
     def __init__(self, group_id: str, add: str = "", remove: str = "", ttl: TTL = 3600):
@@ -45,6 +52,16 @@ class GroupUpdate(BaseMessage):
         self.group_id = str(group_id)
         self.add = (add or "").strip()       # comma-separated UserIDs in wire format
         self.remove = (remove or "").strip() # comma-separated UserIDs in wire format
+        self.version = None
+        self.digest = None
+        current = client_state.get_group_version(self.group_id)
+        if current is not None:
+            self.version = current[0] + 1
+            self.digest = client_state.get_group_digest_after(
+                self.group_id,
+                [UserID.parse(u) for u in msg_format.string_to_list(self.add)],
+                [UserID.parse(u) for u in msg_format.string_to_list(self.remove)]
+            )
         self.timestamp = Timestamp(unix_now)
         self.token = Token(self.from_user, self.timestamp + ttl, self.SCOPE)
 
@@ -56,6 +73,8 @@ class GroupUpdate(BaseMessage):
         new_obj.group_id = data["GROUP_ID"]
         new_obj.add = data.get("ADD", "") or ""
         new_obj.remove = data.get("REMOVE", "") or ""
+        new_obj.version = int(data["VERSION"]) if "VERSION" in data else None
+        new_obj.digest = data.get("DIGEST")
         new_obj.timestamp = Timestamp.parse(int(data["TIMESTAMP"]))
         new_obj.token = Token.parse(data["TOKEN"])
         Token.validate_token(new_obj.token, expected_scope=cls.SCOPE, expected_user_id=new_obj.from_user)
@@ -100,6 +119,7 @@ class GroupUpdate(BaseMessage):
                     uid = UserID.parse(str(uid))
                 dst_ip = uid.get_ip()
                 socket.sendto(msg.encode(encoding), (dst_ip, port))
+                messages_sent.inc(self.TYPE)
                 client_logger.debug(f"Sent GROUP_UPDATE to {uid} at {dst_ip}:{port}")
                 last_ip = dst_ip
                 sent += 1
@@ -121,12 +141,13 @@ class GroupUpdate(BaseMessage):
         add_members = [UserID.parse(u) for u in msg_format.string_to_list(received.add)] if received.add else []
         remove_members = [UserID.parse(u) for u in msg_format.string_to_list(received.remove)] if received.remove else []
 
-        # This single helper updates self._groups[group_id]['members']
-        client_state.upsert_group_members(
+        # This single helper updates the group's members and the member -> groups index
+        previous = client_state.upsert_group_members(
             group_id=received.group_id,
             group_name=None,                 # name unchanged on updates
             add_members=add_members,
-            remove_members=remove_members
+            remove_members=remove_members,
+            version=received.version
         )
         
         # If *this* client was removed, drop the entire group locally
@@ -136,6 +157,15 @@ class GroupUpdate(BaseMessage):
                 client_state.remove_group(received.group_id)
             except Exception:
                 pass
+            return received
+
+        # Catch up on anything missed instead of waiting for a re-create
+        if received.version is not None and received.from_user != me:
+            version, digest = client_state.get_group_version(received.group_id)
+            if received.version > previous + 1:
+                request_sync(received.from_user, received.group_id, previous)
+            elif received.version == version and received.digest and received.digest != digest:
+                request_sync(received.from_user, received.group_id, 0)
 
         return received
 
@@ -1,6 +1,7 @@
 from custom_types.fields import UserID, Token, Timestamp, MessageID, TTL
 from datetime import datetime, timezone
 from utils import msg_format
+from utils.metrics import messages_sent
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
 from client_logger import client_logger
@@ -68,6 +69,7 @@ class Post(BaseMessage):
       try:
         follower_ip = follower.get_ip()
         socket.sendto(msg.encode(encoding), (follower_ip, port))
+        messages_sent.inc(self.TYPE)
         client_logger.debug(f"Sent to {follower_ip}:{port}")
       except Exception as e:
         client_logger.error(f"Error sending to {follower}: {e}")
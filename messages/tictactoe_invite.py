@@ -5,13 +5,13 @@
 
 from datetime import datetime, timezone
 import socket
-import random
 import config
 import client
 
 from custom_types.fields import UserID, Token, Timestamp, MessageID, TTL
 from custom_types.base_message import BaseMessage
 from utils import msg_format
+from utils.metrics import messages_retransmitted, ack_timer
 from states.client_state import client_state
 from client_logger import client_logger
 from messages.ack import Ack
@@ -59,11 +59,7 @@ class TicTacToeInvite(BaseMessage):
         if symbol not in ['X', 'O']:
             raise ValueError("Symbol must be either 'X' or 'O'")
         
-        while True:
-            game_id = f"g{random.randint(0, 255)}"
-            if not game_session_manager.find_game(game_id):
-                break 
-
+        game_id = game_session_manager.allocate_game_id()
 
         self.type = self.TYPE
         self.from_user = client_state.get_user_id()
@@ -82,7 +78,7 @@ class TicTacToeInvite(BaseMessage):
         new_obj.type = data["TYPE"]
         new_obj.from_user = UserID.parse(data["FROM"])
         new_obj.to_user = UserID.parse(data["TO"])
-        new_obj.game_id = data["GAMEID"]
+        new_obj.game_id = msg_format.check_game_id(data["GAMEID"])
         new_obj.symbol = data["SYMBOL"]
         new_obj.timestamp = Timestamp.parse(int(data["TIMESTAMP"]))
         new_obj.message_id = MessageID.parse(data["MESSAGE_ID"]) 
@@ -115,6 +111,9 @@ class TicTacToeInvite(BaseMessage):
         while retries < 3:
             # Send message
             dest = super().send(socket, ip, port, encoding)
+            ack_timer.sent(self.message_id, self.TYPE)
+            if retries > 0:
+                messages_retransmitted.inc(self.TYPE)
             client_logger.debug(f"Send tictactoe_invite {self.message_id}, attempt {retries + 1}")
 
             # Wait a bit for ACK
@@ -149,6 +148,10 @@ class TicTacToeInvite(BaseMessage):
         client_logger.debug(f"ACK SENT TO {dest}")
 
         game = game_session_manager.find_game(received_invite.game_id)
+        if game and not game.active:
+            # A finished game the sender already dropped, its ID now names this new game
+            game_session_manager.delete_game(received_invite.game_id)
+            game = None
 
         if not game:
             game_session_manager.create_game(received_invite.game_id)
@@ -5,6 +5,7 @@
 from custom_types.fields import UserID, Token, MessageID, TTL, Timestamp
 from datetime import datetime, timezone
 from utils import msg_format
+from utils.metrics import messages_retransmitted, ack_timer
 from custom_types.base_message import BaseMessage
 from states.client_state import client_state
 from messages.ack import Ack
@@ -135,6 +136,7 @@ class TicTacToeMove(BaseMessage):
 
         # Check game result
         winning_line = None
+        game_over = True
         if game_session_manager.is_winning_move(self.game_id):
             winning_line = game_session_manager.find_winning_line(self.game_id)
             result = TicTacToeResult(
@@ -157,6 +159,8 @@ class TicTacToeMove(BaseMessage):
                 turn=self.turn,
             )
             result.send(socket=client.get_unicast_socket(), ip=self.from_user.get_ip(), port=config.PORT)
+        else:
+            game_over = False
 
         # Default IP resolution
         retries = 0
@@ -166,6 +170,9 @@ class TicTacToeMove(BaseMessage):
         while retries < 3:
             # Send message
             dest = super().send(socket, ip, port, encoding)
+            ack_timer.sent(self.message_id, self.TYPE)
+            if retries > 0:
+                messages_retransmitted.inc(self.TYPE)
             client_logger.debug(f"Sent tictactoe_move {self.message_id}, attempt {retries + 1}")
 
             # Wait a bit for ACK
@@ -182,6 +189,8 @@ class TicTacToeMove(BaseMessage):
             client_state.remove_recent_message_sent(self)
             game.undo()
             return dest
+        if game_over:
+            game_session_manager.finish_game(self.game_id)
         client_logger.info(self.info(verbose=False))
         return dest
      
@@ -232,6 +241,7 @@ class TicTacToeMove(BaseMessage):
             result.send(socket=client.get_unicast_socket(),
                         ip=move_received.to_user.get_ip(),
                         port=config.PORT)
+            game_session_manager.finish_game(move_received.game_id)
 
         elif game_session_manager.is_draw(move_received.game_id):
             result = TicTacToeResult(
@@ -245,6 +255,7 @@ class TicTacToeMove(BaseMessage):
             result.send(socket=client.get_unicast_socket(),
                         ip=move_received.to_user.get_ip(),
                         port=config.PORT)
+            game_session_manager.finish_game(move_received.game_id)
 
         return move_received
     
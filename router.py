@@ -2,13 +2,16 @@ import config
 import socket
 import importlib
 import pkgutil
+import time
 import traceback
 import utils.msg_format as msg_format
 from typing import Type
 from custom_types.base_message import BaseMessage
+from utils import metrics, tracing
 from client_logger import client_logger
 
 MESSAGE_REGISTRY: dict[str, Type[BaseMessage]] = {}
+FRAME_REGISTRY: dict[int, Type[BaseMessage]] = {}  # binary frame kind -> message class
 
 def load_messages(dir: str):
   """
@@ -39,16 +42,22 @@ def load_messages(dir: str):
         continue
 
       MESSAGE_REGISTRY[msg_type] = msg_class
+      frame_kind = getattr(msg_class, "__frame__", None)
+      if frame_kind is not None:
+        FRAME_REGISTRY[frame_kind] = msg_class
       client_logger.success(f"REGISTERED: [{module_name}]")  
     except Exception:
       client_logger.error("ERROR: (load_messages)" + traceback.format_exc())
 
 def send_message(socket: socket.socket, type: str, data: dict, ip: str, port: int) -> "BaseMessage":
   try:
-    message_class = MESSAGE_REGISTRY.get(type)
-    message_obj = message_class(**data)
-    dest = message_obj.send(socket, ip, port, config.ENCODING)
-    client_logger.send(f"MESSAGE: {message_obj.payload} TO ({dest[0]}, {dest[1]})")
+    with tracing.span("send_message", type=type):
+      message_class = MESSAGE_REGISTRY.get(type)
+      with tracing.span("construct", type=type):
+        message_obj = message_class(**data)
+      with tracing.span("send", type=type):
+        dest = message_obj.send(socket, ip, port, config.ENCODING)
+      client_logger.send("MESSAGE: {0.payload} TO ({1}, {2})", message_obj, dest[0], dest[1])
     return message_obj
   except Exception as e:
     client_logger.warn("Failed to send message")
@@ -56,13 +65,39 @@ def send_message(socket: socket.socket, type: str, data: dict, ip: str, port: in
     client_logger.debug(f"ERROR in send_message(): {traceback.format_exc()}")
 
 def recv_message(raw: bytes, address) -> BaseMessage:
+  start = time.perf_counter()
+  msg_type = "?"
+  message_class = None
   try:
-    msg_str = raw.decode(config.ENCODING, errors="ignore")
-    msg_type = msg_format.extract_message_type(msg_str)
-    message_obj = MESSAGE_REGISTRY[msg_type].receive(msg_str)
-    client_logger.receive(f"MESSAGE: {message_obj.payload} FROM {address}")
+    if msg_format.is_binary_frame(raw):
+      message_class = FRAME_REGISTRY.get(raw[1])
+      if message_class is None:
+        raise ValueError(f"Unknown binary frame kind {raw[1]}")
+      msg_type = message_class.TYPE
+      decoded = time.perf_counter()
+      with tracing.span("receive_frame", type=msg_type):
+        message_obj = message_class.receive_frame(raw, address)
+      client_logger.receive("FRAME: {0} ({1} bytes) FROM {2}", message_obj.type, len(raw), address)
+    else:
+      with tracing.span("decode"):
+        msg_str = raw.decode(config.ENCODING, errors="ignore")
+      with tracing.span("extract_message_type"):
+        msg_type = msg_format.extract_message_type(msg_str)
+      message_class = MESSAGE_REGISTRY.get(msg_type)
+      if message_class is None:
+        raise ValueError(f"Unknown TYPE {msg_type}")
+      decoded = time.perf_counter()
+      with tracing.span("receive", type=msg_type):
+        message_obj = message_class.receive(msg_str)
+      client_logger.receive("MESSAGE: {0.payload} FROM {1}", message_obj, address)
+    metrics.decode_seconds.observe(decoded - start, msg_type)
+    metrics.receive_seconds.observe(time.perf_counter() - decoded, msg_type)
+    metrics.messages_received.inc(msg_type)
     return message_obj
   except Exception as err:
-    client_logger.drop({raw.decode(config.ENCODING, errors="ignore")})
-    client_logger.drop({err})
-  
\ No newline at end of file
+    # Only registered TYPEs become label values, so junk TYPEs cannot grow the counter (or the metrics export)
+    if message_class is not None:
+      metrics.messages_dropped.inc((msg_type, type(err).__name__))
+    else:
+      metrics.messages_dropped.inc(("?", "unknown_type"))
+    client_logger.drop("{0!r} FROM {1}: {2!r}", err, address, raw[:config.LOG_DROP_PREVIEW], source=address[0])
@@ -2,7 +2,9 @@ import threading
 from custom_types.fields import UserID, Token, MessageID
 from custom_types.base_message import BaseMessage
 from client_logger import client_logger
+from states.group import GroupRegistry, GroupHistory, format_digest
 import time
+import config
 
 class ClientState:
   _instance = None
@@ -23,8 +25,8 @@ class ClientState:
     self._peer_display_names = {}
     self._followers = []
     self._following = []
-    self._groups = {}  # Dictionary of {group_id: {"name": group_name, "members": [members]}}
-    self._group_ids = []  # List of group IDs
+    self._groups = GroupRegistry()  # groups this client is in, every group ID seen, and member -> groups
+    self._group_history: dict[str, GroupHistory] = {}  # group_id -> recent GROUP_MESSAGEs sent and received
     self._recent_messages_received = []
     self._recent_messages_sent = []
     self._revoked_tokens = []
@@ -171,6 +173,18 @@ class ClientState:
     with self._lock:
       return self._peers.copy()
     
+  def get_state_sizes(self) -> dict[str, int]:
+    """Returns how many peers, followers, groups and recent messages are held, without copying any of them"""
+    with self._lock:
+      return {
+        "peers": len(self._peers),
+        "followers": len(self._followers),
+        "following": len(self._following),
+        "groups": len(self._groups),
+        "recent_received": len(self._recent_messages_received),
+        "recent_sent": len(self._recent_messages_sent),
+      }
+
   def get_followers(self) -> list[UserID]:
     with self._lock:
       return self._followers.copy()
@@ -253,139 +267,166 @@ class ClientState:
   #group helpers
   def create_group(self, group_id: str, group_name: str, members: list[UserID] = None):
     with self._lock:
-        if members is None:
-            members = []
-        for member in members:
-            self._validate_user_id(member)
-        if group_id not in self._group_ids:
-            self._groups[group_id] = {
-                "name": group_name,
-                "members": members
-            }
-            # Add group_id if not already present
-            if group_id not in self._group_ids:
-                self._group_ids.append(group_id)
-            client_logger.debug(f"Created group: {group_id} ({group_name}) with members: {members}")
+      if members is None:
+        members = []
+      for member in members:
+        self._validate_user_id(member)
+      if self._groups.create(group_id, group_name, members):
+        client_logger.debug(f"Created group: {group_id} ({group_name}) with members: {members}")
 
   def remove_group(self, group_id: str):
     with self._lock:
-      if group_id in self._groups:
-        del self._groups[group_id]
+      if self._groups.remove(group_id):
         client_logger.debug(f"Removed group: {group_id}")
 
-  def get_group(self, group_id: str) -> dict:
+  def get_group(self, group_id: str) -> dict | None:
     with self._lock:
-      return self._groups.get(group_id, None)
+      group = self._groups.get(group_id)
+      if group is None:
+        return None
+      return {"name": group.name, "members": group.member_tuple()}
 
   def get_all_groups(self) -> dict:
     with self._lock:
-      return self._groups.copy()
+      return self._groups.all()
     
   def get_group_ids(self) -> list[str]:
     with self._lock:
-      return self._group_ids.copy()
+      return self._groups.group_ids()
+
+  def is_known_group_id(self, group_id: str) -> bool:
+    with self._lock:
+      return self._groups.is_known(group_id)
     
   def add_group_id(self, group_id: str):
     with self._lock:
-      if group_id not in self._group_ids:
-        self._group_ids.append(group_id)
+      if self._groups.add_known_id(group_id):
         client_logger.debug(f"Added group ID: {group_id}")
 
-  # somewhere in ClientState
+  def get_group_members(self, group_id: str) -> tuple[UserID, ...]:
+    """Returns the group's members (empty if unknown). The tuple is cached until membership changes"""
+    with self._lock:
+      return self._groups.members(group_id)
 
-  def get_group(self, group_id: str) -> dict | None:
-      with self._lock:
-          return self._groups.get(group_id)
-
-  def get_group_members(self, group_id: str) -> list[UserID]:
-      with self._lock:
-          group = self._groups.get(group_id)
-          if not group:
-              return []
-          # Ensure members are UserID objects
-          members = group.get("members", [])
-          return [UserID.parse(m) if not isinstance(m, UserID) else m for m in members]
+  def get_member_groups(self, member: UserID) -> set[str]:
+    """Returns the IDs of the groups `member` is in"""
+    with self._lock:
+      return self._groups.groups_of(member)
 
   def add_group_member(self, group_id: str, member: UserID):
-      with self._lock:
-          self._validate_user_id(member)
-          if group_id not in self._groups:
-              raise ValueError(f"Group {group_id} does not exist")
-          members = self._groups[group_id]["members"]
-          if member not in members:
-              members.append(member)
-              client_logger.debug(f"Added member {member} to group: {group_id}")
+    with self._lock:
+      self._validate_user_id(member)
+      if self._groups.get(group_id) is None:
+        raise ValueError(f"Group {group_id} does not exist")
+      if self._groups.add_member(group_id, member, self._groups.get(group_id).version + 1):
+        client_logger.debug(f"Added member {member} to group: {group_id}")
 
   def remove_group_member(self, group_id: str, member: UserID):
-      with self._lock:
-          self._validate_user_id(member)
-          if group_id not in self._groups:
-              raise ValueError(f"Group {group_id} does not exist")
-          members = self._groups[group_id]["members"]
-          if member in members:
-              members.remove(member)
-              client_logger.debug(f"Removed member {member} from group: {group_id}")
+    with self._lock:
+      self._validate_user_id(member)
+      if self._groups.get(group_id) is None:
+        raise ValueError(f"Group {group_id} does not exist")
+      if self._groups.remove_member(group_id, member, self._groups.get(group_id).version + 1):
+        client_logger.debug(f"Removed member {member} from group: {group_id}")
 
   def upsert_group_members(self, group_id: str, group_name: str | None = None,
-                          add_members: list[UserID] | None = None,
-                          remove_members: list[UserID] | None = None):
-      """
-      Create the group if missing (like create_group) and then apply add/remove in one go.
-      - group_name: used only if group is newly created (None keeps existing name).
-      - add_members/remove_members: lists of UserID (caller ensures type).
-      """
-      add_members = add_members or []
-      remove_members = remove_members or []
-
-      with self._lock:
-          # Normalize to UserID instances
-          def _norm(lst):
-              return [UserID.parse(u) if not isinstance(u, UserID) else u for u in lst]
-
-          add_members = _norm(add_members)
-          remove_members = _norm(remove_members)
-
-          # Create if missing (mimic create_group behavior)
-          if group_id not in self._groups:
-              self._groups[group_id] = {
-                  "name": group_name or str(group_id),
-                  "members": []
-              }
-              if group_id not in getattr(self, "_group_ids", []):
-                  # maintain _group_ids list if you track it
-                  self._group_ids.append(group_id)  # assumes _group_ids exists
-              client_logger.debug(f"Created group: {group_id} ({self._groups[group_id]['name']})")
-
-          members = self._groups[group_id]["members"]
-
-          # Apply adds
-          for u in add_members:
-              self._validate_user_id(u)
-              if u not in members:
-                  members.append(u)
-                  client_logger.debug(f"Added member {u} to group: {group_id}")
-
-          # Apply removes
-          for u in remove_members:
-              self._validate_user_id(u)
-              if u in members:
-                  members.remove(u)
-                  client_logger.debug(f"Removed member {u} from group: {group_id}")
+                           add_members: list[UserID] | None = None,
+                           remove_members: list[UserID] | None = None,
+                           version: int | None = None) -> int:
+    """
+    Create the group if missing (like create_group) and then apply add/remove in one go.
+    - group_name: used only if group is newly created (None keeps existing name).
+    - add_members/remove_members: lists of UserID (caller ensures type).
+    - version: the group version this change produces (None for the next local version).
+    Returns the group's version before the change, so callers can tell if they missed any.
+    """
+    add_members = add_members or []
+    remove_members = remove_members or []
+
+    with self._lock:
+      for u in add_members + remove_members:
+        self._validate_user_id(u)
+
+      group = self._groups.ensure(group_id, group_name)
+      previous = group.version
+      if version is None:
+        version = previous + 1
+      group.version = max(previous, version)
+
+      # Apply adds
+      for u in add_members:
+        if self._groups.add_member(group_id, u, version):
+          client_logger.debug(f"Added member {u} to group: {group_id}")
+
+      # Apply removes
+      for u in remove_members:
+        if self._groups.remove_member(group_id, u, version):
+          client_logger.debug(f"Removed member {u} from group: {group_id}")
+      return previous
+
+  def get_group_version(self, group_id: str) -> tuple[int, str] | None:
+    """Returns the group's (version, membership digest), or None if this client has no entry for it"""
+    with self._lock:
+      group = self._groups.get(group_id)
+      if group is None:
+        return None
+      return (group.version, format_digest(group.digest))
+
+  def get_group_digest_after(self, group_id: str, add_members: list[UserID], remove_members: list[UserID]) -> str:
+    with self._lock:
+      return format_digest(self._groups.digest_after(group_id, add_members, remove_members))
+
+  def get_group_delta(self, group_id: str, have: int) -> tuple[int, int, list[UserID], list[UserID], str]:
+    """
+    Returns (base, version, add, remove, digest) bringing a member at version `have` up to date.
+    base is `have` for a delta, or 0 when the delta log doesn't reach back that far and `add` is the full member list.
+    """
+    with self._lock:
+      group = self._groups.get(group_id)
+      if group is None:
+        raise ValueError(f"Group {group_id} does not exist")
+      delta = group.delta_since(have)
+      if delta is None:
+        return (0, group.version, list(group.members), [], format_digest(group.digest))
+      return (have, group.version, delta[0], delta[1], format_digest(group.digest))
+
+  def apply_group_sync(self, group_id: str, base: int, version: int,
+                       add_members: list[UserID], remove_members: list[UserID]) -> str:
+    """Applies a GROUP_SYNC (a full snapshot if base is 0) and returns the resulting membership digest"""
+    with self._lock:
+      for u in add_members + remove_members:
+        self._validate_user_id(u)
+      group = self._groups.ensure(group_id)
+      if base == 0:
+        self._groups.reset_members(group_id, add_members, version)
+      else:
+        for u in add_members:
+          self._groups.add_member(group_id, u, version)
+        for u in remove_members:
+          self._groups.remove_member(group_id, u, version)
+        group.version = max(group.version, version)
+      client_logger.debug(f"Synced group {group_id} from version {base} to {version}")
+      return format_digest(group.digest)
 
+  def add_group_history(self, message: BaseMessage):
+    with self._lock:
+      self._validate_base_message(message)
+      history = self._group_history.get(message.group_id)
+      if history is None:
+        history = self._group_history[message.group_id] = GroupHistory(config.GROUP_HISTORY_DEPTH)
+      history.add(message.timestamp.time, message)
+
+  def get_group_history(self, group_id: str, before: int | None = None, limit: int = 20) -> list[tuple[int, BaseMessage]]:
+    """Returns up to `limit` (timestamp, message) pairs of `group_id` older than `before`, oldest first"""
+    with self._lock:
+      history = self._group_history.get(group_id)
+      if history is None:
+        return []
+      return history.page(before, limit)
 
   def is_group_member(self, group_id: str, member: UserID) -> bool:
     with self._lock:
       self._validate_user_id(member)
-      if group_id not in self._groups:
-        return False
-      return member in self._groups[group_id]["members"]
- 
-  def get_group_members(self, group_id: str) -> list[UserID]:
-    with self._lock:
-        group = self._groups.get(group_id)
-        if group:
-            return [UserID.parse(m) if not isinstance(m, UserID) else m
-                    for m in group.get("members", [])]
-        return []
+      return self._groups.is_member(group_id, member)
       
 client_state = ClientState()
\ No newline at end of file
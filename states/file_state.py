@@ -1,11 +1,15 @@
 import os
-import time
+import queue
+import zlib
 import base64
 import threading
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from custom_types.fields import MessageID
 from custom_types.file_transfer import FileTransfer
 from client_logger import client_logger
+from utils.msg_file_transfer import decompress_chunk
+from utils.disk_io import disk_io, write_file_atomic
+import config
 
 class FileState:
     _instance = None
@@ -27,11 +31,20 @@ class FileState:
         self._pending_transfers: Dict[MessageID, FileTransfer] = {}
         self._accepted_files: List[MessageID] = []
         self._recent: MessageID = None
+        self._handles: Dict[int, MessageID] = {}  # binary chunk frame handle -> file_id
+        self._outgoing_transfers: Dict[MessageID, object] = {}  # file_id -> sent FileOffer, kept to serve FILE_RESEND
+        self._corrupt_chunks: Dict[MessageID, List[int]] = {}
+        self._memory_used = 0  # chunk bytes held in memory across all pending transfers
+        self._saving: Dict[MessageID, FileTransfer] = {}  # complete transfers being written to disk
 
         # Save to: <project root>/received_files
         project_root = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
         self._files_dir = os.path.join(project_root, "received_files")
         os.makedirs(self._files_dir, exist_ok=True)
+        # Spool and partially written files only live as long as their transfer, anything left over is from an earlier run
+        for name in os.listdir(self._files_dir):
+            if name.startswith(".") and (name.endswith(".spool") or name.endswith(".part")):
+                os.remove(os.path.join(self._files_dir, name))
 
     def _validate_message_id(self, data):
         if not isinstance(data, MessageID):
@@ -43,10 +56,10 @@ class FileState:
 
     def accept_file(self, file_id: MessageID = None):
         with self._lock:
-            if file_id is None and self._recent is not None:
+            if file_id is None:
+                if self._recent is None:
+                    raise ValueError("No file transfers to accept")
                 file_id = self._recent
-            else:
-                raise ValueError("No file transfers to accept")
 
             self._validate_message_id(file_id)
             if file_id in self._accepted_files:
@@ -57,25 +70,45 @@ class FileState:
 
             self._accepted_files.append(file_id)
             client_logger.debug(f"Accepted file transfer with file_id {file_id}")
-            transfer = self.get_pending_transfers()[file_id]
-            if transfer.received_count == transfer.total_chunks and transfer.total_chunks > 0:
+            if self._pending_transfers[file_id].status is not None:
                 self._save_completed_file(file_id)
             else:
+                # _verify_transfer() saves it once the last chunk is hashed
                 client_logger.debug(f"File accepted, but not yet complete: {file_id}")
     
     def reject_file(self, file_id: MessageID = None):
         with self._lock:
-            if file_id is None and self._recent is not None:
+            if file_id is None:
+                if self._recent is None:
+                    raise ValueError("No file transfers to reject")
                 file_id = self._recent
-            else:
-                raise ValueError("No file transfers to reject")
         
             if file_id not in self._pending_transfers.keys():
                     raise ValueError("No pending file offers to reject")
             
-            del self._pending_transfers[file_id]
+            self._drop_transfer(file_id)
+            if file_id in self._accepted_files:
+                self._accepted_files.remove(file_id)
+            if self._recent == file_id:
+                self._recent = None
 
 
+    def cancel_incoming(self, file_id: MessageID, from_user=None):
+        """
+        Drops a pending incoming transfer, deleting its chunks and spool file. Returns its sender, or None if
+        there is no such transfer (from `from_user`, when given)
+        """
+        with self._lock:
+            transfer = self._pending_transfers.get(file_id)
+            if transfer is None or (from_user is not None and transfer.from_user != from_user):
+                return None
+            self._drop_transfer(file_id)
+            if file_id in self._accepted_files:
+                self._accepted_files.remove(file_id)
+            if self._recent == file_id:
+                self._recent = None
+            return transfer.from_user
+
     def is_file_accepted(self, file_id: MessageID) -> bool:
         with self._lock:
             self._validate_message_id(file_id)
@@ -89,13 +122,83 @@ class FileState:
             self._recent = file_id
             client_logger.debug(f"Added pending transfer file {file} with file_id {file_id}")
 
-    def add_chunk(self, file_id: MessageID, chunk_index: int, chunk_data: str, total_chunks: int) -> bool:
-        """Returns True if file is complete after adding chunk"""
+    def register_handle(self, handle: int, file_id: MessageID) -> bool:
+        """Maps a binary chunk frame handle to a pending transfer. Returns False if the handle is already in use"""
+        with self._lock:
+            self._validate_message_id(file_id)
+            owner = self._handles.get(handle)
+            if owner is not None and owner != file_id:
+                return False
+            self._handles[handle] = file_id
+            return True
+
+    def get_transfer_by_handle(self, handle: int) -> tuple[MessageID, FileTransfer]:
+        with self._lock:
+            file_id = self._handles.get(handle)
+            if file_id is None or file_id not in self._pending_transfers:
+                raise ValueError(f"Unknown transfer handle {handle:08x}")
+            return file_id, self._pending_transfers[file_id]
+
+    def _drop_transfer(self, file_id: MessageID):
+        """Removes a pending transfer, returning its chunks to the memory budget and deleting its spool file"""
+        transfer = self._pending_transfers.pop(file_id)
+        self._memory_used -= transfer.memory_bytes
+        transfer.discard()
+        self._release_handle(file_id)
+        self._corrupt_chunks.pop(file_id, None)
+        if not transfer.io_scheduled:
+            # A running I/O task deletes the spool file itself when it sees the transfer was dropped
+            self._close_spool(transfer)
+
+    def _close_spool(self, transfer: FileTransfer):
+        # Called with the lock held, so the file is closed and deleted by a disk I/O worker when one is free
+        if transfer.spool_path is None:
+            return
+        try:
+            disk_io.submit(transfer.close_spool)
+        except queue.Full:
+            transfer.close_spool()
+
+    def _spool_path(self, file_id: MessageID) -> str:
+        return os.path.join(self._files_dir, f".{file_id}.spool")
+
+    def _release_handle(self, file_id: MessageID):
+        for handle, owner in list(self._handles.items()):
+            if owner == file_id:
+                del self._handles[handle]
+
+    def add_outgoing_transfer(self, file_id: MessageID, offer):
+        with self._lock:
+            self._validate_message_id(file_id)
+            self._outgoing_transfers[file_id] = offer
+
+    def get_outgoing_transfer(self, file_id: MessageID):
+        with self._lock:
+            return self._outgoing_transfers.get(file_id)
+
+    def remove_outgoing_transfer(self, file_id: MessageID):
+        with self._lock:
+            self._outgoing_transfers.pop(file_id, None)
+
+    def pop_corrupt_chunks(self, file_id: MessageID) -> List[int]:
+        """Returns and clears the chunk indexes that failed their CRC check and need to be requested again"""
+        with self._lock:
+            return self._corrupt_chunks.pop(file_id, [])
+
+    def add_chunk(self, file_id: MessageID, chunk_index: int, chunk_data: str | bytes, total_chunks: int, crc: int = None,
+                  on_status: Callable = None) -> bool:
+        """
+        Returns True if this chunk completed the file.
+        `chunk_data` is base64 text from a FILE_CHUNK message or raw bytes from a binary frame.
+        `crc` is the sender's CRC32 of the uncompressed chunk, checked when the CRC feature was negotiated.
+        Spooling and hashing run on a disk I/O worker, which calls `on_status(from_user, file_id, status)` with
+        the FILE_RECEIVED status once every chunk is hashed.
+        """
         with self._lock:
             if not isinstance(chunk_index, int):
                 raise ValueError(f"chunk_index {chunk_index} is not of type int")
-            if not isinstance(chunk_data, str):
-                raise ValueError(f"chunk_data {chunk_data} is not of type str")
+            if not isinstance(chunk_data, (str, bytes)):
+                raise ValueError(f"chunk_data {chunk_data} is not of type str or bytes")
             if not isinstance(total_chunks, int):
                 raise ValueError(f"total_chunks {total_chunks} is not of type int")
             if file_id not in self._pending_transfers:
@@ -105,68 +208,146 @@ class FileState:
             transfer = self._pending_transfers[file_id]
 
             if transfer.total_chunks != total_chunks:
+                # Each chunk carries at least one byte, so FILESIZE bounds the chunk count
+                if not (0 < total_chunks <= max(transfer.filesize, 1)):
+                    raise ValueError(f"total_chunks {total_chunks} is invalid for a {transfer.filesize} byte file")
                 transfer.set_total_chunks(total_chunks)
+            if not (0 <= chunk_index < transfer.total_chunks):
+                raise ValueError(f"chunk_index {chunk_index} out of range for {transfer.total_chunks} chunks")
 
-            decoded_data = base64.b64decode(chunk_data)
+            if isinstance(chunk_data, str):
+                decoded_data = base64.b64decode(chunk_data)
+            else:
+                decoded_data = chunk_data
+            try:
+                if "ZLIB" in transfer.features:
+                    # Never inflate past what this chunk can hold, so a tiny datagram can't expand to the whole FILESIZE
+                    _, longest = transfer.chunk_length_range(chunk_index)
+                    decoded_data = decompress_chunk(decoded_data, min(longest, transfer.filesize - transfer.stored_bytes()))
+                transfer.check_chunk_length(chunk_index, len(decoded_data))
+                if "CRC" in transfer.features and crc is not None and zlib.crc32(decoded_data) != crc:
+                    raise ValueError("CRC mismatch")
+            except (ValueError, zlib.error) as e:
+                client_logger.warn(f"Chunk {chunk_index} of {file_id} is corrupt ({e}), requesting it again")
+                self._corrupt_chunks.setdefault(file_id, []).append(chunk_index)
+                return False
 
-            if transfer.received_chunks[chunk_index] is None:
-                transfer.received_chunks[chunk_index] = decoded_data
-                transfer.received_count += 1
-            client_logger.debug(f"Chunks received for FILE_ID {file_id}: {transfer.received_count}")
+            if transfer.has_chunk(chunk_index):
+                return False
+            if transfer.stored_bytes() + len(decoded_data) > transfer.filesize:
+                raise ValueError(f"Chunk {chunk_index} of {file_id} exceeds the declared FILESIZE {transfer.filesize}")
+            if not transfer.io_scheduled:
+                try:
+                    disk_io.submit(self._run_transfer_io, file_id, transfer)
+                except queue.Full:
+                    client_logger.debug(f"Disk I/O queue is full, requesting chunk {chunk_index} of {file_id} again")
+                    self._corrupt_chunks.setdefault(file_id, []).append(chunk_index)
+                    return False
+                transfer.io_scheduled = True
+            if on_status is not None:
+                transfer.on_status = on_status
+            # Chunks over the memory budget are held until the I/O task has written them to the spool file
+            spool = self._memory_used + len(decoded_data) > config.TRANSFER_MEMORY_BUDGET
+            if spool and transfer.spooled_bytes == 0:
+                client_logger.debug(f"Transfer memory budget reached, spooling {file_id} to disk")
+            transfer.store_chunk(chunk_index, decoded_data, spool)
+            self._memory_used += len(decoded_data)
+            client_logger.debug("Chunks received for FILE_ID {0}: {1}", file_id, transfer.received_count)
 
             if transfer.received_count == transfer.total_chunks:
                 client_logger.debug("\n\nALL CHUNKS RECEIVED\n\n")
                 return True
             return False
 
+    def _run_transfer_io(self, file_id: MessageID, transfer: FileTransfer):
+        """
+        Runs on a disk I/O worker, at most one per transfer: writes the chunks add_chunk() set aside to the spool
+        file and feeds the digest, until no chunk is left to do, then verifies the transfer once all are hashed.
+        The spool file is only read and written here, without the lock held.
+        """
+        status = None
+        try:
+            while True:
+                with self._lock:
+                    chunks = [] if transfer.discarded else transfer.take_unspooled()
+                    if transfer.discarded or not (chunks or transfer.has_unhashed()):
+                        # Stop in the same critical section add_chunk() checks, so no chunk is left unhandled
+                        if not transfer.discarded and transfer.received_count == transfer.total_chunks:
+                            status = self._verify_transfer(file_id, transfer)
+                        # Once io_scheduled is cleared, _drop_transfer() deletes the spool file instead
+                        close_spool = transfer.discarded
+                        transfer.io_scheduled = False
+                        break
+                if chunks:
+                    locations = transfer.write_spool(chunks, self._spool_path(file_id))
+                    with self._lock:
+                        if not transfer.discarded:
+                            self._memory_used -= transfer.spooled(locations)
+                transfer.update_digest()
+        except Exception as e:
+            client_logger.error(f"Failed to spool or hash {transfer.filename} ({file_id}), cancelling it: {e}")
+            with self._lock:
+                if self._pending_transfers.get(file_id) is transfer:
+                    self._drop_transfer(file_id)
+                    if file_id in self._accepted_files:
+                        self._accepted_files.remove(file_id)
+                    status = "CANCELLED"  # tells the sender to stop too
+                close_spool = transfer.discarded
+                transfer.io_scheduled = False
+        if close_spool:
+            transfer.close_spool()
+        if status is not None and transfer.on_status is not None:
+            transfer.on_status(transfer.from_user, file_id, status)
+
+    def _verify_transfer(self, file_id: MessageID, transfer: FileTransfer) -> str:
+        """
+        Returns the FILE_RECEIVED status for a complete transfer, dropping it if its digest does not match.
+        A verified transfer that was already accepted is saved right away. Called with the lock held.
+        """
+        status = transfer.verify()
+        if status == "CORRUPTED":
+            client_logger.warn(f"File {transfer.filename} ({file_id}) does not match its digest, discarding it")
+            self.remove_transfers([file_id])
+            return status
+        transfer.status = status
+        if file_id in self._accepted_files:
+            self._save_completed_file(file_id)
+        return status
+
     def _save_completed_file(self, file_id: MessageID):
+        """
+        Hands a complete transfer over to the disk I/O workers, which write it without holding the lock.
+        If their queue is full the transfer stays pending and unaccepted, so it can be accepted again later.
+        """
         transfer = self._pending_transfers[file_id]
-        if not (transfer.received_count == transfer.total_chunks and transfer.total_chunks > 0):
+        if transfer.status is None:
             raise ValueError(f"File Transfer with id {file_id} is not yet complete")
-        
-        # Combine chunks in order
-        complete_data = b""
-        start_time = time.time()
-        prev_time = start_time
-        client_logger.process("Combining file chunks...")
-        for i in range(transfer.total_chunks):
-            chunk = transfer.received_chunks[i]
-            if chunk is None:
-                raise ValueError(f"Chunk at index {i} is missing or None.")
-            complete_data += chunk
-            current_time = time.time()
-            if current_time - prev_time >= 3:
-                client_logger.process(f"completion {(i / transfer.total_chunks) * 100:.2f}%...")
-                prev_time = current_time
-        client_logger.success("Combined all file chunks!")
-
-        # Save to file
-        filepath = os.path.join(self._files_dir, transfer.filename)
-        client_logger.process(f"Writing file to {filepath}...")
-        with open(filepath, "wb") as f:
-            f.write(complete_data)
-        client_logger.success(f"File saved to {filepath}!")
-
-        # Cleanup
+        self._accepted_files.remove(file_id)
+        try:
+            disk_io.submit(self._write_completed_file, file_id, transfer)
+        except queue.Full:
+            client_logger.warn(f"Disk write queue is full, enter ACCEPT {file_id} to save {transfer.filename} again")
+            return
         del self._pending_transfers[file_id]
-        if file_id in self._accepted_files:
-            self._accepted_files.remove(file_id)
+        self._release_handle(file_id)
+        self._saving[file_id] = transfer
 
-    def complete_transfers(self):
-        with self._lock:
-            completed_files = []
-
-            # Work on a copy since we may mutate the list during iteration
-            for file_id in list(self._accepted_files):
-                if file_id in self._pending_transfers:
-                    transfer = self.get_pending_transfers()[file_id]
-                    if transfer.received_count == transfer.total_chunks and transfer.total_chunks > 0:
-                        self._save_completed_file(file_id)
-                    else:
-                        client_logger.debug(f"Waiting for {file_id} to complete")
-
-            if completed_files:
-                client_logger.debug(f"Completed file transfers: {completed_files}")
+    def _write_completed_file(self, file_id: MessageID, transfer: FileTransfer):
+        # Runs on a disk I/O worker. Chunks are written in order, spooled chunks are read back one at a time
+        filepath = os.path.join(self._files_dir, os.path.basename(transfer.filename))
+        client_logger.process(f"Writing file to {filepath}...")
+        try:
+            write_file_atomic(filepath, (transfer.chunk_data(i) for i in range(transfer.total_chunks)))
+            client_logger.success(f"File saved to {filepath}!")
+        except OSError as e:
+            client_logger.error(f"Failed to save {transfer.filename} ({file_id}): {e}")
+        finally:
+            # Cleanup
+            with self._lock:
+                del self._saving[file_id]
+                self._memory_used -= transfer.memory_bytes
+                transfer.discard()
+            transfer.close_spool()
 
     def remove_transfers(self, file_ids: list[MessageID]):
         with self._lock:
@@ -179,10 +360,15 @@ class FileState:
                     removed = True
 
                 if file_id in self._pending_transfers:
-                    del self._pending_transfers[file_id]
+                    self._drop_transfer(file_id)
                     client_logger.debug(f"Removed file_id {file_id} from pending transfers")
                     removed = True
 
+                if file_id in self._outgoing_transfers:
+                    del self._outgoing_transfers[file_id]
+                    client_logger.debug(f"Removed file_id {file_id} from outgoing transfers")
+                    removed = True
+
                 if not removed:
                     client_logger.warn(f"Tried to remove non-existent file_id {file_id}")
 
@@ -195,4 +381,19 @@ class FileState:
     def get_accepted_files(self) -> list[MessageID]:
         return self._accepted_files
 
+    def get_saving_transfers(self) -> Dict[MessageID, FileTransfer]:
+        with self._lock:
+            return dict(self._saving)
+
+    def get_memory_usage(self) -> tuple[int, int, int]:
+        """
+        Returns (bytes held in memory, bytes spooled to disk, bytes in memory waiting to be spooled) across all
+        pending transfers. Memory only goes over TRANSFER_MEMORY_BUDGET by the bytes waiting to be spooled.
+        """
+        with self._lock:
+            transfers = list(self._pending_transfers.values()) + list(self._saving.values())
+            spooled = sum(transfer.spooled_bytes for transfer in transfers)
+            unspooled = sum(transfer.unspooled_bytes for transfer in transfers)
+            return self._memory_used, spooled, unspooled
+
 file_state = FileState()
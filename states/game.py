@@ -1,46 +1,79 @@
+import time
+import random
 import threading
 from client_logger import client_logger
+from states.game_journal import game_journal
+import config
 from typing import Dict, Optional
 
 
+# Boards are stored as one 9-bit integer per symbol, bit i set when that symbol holds position i
+WINNING_COMBINATIONS = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),  # Rows
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),  # Columns
+    (0, 4, 8), (2, 4, 6)              # Diagonals
+)
+WIN_MASKS = tuple(sum(1 << i for i in combo) for combo in WINNING_COMBINATIONS)
+FULL_BOARD = 0x1FF
+# Winning mask (0 if none) for each of the 512 possible positions of one symbol, so a win check is one lookup
+WINNING_LINE = tuple(next((mask for mask in WIN_MASKS if bits & mask == mask), 0) for bits in range(FULL_BOARD + 1))
+# GAMEIDs are "g" + a number. Peers that only know the short form accept g0-g255, so those are handed out first
+SHORT_GAME_IDS = 256
+MAX_GAME_IDS = 65536
+WINNING_LINE_STRINGS = {mask: ",".join(str(i) for i in combo) for mask, combo in zip(WIN_MASKS, WINNING_COMBINATIONS)}
+
 
 class GameState:
     """Tracks the state of TicTacToe games and prints the board only."""
 
+    __slots__ = ("active", "_x", "_o", "last_symbol", "turn", "player_x", "player_o", "starting_symbol",
+                 "_undo_log", "_undo_head", "_undo_len", "lock", "last_activity", "game_id")
+
     def __init__(self):
         self.active = False
-        self.board = [' '] * 9
+        self._x = 0  # bitboard of X's positions
+        self._o = 0  # bitboard of O's positions
         self.last_symbol: Optional[str] = None  
         self.turn = 1  
         self.player_x: Optional[str] = None
         self.player_o: Optional[str] = None
         self.starting_symbol: str = "X"  # X always starts unless changed
-        self.prev_state: GameState = None
-
-    @classmethod
-    def _manual_construct(cls, active: bool, board: list, last_symbol: str, turn: int, player_x: str, player_o: str, starting_symbol: str, prev_state) -> "GameState":
-        new_gamestate = cls()
-        new_gamestate.active = active
-        new_gamestate.board = board.copy()
-        new_gamestate.last_symbol = last_symbol
-        new_gamestate.turn = turn
-        new_gamestate.player_x = player_x
-        new_gamestate.player_o = player_o
-        new_gamestate.starting_symbol = starting_symbol
-        if prev_state is not None and not isinstance(prev_state, GameState):
-            raise ValueError("Invalid previous GameState")
-        new_gamestate.prev_state = prev_state
-        return new_gamestate
+        # Ring buffer of the last GAME_UNDO_DEPTH moves, each stored as position | 0x10 for O.
+        # Turns alternate, so a move plus the turn number is enough to roll the game back.
+        self._undo_log: Optional[list] = None
+        self._undo_head = 0
+        self._undo_len = 0
+        self.lock = threading.Lock()  # held while the game is changed, so games never contend with each other
+        self.last_activity = time.monotonic()
+        self.game_id: Optional[str] = None  # set by GameSessionManager, games without one are not journaled
+
+    @property
+    def board(self) -> list:
+        """The board as a list of 9 symbols (' ', 'X' or 'O'), built from the bitboards"""
+        return ['X' if self._x >> i & 1 else 'O' if self._o >> i & 1 else ' ' for i in range(9)]
+
+    @board.setter
+    def board(self, board: list):
+        self._x = sum(1 << i for i, symbol in enumerate(board) if symbol == 'X')
+        self._o = sum(1 << i for i, symbol in enumerate(board) if symbol == 'O')
+
+    def winning_mask(self, symbol: str) -> int:
+        """Returns the mask of a line completed by `symbol`, or 0 if it has none"""
+        return WINNING_LINE[self._x if symbol == 'X' else self._o]
+
+    def is_full(self) -> bool:
+        return (self._x | self._o).bit_count() == 9
 
     def get_board_string(self) -> str:
         """Returns the current game board as a string."""
+        board = self.board
         return (
             "\nCurrent Board:\n"
-            f" {self.board[0]} | {self.board[1]} | {self.board[2]} \n"
+            f" {board[0]} | {board[1]} | {board[2]} \n"
             "-----------\n"
-            f" {self.board[3]} | {self.board[4]} | {self.board[5]} \n"
+            f" {board[3]} | {board[4]} | {board[5]} \n"
             "-----------\n"
-            f" {self.board[6]} | {self.board[7]} | {self.board[8]} "
+            f" {board[6]} | {board[7]} | {board[8]} "
         )
 
     def print_board(self):
@@ -55,46 +88,89 @@ class GameState:
             ValueError: If player is invalid, it's not their turn, 
                         position is invalid, or symbol is invalid.
         """
-        last_state = self._manual_construct(
-            self.active,
-            self.board,
-            self.last_symbol,  
-            self.turn,  
-            self.player_x,
-            self.player_o,
-            self.starting_symbol,
-            self.prev_state
-        )
-        # Validate player and turn
-        if user_id not in [self.player_x, self.player_o]:
-            raise ValueError(f"User {user_id} is not a player in this game")
-
-        if user_id == self.player_x:
-            if self.turn % 2 != 1:
-                raise ValueError(f"Player X ({user_id}) can only move on turns 1, 3, 5, etc. Current turn: {self.turn}")
-            symbol = 'X'
-        else:  # user_id == self.player_o
-            if self.turn % 2 != 0:
-                raise ValueError(f"Player O ({user_id}) can only move on turns 2, 4, 6, etc. Current turn: {self.turn}")
-            symbol = 'O'
-
-        # Validate position
-        if not (0 <= position <= 8):
-            raise ValueError("Position must be between 0 and 8")
-        if self.board[position] != ' ':
-            raise ValueError("Position already taken")
-
-        # Make the move
-        self.board[position] = symbol
+        with self.lock:
+            # Validate player and turn
+            if user_id not in [self.player_x, self.player_o]:
+                raise ValueError(f"User {user_id} is not a player in this game")
+
+            if user_id == self.player_x:
+                if self.turn % 2 != 1:
+                    raise ValueError(f"Player X ({user_id}) can only move on turns 1, 3, 5, etc. Current turn: {self.turn}")
+                symbol = 'X'
+            else:  # user_id == self.player_o
+                if self.turn % 2 != 0:
+                    raise ValueError(f"Player O ({user_id}) can only move on turns 2, 4, 6, etc. Current turn: {self.turn}")
+                symbol = 'O'
+
+            # Validate position
+            if not (0 <= position <= 8):
+                raise ValueError("Position must be between 0 and 8")
+            if (self._x | self._o) >> position & 1:
+                raise ValueError("Position already taken")
+
+            self._place(position, symbol)
+            if self.game_id is not None:
+                game_journal.record_move(self.game_id, position)
+        client_logger.info(f"Player {symbol} ({user_id}) moved to position {position}")
+
+    def _place(self, position: int, symbol: str):
+        """Makes an already validated move"""
+        if symbol == 'X':
+            self._x |= 1 << position
+        else:
+            self._o |= 1 << position
         self.last_symbol = symbol
         self.turn += 1
-        self.prev_state = last_state
-        client_logger.info(f"Player {symbol} ({user_id}) moved to position {position}")
+        self._record_move(position, symbol)
+        self.last_activity = time.monotonic()
+
+    def replay(self, events: str):
+        """Reapplies the moves and undos of a game journal, X moving on odd turns"""
+        with self.lock:
+            for event in events:
+                if event == "u":
+                    self._undo()
+                    continue
+                position = int(event)
+                if (self._x | self._o) >> position & 1:
+                    raise ValueError(f"Position {position} already taken")
+                self._place(position, 'X' if self.turn % 2 == 1 else 'O')
+
+    def is_over(self) -> bool:
+        return self.last_symbol is not None and (self.winning_mask(self.last_symbol) != 0 or self.is_full())
+
+    def _record_move(self, position: int, symbol: str):
+        if config.GAME_UNDO_DEPTH <= 0:
+            return
+        if self._undo_log is None:
+            self._undo_log = [0] * config.GAME_UNDO_DEPTH
+        self._undo_log[self._undo_head] = position | (0x10 if symbol == 'O' else 0)
+        self._undo_head = (self._undo_head + 1) % len(self._undo_log)
+        self._undo_len = min(self._undo_len + 1, len(self._undo_log))
 
     def undo(self):
-        if self.prev_state:
-            return self.prev_state
-        raise ValueError("No previous game state to undo to.")
+        """Rolls back the last move in place"""
+        with self.lock:
+            self._undo()
+            if self.game_id is not None:
+                game_journal.record_undo(self.game_id)
+
+    def _undo(self):
+        if self._undo_len == 0:
+            raise ValueError("No previous game state to undo to.")
+        self._undo_head = (self._undo_head - 1) % len(self._undo_log)
+        self._undo_len -= 1
+        delta = self._undo_log[self._undo_head]
+        if delta & 0x10:
+            self._o &= ~(1 << (delta & 0xF))
+        else:
+            self._x &= ~(1 << (delta & 0xF))
+        self.turn -= 1
+        # The move before the undone one was made on turn - 1, by X on odd turns
+        if self.turn == 1:
+            self.last_symbol = None
+        else:
+            self.last_symbol = 'X' if (self.turn - 1) % 2 == 1 else 'O'
 
 
 class GameSessionManager:
@@ -103,17 +179,72 @@ class GameSessionManager:
     def __init__(self):
         self._lock = threading.Lock()
         self._sessions: Dict[str, GameState] = {}
+        # Game ID allocator: free short IDs in random order, then wide IDs. Only IDs of deleted or reaped games
+        # are freed, a finished game keeps its ID while peers may still hold it (up to GAME_FINISHED_TTL)
+        self._free_short = random.sample(range(SHORT_GAME_IDS), SHORT_GAME_IDS)
+        self._free_wide: list[int] = []
+        self._freed = set(self._free_short)  # numbers currently in either free list
+        self._next_wide = SHORT_GAME_IDS
+        self._reaped_count = 0
+
+    def allocate_game_id(self) -> str:
+        """
+        Returns an unused GAMEID. IDs in the free lists may have been taken by games a peer created,
+        those are skipped here rather than tracked on creation.
+        """
+        with self._lock:
+            while self._free_short:
+                game_id = self._pop_free(self._free_short)
+                if game_id not in self._sessions:
+                    return game_id
+            while self._free_wide:
+                game_id = self._pop_free(self._free_wide)
+                if game_id not in self._sessions:
+                    return game_id
+            while self._next_wide < MAX_GAME_IDS:
+                game_id = f"g{self._next_wide}"
+                self._next_wide += 1
+                if game_id not in self._sessions:
+                    return game_id
+            raise ValueError("No free game IDs left")
+
+    def _pop_free(self, free_list: list) -> str:
+        number = free_list.pop()
+        self._freed.discard(number)
+        return f"g{number}"
+
+    def _release_game_id(self, game_id: str):
+        number = int(game_id[1:])
+        if number in self._freed or (number >= SHORT_GAME_IDS and number >= self._next_wide):
+            return  # already free, or a wide ID the allocator has not reached yet
+        self._freed.add(number)
+        if number < SHORT_GAME_IDS:
+            self._free_short.append(number)
+        else:
+            self._free_wide.append(number)
+
+    def finish_game(self, game_id: str):
+        """Marks a game as over. Its ID is freed once reap() or delete_game() drops the game"""
+        with self._lock:
+            game = self._sessions.get(game_id)
+            if game is None or not game.active:
+                return
+            with game.lock:
+                game.active = False
+                game.last_activity = time.monotonic()
+            client_logger.debug(f"Game {game_id} finished")
 
     def get_turn(self, game_id: str) -> int:
         """Returns the current turn number for the specified game."""
         game = self.find_game(game_id)
         return game.turn
     
-    def undo(self, game_id: str) -> int:
+    def undo(self, game_id: str):
+        """Rolls back the last move of the specified game."""
         game = self.find_game(game_id)
-        prev_game_state = game.prev_state
-        if prev_game_state is not None:
-            self._sessions[game_id] = prev_game_state
+        if not game:
+            raise ValueError(f"Game with ID '{game_id}' does not exist.")
+        game.undo()
 
 
     def assign_players(self, game_id: str, player_x: str, player_o: str):
@@ -121,8 +252,11 @@ class GameSessionManager:
         game = self.find_game(game_id)
         if not game:
             raise ValueError(f"Game with ID '{game_id}' does not exist.")
-        game.player_x = player_x
-        game.player_o = player_o
+        with game.lock:
+            game.player_x = player_x
+            game.player_o = player_o
+            game.last_activity = time.monotonic()
+            game_journal.record_players(game_id, player_x, player_o)
         client_logger.info(f"Assigned {player_x} as X and {player_o} as O in game {game_id}")
 
 
@@ -148,6 +282,7 @@ class GameSessionManager:
             
             game = GameState()
             game.active = True  # Mark game as active immediately
+            game.game_id = game_id
             
             self._sessions[game_id] = game
             client_logger.info(f"Created new game with ID: {game_id} (active)")
@@ -166,10 +301,80 @@ class GameSessionManager:
         with self._lock:
             if game_id in self._sessions:
                 del self._sessions[game_id]
+                self._release_game_id(game_id)
+                game_journal.remove(game_id)
                 client_logger.info(f"Deleted game with ID: {game_id}")
                 return True
             return False
 
+    def restore_games(self, user_id):
+        """
+        Rebuilds the unfinished games `user_id` plays in by replaying their journals, then starts journaling.
+        Called once at startup, after the user ID is set and before any message is processed.
+        """
+        # Imported here: custom_types.fields imports utils.msg_format, which imports this module
+        from custom_types.fields import UserID
+        finished = []
+        for game_id, (player_x, player_o, events) in game_journal.load().items():
+            game = GameState()
+            game.active = True
+            game.game_id = game_id
+            try:
+                # The journal holds the players as text, live messages compare them as UserIDs
+                game.player_x = UserID.parse(player_x)
+                game.player_o = UserID.parse(player_o)
+            except ValueError as e:
+                client_logger.warn(f"Could not replay journal of game {game_id}: {e}")
+                finished.append(game_id)
+                continue
+            if user_id not in (game.player_x, game.player_o):
+                continue  # journaled by another user running from this directory, left for them
+            try:
+                game.replay(events)
+            except (ValueError, IndexError) as e:
+                client_logger.warn(f"Could not replay journal of game {game_id}: {e}")
+                finished.append(game_id)
+                continue
+            if game.is_over():
+                finished.append(game_id)
+                continue
+            with self._lock:
+                self._sessions[game_id] = game
+            client_logger.info(f"Restored game {game_id} ({player_x} vs {player_o}) at turn {game.turn}")
+        game_journal.start()
+        for game_id in finished:
+            game_journal.remove(game_id)
+
+    def reap(self) -> int:
+        """
+        Deletes games that finished more than GAME_FINISHED_TTL seconds ago or saw no activity for GAME_IDLE_TTL seconds.
+        Returns the number of games deleted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                game_id for game_id, game in self._sessions.items()
+                if now - game.last_activity > (config.GAME_IDLE_TTL if game.active else config.GAME_FINISHED_TTL)
+            ]
+            for game_id in expired:
+                del self._sessions[game_id]
+                self._release_game_id(game_id)
+                game_journal.remove(game_id)
+            self._reaped_count += len(expired)
+        if expired:
+            client_logger.debug(f"Reaped {len(expired)} finished or idle games: {expired}")
+        return len(expired)
+
+    def get_session_counts(self) -> Dict[str, int]:
+        """Returns the number of active and finished games held, and the number reaped so far"""
+        with self._lock:
+            active = sum(1 for game in self._sessions.values() if game.active)
+            return {
+                "active": active,
+                "finished": len(self._sessions) - active,
+                "reaped": self._reaped_count
+            }
+
     def is_active_game(self, game_id: str) -> bool:
         """
         Raises ValueError if the game doesn't exist or is not active.
@@ -192,33 +397,14 @@ class GameSessionManager:
         game = self.find_game(game_id)
         if not game or not game.last_symbol:
             return False
-        
-        symbol = game.last_symbol  
-
-        winning_combinations = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  
-            [0, 4, 8], [2, 4, 6]              
-        ]
-
-        for combo in winning_combinations:
-            if all(game.board[i] == symbol for i in combo):
-                return True
-
-        return False
+        return game.winning_mask(game.last_symbol) != 0
     
     def is_draw(self, game_id: str) -> bool:
         """Check if the game is a draw: board full and no winner."""
         game = self.find_game(game_id)
         if not game:
             return False
-
-        # If any empty space, not a draw yet
-        if ' ' in game.board:
-            return False
-
-        # Board full, no winner => draw
-        return True
+        return game.is_full()
 
     
     def find_winning_line(self, game_id: str) -> Optional[str]:
@@ -226,20 +412,7 @@ class GameSessionManager:
         game = self.find_game(game_id)
         if not game or not game.last_symbol:
             return None
-
-        symbol = game.last_symbol
-
-        winning_combinations = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Columns
-            [0, 4, 8], [2, 4, 6]              # Diagonals
-        ]
-
-        for combo in winning_combinations:
-            if all(game.board[i] == symbol for i in combo):
-                return ",".join(str(pos) for pos in combo)  
-
-        return None
+        return WINNING_LINE_STRINGS.get(game.winning_mask(game.last_symbol))
 
     def is_player(self, game_id: str, user_id: str) -> bool:
         """
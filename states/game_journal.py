@@ -0,0 +1,106 @@
+import os
+import queue
+import threading
+from typing import Dict, List, Tuple
+from client_logger import client_logger
+import config
+
+
+class GameJournal:
+    """
+    Append-only move journal, one file per GAMEID under GAME_JOURNAL_DIR.
+
+    A journal starts with "<player_x> <player_o>\\n", followed by one character per event:
+    a digit 0-8 for a move (turns alternate, so the symbol is implied) or "u" for an undone move.
+    Writes go through a queue to a background thread, so recording a move never waits on the disk.
+    Nothing is recorded until start() is called.
+    """
+
+    def __init__(self):
+        project_root = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+        self._dir = os.path.join(project_root, config.GAME_JOURNAL_DIR)
+        self._queue: queue.Queue = queue.Queue()
+        self._started = False
+
+    def _path(self, game_id: str) -> str:
+        return os.path.join(self._dir, f"{game_id}.log")
+
+    def start(self):
+        os.makedirs(self._dir, exist_ok=True)
+        self._started = True
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def record_players(self, game_id: str, player_x: str, player_o: str):
+        """Starts a new journal for `game_id`, replacing any earlier game that used the same ID"""
+        if self._started:
+            self._queue.put(("players", game_id, f"{player_x} {player_o}\n"))
+
+    def record_move(self, game_id: str, position: int):
+        if self._started:
+            self._queue.put(("append", game_id, str(position)))
+
+    def record_undo(self, game_id: str):
+        if self._started:
+            self._queue.put(("append", game_id, "u"))
+
+    def remove(self, game_id: str):
+        if self._started:
+            self._queue.put(("remove", game_id, None))
+
+    def flush(self):
+        """Waits until every recorded event is on disk, called before the client exits"""
+        if self._started:
+            self._queue.join()
+
+    def load(self) -> Dict[str, Tuple[str, str, str]]:
+        """Reads every journal, returning game_id -> (player_x, player_o, events)"""
+        journals = {}
+        if not os.path.isdir(self._dir):
+            return journals
+        for name in os.listdir(self._dir):
+            if not name.endswith(".log"):
+                continue
+            game_id = name[:-len(".log")]
+            try:
+                with open(os.path.join(self._dir, name), "r", encoding="utf-8") as f:
+                    header, _, events = f.read().partition("\n")
+                player_x, player_o = header.split(" ")
+                journals[game_id] = (player_x, player_o, events)
+            except (OSError, ValueError) as e:
+                client_logger.warn(f"Skipping unreadable game journal {name}: {e}")
+        return journals
+
+    def _write_loop(self):
+        client_logger.debug("INIT THREAD: game_journal._write_loop()")
+        while True:
+            # Drain everything queued so far and write it with one open() per game
+            batch: List[tuple] = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            files: Dict[str, object] = {}
+            for op, game_id, data in batch:
+                try:
+                    if op == "append" and game_id in files:
+                        files[game_id].write(data)
+                        continue
+                    f = files.pop(game_id, None)
+                    if f is not None:
+                        f.close()
+                    if op == "remove":
+                        if os.path.exists(self._path(game_id)):
+                            os.remove(self._path(game_id))
+                        continue
+                    files[game_id] = open(self._path(game_id), "w" if op == "players" else "a", encoding="utf-8")
+                    files[game_id].write(data)
+                except OSError as e:
+                    client_logger.error(f"Error writing game journal for {game_id}: {e}")
+            for f in files.values():
+                f.close()
+            for _ in batch:
+                self._queue.task_done()
+
+
+game_journal = GameJournal()
@@ -1 +1,285 @@
-# TODO: Add Local Group State tracking
\ No newline at end of file
+import hashlib
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from custom_types.fields import UserID
+from client_logger import client_logger
+import config
+
+
+def member_hash(member: UserID) -> int:
+  return int.from_bytes(hashlib.blake2b(str(member).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def format_digest(digest: int) -> str:
+  return f"{digest:016x}"
+
+
+class Group:
+  """
+  A group's name, members and membership version. The member tuple handed out to callers is cached until
+  membership changes.
+
+  Every membership change is stamped with the group version it happened at and kept in a bounded delta log,
+  so a member that missed updates can be sent just the changes after the version it has. `digest` is the
+  XOR of every member's hash, updated in O(1) per change, so two peers can compare membership without
+  exchanging member lists.
+  """
+
+  __slots__ = ("name", "members", "_member_tuple", "version", "digest", "_log", "_log_base")
+
+  def __init__(self, name: str, members: Set[UserID], version: int = 0):
+    self.name = name
+    self.members = members
+    self._member_tuple = None
+    self.version = version
+    self.digest = 0
+    for member in members:
+      self.digest ^= member_hash(member)
+    self._log: deque = deque(maxlen=config.GROUP_DELTA_LOG)  # (version, member, added)
+    self._log_base = version  # deltas can be served to anyone at this version or later
+
+  def member_tuple(self) -> tuple[UserID, ...]:
+    if self._member_tuple is None:
+      self._member_tuple = tuple(self.members)
+    return self._member_tuple
+
+  def _changed(self):
+    self._member_tuple = None
+
+  def _record(self, version: int, member: UserID, added: bool):
+    if len(self._log) == self._log.maxlen:
+      self._log_base = max(self._log_base, self._log[0][0])
+    self._log.append((version, member, added))
+
+  def add(self, member: UserID, version: int) -> bool:
+    if member in self.members:
+      return False
+    self.members.add(member)
+    self.digest ^= member_hash(member)
+    self._record(version, member, True)
+    self._changed()
+    return True
+
+  def discard(self, member: UserID, version: int) -> bool:
+    if member not in self.members:
+      return False
+    self.members.discard(member)
+    self.digest ^= member_hash(member)
+    self._record(version, member, False)
+    self._changed()
+    return True
+
+  def reset(self, members: Iterable[UserID], version: int):
+    """Replaces the membership with a full snapshot taken at `version`"""
+    self.members = set(members)
+    self.digest = 0
+    for member in self.members:
+      self.digest ^= member_hash(member)
+    self.version = version
+    self._log.clear()
+    self._log_base = version
+    self._changed()
+
+  def delta_since(self, have: int) -> Optional[Tuple[List[UserID], List[UserID]]]:
+    """
+    Returns the (added, removed) members that turn the membership at version `have` into the current one,
+    or None if the delta log no longer reaches back that far
+    """
+    if have < self._log_base or have > self.version:
+      return None
+    last: Dict[UserID, bool] = {}
+    for version, member, added in self._log:
+      if version > have:
+        last[member] = added
+    return ([m for m, added in last.items() if added], [m for m, added in last.items() if not added])
+
+  def __repr__(self):
+    return f"{{'name': '{self.name}', 'members': {list(self.member_tuple())}}}"
+
+
+class GroupHistory:
+  """
+  The last `depth` messages of one group in a ring buffer kept in timestamp order, so a page of history
+  is found by binary search on the timestamps and copied out in O(page size).
+  Messages normally arrive newest last and are appended in O(1); a late one is slotted into place.
+  """
+
+  __slots__ = ("_timestamps", "_messages", "_start", "_len")
+
+  def __init__(self, depth: int):
+    self._timestamps: List[int] = [0] * depth
+    self._messages: List[Any] = [None] * depth
+    self._start = 0
+    self._len = 0
+
+  def __len__(self) -> int:
+    return self._len
+
+  def _slot(self, i: int) -> int:
+    return (self._start + i) % len(self._messages)
+
+  def _bisect(self, timestamp: int, right: bool) -> int:
+    """Returns the logical index of the first message newer than (right) or not older than `timestamp`"""
+    lo, hi = 0, self._len
+    while lo < hi:
+      mid = (lo + hi) // 2
+      ts = self._timestamps[self._slot(mid)]
+      if ts < timestamp or (right and ts == timestamp):
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def add(self, timestamp: int, message: Any):
+    depth = len(self._messages)
+    if self._len and timestamp < self._timestamps[self._slot(self._len - 1)]:
+      index = self._bisect(timestamp, right=True)
+    else:
+      index = self._len
+    if self._len == depth:
+      if index == 0:
+        return  # older than everything kept
+      # Drop the oldest to make room
+      self._messages[self._start] = None
+      self._start = (self._start + 1) % depth
+      self._len -= 1
+      index -= 1
+    # Shift the newer messages up one slot, nothing moves for an in-order message
+    for i in range(self._len, index, -1):
+      src, dst = self._slot(i - 1), self._slot(i)
+      self._timestamps[dst] = self._timestamps[src]
+      self._messages[dst] = self._messages[src]
+    self._timestamps[self._slot(index)] = timestamp
+    self._messages[self._slot(index)] = message
+    self._len += 1
+
+  def page(self, before: Optional[int] = None, limit: int = 20) -> List[Tuple[int, Any]]:
+    """
+    Returns up to `limit` of the newest (timestamp, message) pairs older than `before` (None for the newest),
+    oldest first. A page never splits messages sharing a timestamp, so the oldest timestamp of one page is
+    the `before` of the next.
+    """
+    end = self._len if before is None else self._bisect(before, right=False)
+    start = max(0, end - limit)
+    while 0 < start < end and self._timestamps[self._slot(start - 1)] == self._timestamps[self._slot(start)]:
+      start -= 1
+    return [(self._timestamps[self._slot(i)], self._messages[self._slot(i)]) for i in range(start, end)]
+
+
+class GroupRegistry:
+  """
+  Groups this client is a member of, every group ID it has heard of, and a reverse index from each member
+  to the groups they are in. Not locked itself: ClientState serializes access under its own lock.
+  """
+
+  def __init__(self):
+    self._groups: Dict[str, Group] = {}
+    self._known_ids: Dict[str, None] = {}  # insertion ordered set of every group ID seen, member or not
+    self._user_groups: Dict[UserID, Set[str]] = {}
+
+  def _index(self, group_id: str, member: UserID):
+    self._user_groups.setdefault(member, set()).add(group_id)
+
+  def _unindex(self, group_id: str, member: UserID):
+    groups = self._user_groups.get(member)
+    if groups is not None:
+      groups.discard(group_id)
+      if not groups:
+        del self._user_groups[member]
+
+  def create(self, group_id: str, name: str, members: list[UserID]) -> bool:
+    """Creates the group at version 1 unless its ID is already known. Returns True if it was created"""
+    if group_id in self._known_ids:
+      return False
+    self._groups[group_id] = Group(name, set(members), version=1)
+    self._known_ids[group_id] = None
+    for member in members:
+      self._index(group_id, member)
+    return True
+
+  def ensure(self, group_id: str, name: Optional[str] = None) -> Group:
+    """Returns the group, creating it empty (named `name` or its ID) if this client has no entry for it"""
+    group = self._groups.get(group_id)
+    if group is None:
+      group = Group(name or str(group_id), set())
+      self._groups[group_id] = group
+      self._known_ids[group_id] = None
+      client_logger.debug(f"Created group: {group_id} ({group.name})")
+    return group
+
+  def remove(self, group_id: str) -> bool:
+    """Forgets the group's members. Its ID stays known, so a repeated GROUP_CREATE is still ignored"""
+    group = self._groups.pop(group_id, None)
+    if group is None:
+      return False
+    for member in group.members:
+      self._unindex(group_id, member)
+    return True
+
+  def add_known_id(self, group_id: str) -> bool:
+    if group_id in self._known_ids:
+      return False
+    self._known_ids[group_id] = None
+    return True
+
+  def is_known(self, group_id: str) -> bool:
+    return group_id in self._known_ids
+
+  def get(self, group_id: str) -> Optional[Group]:
+    return self._groups.get(group_id)
+
+  def add_member(self, group_id: str, member: UserID, version: int) -> bool:
+    """Adds `member` as part of the change to `version`. Returns True if they were not a member yet"""
+    group = self._groups[group_id]
+    group.version = max(group.version, version)
+    if not group.add(member, version):
+      return False
+    self._index(group_id, member)
+    return True
+
+  def remove_member(self, group_id: str, member: UserID, version: int) -> bool:
+    group = self._groups[group_id]
+    group.version = max(group.version, version)
+    if not group.discard(member, version):
+      return False
+    self._unindex(group_id, member)
+    return True
+
+  def reset_members(self, group_id: str, members: Iterable[UserID], version: int):
+    group = self._groups[group_id]
+    for member in group.members:
+      self._unindex(group_id, member)
+    group.reset(members, version)
+    for member in group.members:
+      self._index(group_id, member)
+
+  def digest_after(self, group_id: str, add: Iterable[UserID], remove: Iterable[UserID]) -> int:
+    """Returns the digest the group would have after adding `add` and removing `remove`"""
+    group = self._groups[group_id]
+    add, remove = set(add), set(remove)
+    digest = group.digest
+    for member in (add - group.members) - remove:
+      digest ^= member_hash(member)
+    for member in remove & group.members:
+      digest ^= member_hash(member)
+    return digest
+
+  def is_member(self, group_id: str, member: UserID) -> bool:
+    group = self._groups.get(group_id)
+    return group is not None and member in group.members
+
+  def members(self, group_id: str) -> tuple[UserID, ...]:
+    group = self._groups.get(group_id)
+    return group.member_tuple() if group is not None else ()
+
+  def groups_of(self, member: UserID) -> Set[str]:
+    return set(self._user_groups.get(member, ()))
+
+  def __len__(self) -> int:
+    return len(self._groups)
+
+  def group_ids(self) -> list[str]:
+    return list(self._known_ids)
+
+  def all(self) -> Dict[str, Group]:
+    return dict(self._groups)
@@ -0,0 +1,186 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from custom_types.fields import MessageID
+from client_logger import client_logger
+from utils.pacer import pacer
+import config
+
+
+class OutgoingTransfer:
+    """Progress of one outgoing FILE_OFFER, from negotiation to the last chunk."""
+
+    def __init__(self, offer, socket, ip: str, port: int, encoding: str):
+        self.offer = offer
+        self.socket = socket
+        self.ip = ip
+        self.port = port
+        self.encoding = encoding
+        self.state = "QUEUED"  # QUEUED, NEGOTIATING, SENDING, SENT, FAILED, CANCELLED
+        self.sent_chunks = 0
+        self.sent_bytes = 0
+        self.deficit = 0
+        self.chunks = None  # generator from offer.stream_chunks(), one chunk per next()
+        self.cancelled = threading.Event()
+        self.started = time.time()
+
+    def progress(self) -> float:
+        if self.offer.total_chunks == 0:
+            return 100.0
+        return self.sent_chunks / self.offer.total_chunks * 100
+
+    def __repr__(self):
+        return (
+            f"{self.offer.fileid} {self.offer.filename} -> {self.offer.to_user}: {self.state} "
+            f"{self.sent_chunks}/{self.offer.total_chunks} chunks ({self.progress():.1f}%)"
+        )
+
+
+class TransferManager:
+    """
+    Runs outgoing file transfers concurrently.
+
+    Offers are negotiated (FILE_OFFER and ACK wait) on a pool of worker threads, so the CLI never blocks.
+    Once acknowledged, a single pump thread streams the chunks of every active transfer using deficit
+    round robin: each transfer may send TRANSFER_QUANTUM bytes per turn, so transfers share the link fairly
+    regardless of their chunk sizes. A transfer whose destination is over its pacing rate skips its turn,
+    and the pump sleeps once every active transfer is waiting on the pacer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._transfers: Dict[MessageID, OutgoingTransfer] = {}
+        self._active: deque[OutgoingTransfer] = deque()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pump_thread: Optional[threading.Thread] = None
+
+    def submit(self, offer, socket, ip: str, port: int, encoding: str) -> OutgoingTransfer:
+        """Queues `offer` for negotiation and returns immediately"""
+        transfer = OutgoingTransfer(offer, socket, ip, port, encoding)
+        with self._lock:
+            self._prune_finished()
+            self._start()
+            self._transfers[offer.fileid] = transfer
+        self._executor.submit(self._negotiate, transfer)
+        client_logger.debug(f"Queued file transfer {offer.fileid}")
+        return transfer
+
+    def resend(self, offer, socket, chunk_indexes: List[int], port: int):
+        """Queues the chunks a receiver asked for again (FILE_RESEND) on a worker, so the caller never waits on the file or the pacer"""
+        with self._lock:
+            self._start()
+        self._executor.submit(self._resend, offer, socket, chunk_indexes, port)
+
+    def _start(self):
+        # Called with the lock held
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=config.TRANSFER_WORKERS, thread_name_prefix="transfer")
+            self._pump_thread = threading.Thread(target=self._pump, daemon=True)
+            self._pump_thread.start()
+
+    def cancel(self, file_id: MessageID):
+        """Stops an outgoing transfer, returning the receiver it was going to"""
+        with self._lock:
+            transfer = self._transfers.get(file_id)
+            if transfer is None:
+                raise ValueError(f"No outgoing transfer with file_id {file_id}")
+            if transfer.state in ("SENT", "FAILED", "CANCELLED"):
+                raise ValueError(f"Transfer {file_id} already finished ({transfer.state})")
+            transfer.cancelled.set()
+        client_logger.info(f"Cancelling file transfer {file_id}")
+        return transfer.offer.to_user
+
+    def get_transfers(self) -> List[OutgoingTransfer]:
+        with self._lock:
+            return list(self._transfers.values())
+
+    def _prune_finished(self):
+        # Finished transfers stay listed for a while so their outcome can be checked
+        cutoff = time.time() - config.TRANSFER_HISTORY
+        for file_id, transfer in list(self._transfers.items()):
+            if transfer.state in ("SENT", "FAILED", "CANCELLED") and transfer.started < cutoff:
+                del self._transfers[file_id]
+
+    def _negotiate(self, transfer: OutgoingTransfer):
+        try:
+            transfer.state = "NEGOTIATING"
+            if not transfer.offer.negotiate(transfer.socket, transfer.ip, transfer.port, transfer.encoding):
+                self._finish(transfer, "FAILED")
+                return
+            if transfer.cancelled.is_set():
+                self._finish(transfer, "CANCELLED")
+                return
+            transfer.chunks = transfer.offer.stream_chunks(transfer.port)
+            with self._lock:
+                transfer.state = "SENDING"
+                self._active.append(transfer)
+                self._ready.notify()
+        except Exception as e:
+            client_logger.error(f"Error negotiating file transfer {transfer.offer.fileid}: {e}")
+            self._finish(transfer, "FAILED")
+
+    def _resend(self, offer, socket, chunk_indexes: List[int], port: int):
+        try:
+            offer.resend_chunks(socket, chunk_indexes, port)
+        except Exception as e:
+            client_logger.error(f"Error resending chunks of file {offer.fileid}: {e}")
+
+    def _pump(self):
+        client_logger.debug("INIT THREAD: transfer_manager._pump()")
+        paced = 0  # consecutive turns skipped because the destination was over its rate
+        next_ready = None
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._ready.wait()
+                if paced >= len(self._active):
+                    # Every transfer is waiting on the pacer, sleep until the first one may send (or a new one arrives)
+                    self._ready.wait(next_ready)
+                    paced, next_ready = 0, None
+                transfer = self._active.popleft()
+
+            if transfer.cancelled.is_set():
+                self._finish(transfer, "CANCELLED")
+                continue
+
+            delay = pacer.delay(transfer.ip)
+            if delay > 0:
+                paced += 1
+                next_ready = delay if next_ready is None else min(next_ready, delay)
+                with self._lock:
+                    self._active.append(transfer)
+                continue
+            paced, next_ready = 0, None
+
+            transfer.deficit += config.TRANSFER_QUANTUM
+            try:
+                while transfer.deficit > 0:
+                    sent = next(transfer.chunks)
+                    transfer.sent_chunks += 1
+                    transfer.sent_bytes += sent
+                    transfer.deficit -= sent
+            except StopIteration:
+                self._finish(transfer, "SENT")
+                continue
+            except Exception as e:
+                client_logger.error(f"Error sending chunks for file {transfer.offer.fileid}: {e}")
+                self._finish(transfer, "FAILED")
+                continue
+
+            with self._lock:
+                self._active.append(transfer)
+
+    def _finish(self, transfer: OutgoingTransfer, state: str):
+        transfer.state = state
+        transfer.deficit = 0
+        if transfer.chunks is not None:
+            transfer.chunks.close()
+        if state != "SENT":
+            transfer.offer.abort()
+        client_logger.debug(f"File transfer {transfer.offer.fileid} finished: {state}")
+
+
+transfer_manager = TransferManager()
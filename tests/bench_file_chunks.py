@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from array import array
+from custom_types.fields import UserID, Token, Timestamp, MessageID
+from states.client_state import client_state
+from messages.file_chunk import FileChunk
+from utils.msg_file_transfer import chunk_file, read_chunks_into
+from utils import msg_format
+
+# Compares the legacy FILE_CHUNK send path (FileChunk object per chunk) against ChunkFramer.
+# Reports wall time, the memory blocks allocated per chunk and the peak transient memory per chunk.
+# e.g. python -m tests.bench_file_chunks
+
+FILESIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 1024
+
+def legacy_path(filepath, to_user, fileid, total_chunks, token, sink):
+  for i, chunk in enumerate(chunk_file(filepath, CHUNK_SIZE)):
+    chunk_msg = FileChunk(to_user, fileid, i, total_chunks, CHUNK_SIZE, token, chunk)
+    sink(msg_format.serialize_message(chunk_msg.payload).encode("utf-8"))
+
+def framer_path(filepath, to_user, fileid, total_chunks, token, sink):
+  framer = FileChunk.framer(to_user, fileid, total_chunks, CHUNK_SIZE, token)
+  for i, chunk in enumerate(read_chunks_into(filepath, CHUNK_SIZE)):
+    sink(framer.frame(i, chunk))
+
+class AllocationCounter:
+  """
+  Counts memory blocks allocated while Python runs, including short-lived ones: sys.getallocatedblocks() is
+  read before every bytecode instruction (sys.monitoring) and every increase is added up. A temporary freed
+  within the same instruction that allocated it is not seen. The counter's own state lives in arrays, so
+  reading it allocates nothing that outlives the callback.
+  """
+
+  def __init__(self):
+    self._last = array("q", [0])
+    self._total = array("q", [0])
+
+  def _on_instruction(self, code, offset):
+    now = sys.getallocatedblocks()
+    # +1: `now` is still alive when _last is read below, and freed before the next instruction
+    grown = now - self._last[0] + 1
+    if grown > 0:
+      self._total[0] += grown
+    self._last[0] = sys.getallocatedblocks()
+
+  def count(self, fn, *args) -> int:
+    tool = sys.monitoring.PROFILER_ID
+    sys.monitoring.use_tool_id(tool, "bench_file_chunks")
+    sys.monitoring.register_callback(tool, sys.monitoring.events.INSTRUCTION, self._on_instruction)
+    self._total[0] = 0
+    self._last[0] = sys.getallocatedblocks()
+    sys.monitoring.set_events(tool, sys.monitoring.events.INSTRUCTION)
+    try:
+      fn(*args)
+    finally:
+      sys.monitoring.set_events(tool, 0)
+      sys.monitoring.register_callback(tool, sys.monitoring.events.INSTRUCTION, None)
+      sys.monitoring.free_tool_id(tool)
+    return self._total[0]
+
+def measure(name, path, *args):
+  chunks = [0]
+  def sink(datagram):
+    chunks[0] += 1
+
+  start = time.perf_counter()
+  path(*args, lambda d: None)
+  elapsed = time.perf_counter() - start
+
+  allocations = AllocationCounter().count(path, *args, sink)
+
+  peaks = []
+  def peak_sink(datagram):
+    _, peak = tracemalloc.get_traced_memory()
+    peaks.append(peak - baseline[0])
+    tracemalloc.reset_peak()
+    baseline[0] = tracemalloc.get_traced_memory()[0]
+
+  baseline = [0]
+  tracemalloc.start()
+  baseline[0] = tracemalloc.get_traced_memory()[0]
+  path(*args, peak_sink)
+  tracemalloc.stop()
+
+  print(f"{name}: {elapsed * 1000:.1f} ms, {chunks[0]} chunks, "
+        f"{allocations / chunks[0]:.1f} allocations and {sum(peaks) / len(peaks):.0f} bytes peak transient memory per chunk")
+
+def main():
+  client_state.set_user_id("alice@127.0.0.1")
+  to_user = UserID("bob", "127.0.0.2")
+  fileid = MessageID.generate()
+  token = Token(client_state.get_user_id(), Timestamp(int(time.time())) + 3600, Token.Scope.FILE)
+  total_chunks = -(-FILESIZE // CHUNK_SIZE)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    filepath = os.path.join(tmp, "payload.bin")
+    with open(filepath, "wb") as f:
+      f.write(os.urandom(FILESIZE))
+
+    # Both paths must produce identical datagrams
+    legacy, framed = [], []
+    legacy_path(filepath, to_user, fileid, total_chunks, token, legacy.append)
+    framer_path(filepath, to_user, fileid, total_chunks, token, lambda d: framed.append(bytes(d)))
+    assert legacy == framed, "ChunkFramer output differs from FileChunk serialization"
+
+    args = (filepath, to_user, fileid, total_chunks, token)
+    measure("legacy", legacy_path, *args)
+    measure("framer", framer_path, *args)
+
+if __name__ == "__main__":
+  main()
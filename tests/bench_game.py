@@ -0,0 +1,61 @@
+import random
+import time
+import tracemalloc
+from states.game import GameSessionManager
+from client_logger import client_logger
+
+# Plays 10k concurrent TicTacToe games through the GameSessionManager API, one move per game per round,
+# and reports moves/sec and the memory held per session.
+# e.g. python -m tests.bench_game
+
+GAMES = 10_000
+PLAYER_X = "alice@127.0.0.1"
+PLAYER_O = "bob@127.0.0.2"
+
+def create_games(manager):
+  for i in range(GAMES):
+    game_id = f"bench{i}"
+    manager.create_game(game_id)
+    manager.assign_players(game_id, PLAYER_X, PLAYER_O)
+
+def play_games(manager, rng) -> int:
+  """Plays every game to the end one round at a time, returns the number of moves made"""
+  open_positions = {f"bench{i}": list(range(9)) for i in range(GAMES)}
+  moves = 0
+  while open_positions:
+    for game_id, positions in list(open_positions.items()):
+      game = manager.find_game(game_id)
+      player = PLAYER_X if game.turn % 2 == 1 else PLAYER_O
+      game.move(player, positions.pop(rng.randrange(len(positions))))
+      moves += 1
+      if manager.is_winning_move(game_id):
+        manager.find_winning_line(game_id)
+        del open_positions[game_id]
+      elif manager.is_draw(game_id):
+        del open_positions[game_id]
+  return moves
+
+def main():
+  # Per-move console output would dominate the timings
+  client_logger.info = lambda message: None
+
+  manager = GameSessionManager()
+  create_games(manager)
+  start = time.perf_counter()
+  moves = play_games(manager, random.Random(0))
+  elapsed = time.perf_counter() - start
+  print(f"{GAMES} games, {moves} moves in {elapsed:.3f}s: {moves / elapsed:,.0f} moves/sec")
+
+  tracemalloc.start()
+  base = tracemalloc.get_traced_memory()[0]
+  manager = GameSessionManager()
+  create_games(manager)
+  created = tracemalloc.get_traced_memory()[0]
+  play_games(manager, random.Random(0))
+  finished = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  print(f"memory per session: {(created - base) / GAMES:.0f} bytes new, "
+        f"{(finished - base) / GAMES:.0f} bytes after the game (incl. undo history)")
+
+if __name__ == "__main__":
+  main()
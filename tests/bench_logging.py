@@ -0,0 +1,37 @@
+import time
+from client_logger import client_logger
+from states.client_state import client_state
+from messages.post import Post
+
+# Measures the CPU time router.send_message spends logging one message in non-verbose mode,
+# formatting the payload eagerly with an f-string vs passing a deferred template.
+# e.g. python -m tests.bench_logging
+
+MESSAGES = 200_000
+DEST = ("192.168.1.20", 50999)
+
+def eager(message_obj):
+  for _ in range(MESSAGES):
+    client_logger.send(f"MESSAGE: {message_obj.payload} TO ({DEST[0]}, {DEST[1]})")
+
+def deferred(message_obj):
+  for _ in range(MESSAGES):
+    client_logger.send("MESSAGE: {0.payload} TO ({1}, {2})", message_obj, DEST[0], DEST[1])
+
+def measure(fn, message_obj) -> float:
+  start = time.process_time()
+  fn(message_obj)
+  return (time.process_time() - start) / MESSAGES * 1_000_000
+
+def main():
+  client_state.set_user_id("alice@127.0.0.1")
+  message_obj = Post("Hello, world!")
+  client_logger.set_verbose(False)
+  eager_us = measure(eager, message_obj)
+  deferred_us = measure(deferred, message_obj)
+  print(f"non-verbose, eager f-string:    {eager_us:.2f} us CPU per message")
+  print(f"non-verbose, deferred template: {deferred_us:.2f} us CPU per message")
+  print(f"saved: {eager_us - deferred_us:.2f} us per message ({(1 - deferred_us / eager_us) * 100:.0f}%)")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,127 @@
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import config
+from custom_types.fields import UserID
+from states.client_state import client_state
+from states.file_state import file_state
+from states.transfer_manager import transfer_manager
+from messages.file_offer import FileOffer
+from utils.pacer import pacer
+
+# Measures interactive message latency while a file transfer runs, with and without pacing.
+# The file goes through the real send path: TransferManager's pump, FileOffer.stream_chunks and the shared
+# pacer. Only the FILE_OFFER/ACK handshake is skipped. The receiver handles every datagram on one socket
+# in arrival order, like client.py, so an unpaced transfer queues up ahead of interactive messages (and
+# overruns the receive buffer).
+# e.g. python -m tests.bench_pacing
+
+DURATION = 3
+FILESIZE = 4 * 1024 * 1024 * 1024  # sparse, longer than any run so the transfer is cancelled rather than done
+CHUNK_SIZE = 1400
+PING = b"PING"
+PROCESS_COST = 0.00002  # seconds the receiver spends on each bulk datagram
+
+def receiver(sock, stats, stop):
+  while not stop.is_set():
+    try:
+      data, address = sock.recvfrom(65535)
+    except socket.timeout:
+      continue
+    except OSError:
+      return
+    if data == PING:
+      sock.sendto(PING, address)
+    else:
+      stats["bulk"] += 1
+      end = time.perf_counter() + PROCESS_COST
+      while time.perf_counter() < end:
+        pass
+
+def negotiated(offer):
+  # Stands in for FileOffer.negotiate once the receiver has ACKed the BINARY feature
+  def negotiate(socket, ip, port, encoding):
+    offer._prepare_chunks(["BINARY"], encoding)
+    file_state.add_outgoing_transfer(offer.fileid, offer)
+    return True
+  return negotiate
+
+def run(name, filepath):
+  pacer.__init__()  # picks up the PACE_* rates set for this run
+  recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * 1024)
+  recv_sock.bind(("127.0.0.1", 0))
+  recv_sock.settimeout(0.1)
+  dest = recv_sock.getsockname()
+  stats = {"bulk": 0}
+  stop = threading.Event()
+  threading.Thread(target=receiver, args=(recv_sock, stats, stop), daemon=True).start()
+
+  offer = FileOffer(UserID.parse(f"bob@{dest[0]}"), filepath, chunk_size=CHUNK_SIZE)
+  offer.negotiate = negotiated(offer)
+  transfer = transfer_manager.submit(offer, None, dest[0], dest[1], config.ENCODING)
+
+  ping_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  ping_sock.settimeout(1)
+  latencies, lost = [], 0
+  end = time.time() + DURATION
+  while time.time() < end:
+    start = time.perf_counter()
+    ping_sock.sendto(PING, dest)
+    try:
+      ping_sock.recvfrom(16)
+      latencies.append((time.perf_counter() - start) * 1000)
+    except socket.timeout:
+      lost += 1
+    time.sleep(0.02)
+  transfer_manager.cancel(offer.fileid)
+  while transfer.state != "CANCELLED":
+    time.sleep(0.01)
+  time.sleep(0.2)
+  stop.set()
+  recv_sock.close()
+  ping_sock.close()
+
+  latencies.sort()
+  p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan")
+  median = statistics.median(latencies) if latencies else float("nan")
+  print(f"{name}: interactive p50 {median:.2f} ms, p99 {p99:.2f} ms, {lost} lost | "
+        f"bulk {transfer.sent_bytes / DURATION / 1024:.0f} KiB/s sent, "
+        f"{stats['bulk'] / max(transfer.sent_chunks, 1) * 100:.1f}% delivered")
+
+def main():
+  client_state.set_user_id("alice@127.0.0.1")
+  # stream_chunks sends from the client's unicast socket, bound to CLIENT_IP:PORT
+  config.CLIENT_IP = "127.0.0.1"
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+    probe.bind(("127.0.0.1", 0))
+    config.PORT = probe.getsockname()[1]
+  config.FILE_COMPRESSION = False
+  filepath = os.path.join(tempfile.mkdtemp(), "bulk.bin")
+  with open(filepath, "wb") as f:
+    f.truncate(FILESIZE)
+
+  try:
+    config.PACE_PEER_RATE = config.PACE_GLOBAL_RATE = 0
+    run("unpaced", filepath)
+    config.PACE_PEER_RATE = 8 * 1024 * 1024
+    config.PACE_GLOBAL_RATE = 16 * 1024 * 1024
+    run(f"paced {config.PACE_PEER_RATE // 1024} KiB/s", filepath)
+    config.PACE_PEER_RATE = 2 * 1024 * 1024
+    run(f"paced {config.PACE_PEER_RATE // 1024} KiB/s", filepath)
+  finally:
+    os.remove(filepath)
+
+  # Buckets of peers no longer sent to are dropped once they refill
+  for i in range(1000):
+    pacer.consume(f"10.0.{i // 256}.{i % 256}", CHUNK_SIZE)
+  with pacer._lock:
+    pacer._prune(time.monotonic() + config.PACE_BURST / config.PACE_PEER_RATE + 1)
+  assert not pacer._destinations, f"{len(pacer._destinations)} idle pacing buckets kept"
+  print("1000 idle pacing buckets dropped")
+
+if __name__ == "__main__":
+  main()
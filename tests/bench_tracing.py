@@ -0,0 +1,52 @@
+import io
+import json
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+import config
+import router
+from states.client_state import client_state
+from messages.post import Post
+from utils import msg_format, tracing
+
+# Measures what router.recv_message costs per POST with tracing off and with the Chrome trace sink on,
+# then checks the trace file loads as JSON and holds every stage of the receive pipeline.
+# e.g. python -m tests.bench_tracing
+
+MESSAGES = 20_000
+ADDRESS = ("127.0.0.1", 50999)
+STAGES = {"decode", "extract_message_type", "receive", "deserialize_message", "recv_queue_wait"}
+
+def measure(raw: bytes) -> float:
+  start = time.perf_counter()
+  for _ in range(MESSAGES):
+    router.recv_message(raw, ADDRESS)
+  return (time.perf_counter() - start) / MESSAGES * 1_000_000
+
+def main():
+  with redirect_stdout(io.StringIO()):
+    router.load_messages(config.MESSAGES_DIR)
+  client_state.set_user_id("alice@127.0.0.1")
+  raw = msg_format.serialize_message(Post("Hello, world!").payload).encode(config.ENCODING)
+
+  off_us = measure(raw)
+  path = os.path.join(tempfile.mkdtemp(), "trace.json")
+  sink = tracing.start_chrome_trace(path)
+  on_us = measure(raw)
+  time.sleep(0.5)  # spans written by an earlier batch, then more in a later one
+  received_at = time.perf_counter()
+  tracing.record("recv_queue_wait", received_at, time.perf_counter())
+  router.recv_message(raw, ADDRESS)
+  tracing.stop_chrome_trace(sink)
+
+  with open(path, encoding="utf-8") as f:
+    events = json.load(f)
+  names = {e["name"] for e in events}
+  assert STAGES <= names, f"missing stages: {STAGES - names}"
+  print(f"tracing off: {off_us:.2f} us per POST")
+  print(f"tracing on:  {on_us:.2f} us per POST")
+  print(f"{len(events)} trace events in {path}, stages: {sorted(names)}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+from custom_types.fields import UserID
+from states.game import GameSessionManager
+from states.game_journal import game_journal
+
+# Replays game journals the way a restart does for bob, then checks the restored game still accepts its
+# players' moves, which arrive as UserIDs in TICTACTOE_MOVE.
+# e.g. python -m tests.game_restore
+
+GAME_ID = "g7"
+OTHER_GAME_ID = "g8"
+PLAYER_X = UserID.parse("alice@10.0.0.1")
+PLAYER_O = UserID.parse("bob@10.0.0.2")
+
+def main():
+  game_journal._dir = tempfile.mkdtemp()
+  with open(os.path.join(game_journal._dir, f"{GAME_ID}.log"), "w", encoding="utf-8") as f:
+    f.write(f"{PLAYER_X} {PLAYER_O}\n4")  # X took the center before the restart
+  with open(os.path.join(game_journal._dir, f"{OTHER_GAME_ID}.log"), "w", encoding="utf-8") as f:
+    f.write("carol@10.0.0.3 dave@10.0.0.4\n0")
+
+  manager = GameSessionManager()
+  manager.restore_games(PLAYER_O)
+  game = manager.find_game(GAME_ID)
+  assert game and game.turn == 2, "journal was not replayed"
+  assert not manager.find_game(OTHER_GAME_ID), "restored a game this user is not playing in"
+  assert os.path.exists(os.path.join(game_journal._dir, f"{OTHER_GAME_ID}.log")), "removed another user's journal"
+  assert manager.is_player(GAME_ID, PLAYER_O)
+  game.move(PLAYER_O, 0)
+  game.move(PLAYER_X, 8)
+  game_journal.flush()
+  with open(os.path.join(game_journal._dir, f"{GAME_ID}.log"), encoding="utf-8") as f:
+    assert f.read().endswith("\n408"), "moves after the restore were not journaled"
+  print(f"restored {GAME_ID} at turn 2, {PLAYER_O} and {PLAYER_X} moved, now at turn {game.turn}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,202 @@
+import argparse
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+import config
+
+# Segment files start with SEGMENT_MAGIC, followed by one record per datagram:
+# RECORD_HEADER (timestamp, direction, IPv4 address, port, length) and then the raw datagram bytes.
+SEGMENT_MAGIC = b"LSNPCAP\x01"
+RECORD_HEADER = struct.Struct("!dB4sHI")
+SEGMENT_PREFIX = "capture-"
+SEGMENT_SUFFIX = ".lsnpcap"
+INBOUND = 0
+OUTBOUND = 1
+
+# Binary frame kinds (see the messages' __frame__), so captured frames can be filtered by TYPE too
+FRAME_TYPES = {0x01: "FILE_CHUNK"}
+
+# CAPTURE_DIR is relative to the project root, not to where the client or reader was started
+PROJECT_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+class PacketCapture:
+    """
+    Records every datagram sent or received into size-capped segment files under CAPTURE_DIR, keeping only
+    the newest CAPTURE_SEGMENTS of them. Recording only queues the datagram; a background thread writes it,
+    and datagrams arriving while CAPTURE_QUEUE are already waiting are dropped and counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: queue.Queue = None
+        self._dropped = 0
+        self._dir = None
+        self._file = None
+        self._file_size = 0
+        self._segments: List[str] = []
+
+    def record(self, direction: int, data: bytes, address: tuple):
+        if self._records is None:
+            with self._lock:
+                if self._records is None:
+                    self._records = queue.Queue(maxsize=config.CAPTURE_QUEUE)
+                    threading.Thread(target=self._write_loop, name="packet_capture", daemon=True).start()
+        try:
+            self._records.put_nowait((time.time(), direction, bytes(data), address))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def pending(self) -> int:
+        return 0 if self._records is None else self._records.qsize()
+
+    def flush(self):
+        """Waits until every recorded datagram is on disk, called before the client exits"""
+        if self._records is not None:
+            self._records.join()
+
+    def _open_segment(self):
+        if self._file is not None:
+            file, self._file = self._file, None
+            file.close()
+        while len(self._segments) >= config.CAPTURE_SEGMENTS:
+            oldest = self._segments.pop(0)
+            if os.path.exists(oldest):
+                os.remove(oldest)
+        number = int(os.path.basename(self._segments[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if self._segments else 0
+        path = os.path.join(self._dir, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+        file = open(path, "wb")
+        self._segments.append(path)
+        file.write(SEGMENT_MAGIC)
+        self._file = file
+        self._file_size = len(SEGMENT_MAGIC)
+
+    def _write_loop(self):
+        # Imported here so the reader below can run alongside a client without truncating its app.log
+        from client_logger import client_logger
+        client_logger.debug("INIT THREAD: packet_capture._write_loop()")
+        self._dir = os.path.join(PROJECT_ROOT, config.CAPTURE_DIR)
+        # Continue numbering after the segments of earlier runs, they count towards the cap too
+        self._segments = segment_paths(self._dir)
+        while True:
+            batch = [self._records.get()]
+            while True:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                os.makedirs(self._dir, exist_ok=True)
+                for timestamp, direction, data, address in batch:
+                    try:
+                        ip = socket.inet_aton(address[0])
+                    except OSError:
+                        ip = bytes(4)
+                    frame = RECORD_HEADER.pack(timestamp, direction, ip, address[1], len(data)) + data
+                    if self._file is None or self._file_size + len(frame) > config.CAPTURE_SEGMENT_BYTES:
+                        self._open_segment()
+                    self._file.write(frame)
+                    self._file_size += len(frame)
+                self._file.flush()
+                with self._lock:
+                    dropped, self._dropped = self._dropped, 0
+                if dropped:
+                    client_logger.warn(f"Packet capture queue full, {dropped} datagrams not captured")
+            except Exception as e:
+                # Start a new segment with the next batch, and keep draining the queue, flush() waits on it
+                client_logger.error(f"Error writing packet capture: {e}")
+                if self._file is not None:
+                    file, self._file = self._file, None
+                    try:
+                        file.close()
+                    except Exception:
+                        pass
+            finally:
+                for _ in batch:
+                    self._records.task_done()
+
+
+class CaptureSocket(socket.socket):
+    """A UDP socket that records every datagram it sends and receives to `packet_capture`"""
+
+    def sendto(self, data, *args):
+        sent = super().sendto(data, *args)
+        packet_capture.record(OUTBOUND, data, args[-1])
+        return sent
+
+    def recvfrom(self, *args):
+        data, address = super().recvfrom(*args)
+        packet_capture.record(INBOUND, data, address)
+        return data, address
+
+
+packet_capture = PacketCapture()
+
+
+def segment_paths(directory: str) -> List[str]:
+    """Returns the capture segments in `directory`, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, n) for n in names]
+
+
+def read_segment(path: str) -> Iterator[Tuple[float, int, str, int, bytes]]:
+    """Yields (timestamp, direction, ip, port, datagram) for each record, stopping at a truncated tail"""
+    with open(path, "rb") as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a packet capture segment")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, direction, ip, port, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, direction, socket.inet_ntoa(ip), port, data
+
+
+def message_type(data: bytes) -> str:
+    if len(data) >= 2 and data[0] == 0x00:
+        return FRAME_TYPES.get(data[1], f"FRAME_{data[1]:#04x}")
+    first_line = data.split(b"\n", 1)[0].decode(config.ENCODING, errors="replace")
+    return first_line[6:].strip() if first_line.startswith("TYPE: ") else "?"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Print datagrams recorded by the packet capture")
+    parser.add_argument("--dir", default=os.path.join(PROJECT_ROOT, config.CAPTURE_DIR), help="Directory holding the capture segments")
+    parser.add_argument("--type", action="append", help="Only show this message TYPE (repeatable)")
+    parser.add_argument("--peer", action="append", help="Only show datagrams to or from this IP (repeatable)")
+    parser.add_argument("--direction", choices=["in", "out"], help="Only show received (in) or sent (out) datagrams")
+    parser.add_argument("--payload", action="store_true", help="Also print each text message")
+    args = parser.parse_args(argv)
+
+    types = {t.upper() for t in args.type} if args.type else None
+    peers = set(args.peer) if args.peer else None
+    direction = {"in": INBOUND, "out": OUTBOUND}.get(args.direction)
+    for path in segment_paths(args.dir):
+        for timestamp, record_direction, ip, port, data in read_segment(path):
+            msg_type = message_type(data)
+            if types is not None and msg_type not in types:
+                continue
+            if peers is not None and ip not in peers:
+                continue
+            if direction is not None and record_direction != direction:
+                continue
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp * 1000) % 1000:03d}"
+            arrow = "<" if record_direction == INBOUND else ">"
+            print(f"{when} {arrow} {ip}:{port} {msg_type} ({len(data)} bytes)")
+            if args.payload and data[:1] != b"\x00":
+                sys.stdout.write(data.decode(config.ENCODING, errors="replace").rstrip("\n") + "\n\n")
+
+
+if __name__ == "__main__":
+    main()
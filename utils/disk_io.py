@@ -0,0 +1,78 @@
+import os
+import queue
+import threading
+from typing import Callable, Iterable, List
+from client_logger import client_logger
+import config
+
+
+def write_file_atomic(filepath: str, chunks: Iterable[bytes]):
+    """
+    Writes `chunks` to a temporary file next to `filepath`, fsyncs it and renames it into place,
+    so `filepath` is either absent or complete even if the process dies mid-write.
+    """
+    directory, filename = os.path.split(filepath)
+    part_path = os.path.join(directory, f".{filename}.part")
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_path, filepath)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    if os.name != 'nt':  # persist the rename itself, directories can't be opened on Windows
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class DiskIO:
+    """
+    Runs disk I/O (spooling and hashing received chunks, writing received files) on a small pool of
+    worker threads fed by a bounded queue.
+    `submit` never blocks: when DISK_IO_QUEUE tasks are already waiting it raises queue.Full,
+    so message processing threads can hand off writes without ever waiting on the disk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks: queue.Queue = None
+        self._workers: List[threading.Thread] = []
+
+    def submit(self, fn: Callable, *args):
+        with self._lock:
+            if self._tasks is None:
+                self._tasks = queue.Queue(maxsize=config.DISK_IO_QUEUE)
+                for i in range(config.DISK_IO_WORKERS):
+                    worker = threading.Thread(target=self._work, name=f"disk_io_{i}", daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+        self._tasks.put_nowait((fn, args))
+
+    def pending(self) -> int:
+        return 0 if self._tasks is None else self._tasks.qsize()
+
+    def shutdown(self):
+        """Waits for every submitted task to finish, called before the client exits"""
+        if self._tasks is not None:
+            self._tasks.join()
+
+    def _work(self):
+        client_logger.debug(f"INIT THREAD: {threading.current_thread().name}")
+        while True:
+            fn, args = self._tasks.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                client_logger.error(f"Error in disk I/O task {fn.__name__}: {e}")
+            finally:
+                self._tasks.task_done()
+
+
+disk_io = DiskIO()
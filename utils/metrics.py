@@ -0,0 +1,253 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from client_logger import client_logger
+
+# Prefix of every metric name in the Prometheus export
+EXPORT_PREFIX = "lsnp_"
+
+# Histogram bucket upper bounds in seconds: 10us doubling up to ~42s, plus an overflow bucket
+DEFAULT_BUCKETS = tuple(0.00001 * 2 ** i for i in range(23))
+
+LabelValues = Union[str, Tuple[str, ...]]
+
+
+class Counter:
+    """A monotonically increasing count per label value (e.g. per message TYPE)"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: LabelValues = "", amount: int = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self) -> Dict[LabelValues, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """
+    Counts observations (in seconds) into fixed buckets per label value, so recording is a bisect and three
+    additions and quantiles can be estimated from the bucket counts
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[LabelValues, list] = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, label_values: LabelValues = ""):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def snapshot(self) -> Dict[LabelValues, Tuple[List[int], float, int]]:
+        """Returns label values -> (bucket counts, sum, count)"""
+        with self._lock:
+            return {labels: (list(s[0]), s[1], s[2]) for labels, s in self._series.items()}
+
+    def quantile(self, bucket_counts: List[int], count: int, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q-th quantile (inf if it is the overflow bucket)"""
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(bucket_counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return 0.0
+
+
+class Gauge:
+    """A value read from `fn` only when the metrics are shown or exported, so it costs nothing in between"""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def value(self) -> float:
+        try:
+            return self.fn()
+        except Exception:
+            return float("nan")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Counter] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._gauges: Dict[str, Gauge] = {}
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter(name, help, labels)
+            return self._counters[name]
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, help, labels)
+            return self._histograms[name]
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        """Registers (or replaces) the gauge `name`"""
+        with self._lock:
+            self._gauges[name] = Gauge(name, help, fn)
+            return self._gauges[name]
+
+    def get_counters(self) -> List[Counter]:
+        with self._lock:
+            return list(self._counters.values())
+
+    def get_histograms(self) -> List[Histogram]:
+        with self._lock:
+            return list(self._histograms.values())
+
+    def get_gauges(self) -> List[Gauge]:
+        with self._lock:
+            return list(self._gauges.values())
+
+
+class AckTimer:
+    """Remembers when messages awaiting an ACK were last sent and records the round trip once the ACK arrives"""
+
+    def __init__(self, histogram: Histogram, limit: int = 1024):
+        self._histogram = histogram
+        self._limit = limit
+        self._sent: OrderedDict = OrderedDict()  # message id -> (perf_counter at send, TYPE)
+        self._lock = threading.Lock()
+
+    def sent(self, message_id, msg_type: str):
+        with self._lock:
+            self._sent.pop(str(message_id), None)
+            self._sent[str(message_id)] = (time.perf_counter(), msg_type)
+            if len(self._sent) > self._limit:
+                self._sent.popitem(last=False)  # never acknowledged
+
+    def acked(self, message_id):
+        with self._lock:
+            entry = self._sent.pop(str(message_id), None)
+        if entry is not None:
+            self._histogram.observe(time.perf_counter() - entry[0], entry[1])
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], label_values: LabelValues, extra: str = "") -> str:
+    values = (label_values,) if isinstance(label_values, str) else label_values
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def exposition(registry: MetricsRegistry) -> str:
+    """
+    Renders every metric in the Prometheus text exposition format. Each metric is copied under its own lock
+    and each gauge is read on its own, so no lock is held for longer than one metric takes to copy.
+    """
+    lines = []
+    for counter in registry.get_counters():
+        name = f"{EXPORT_PREFIX}{counter.name}_total"
+        lines.append(f"# HELP {name} {counter.help}")
+        lines.append(f"# TYPE {name} counter")
+        for label_values, value in sorted(counter.values().items()):
+            lines.append(f"{name}{_format_labels(counter.labels, label_values)} {value}")
+    for histogram in registry.get_histograms():
+        name = f"{EXPORT_PREFIX}{histogram.name}"
+        lines.append(f"# HELP {name} {histogram.help}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_values, (bucket_counts, total, count) in sorted(histogram.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{name}_bucket{_format_labels(histogram.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(histogram.labels, label_values)
+            lines.append(f"{name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{name}_count{labels} {count}")
+    for gauge in registry.get_gauges():
+        name = f"{EXPORT_PREFIX}{gauge.name}"
+        lines.append(f"# HELP {name} {gauge.help}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(gauge.value())}")
+    return "\n".join(lines) + "\n"
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = exposition(self.registry).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # every scrape would otherwise be printed to stderr
+
+
+def start_export_server(registry: MetricsRegistry, port: int) -> Optional[HTTPServer]:
+    """
+    Serves `registry` at http://127.0.0.1:`port`/metrics from a background thread, one scrape at a time.
+    Only loopback is bound, so the metrics are never exposed to the LAN. Returns None if the port is taken.
+    """
+    handler = type("ExportHandler", (_ExportHandler,), {"registry": registry})
+    try:
+        server = HTTPServer(("127.0.0.1", port), handler)
+    except OSError as e:
+        client_logger.error(f"Could not serve metrics on 127.0.0.1:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics_export", daemon=True).start()
+    client_logger.debug(f"INIT THREAD: metrics export on 127.0.0.1:{port}")
+    return server
+
+
+metrics = MetricsRegistry()
+
+messages_received = metrics.counter("messages_received", "Messages received and handled", ("type",))
+messages_dropped = metrics.counter("messages_dropped", "Datagrams dropped", ("type", "reason"))
+messages_sent = metrics.counter("messages_sent", "Datagrams sent", ("type",))
+messages_retransmitted = metrics.counter("messages_retransmitted", "Datagrams sent again after no ACK or a FILE_RESEND", ("type",))
+decode_seconds = metrics.histogram("decode_seconds", "Decoding a datagram and looking up its TYPE, before any field is parsed", ("type",))
+receive_seconds = metrics.histogram("receive_seconds", "Running the TYPE's receive(): deserializing, field parsing, token checks and the handler", ("type",))
+queue_wait_seconds = metrics.histogram("queue_wait_seconds", "Time a received datagram waited in recv_queue")
+ack_rtt_seconds = metrics.histogram("ack_rtt_seconds", "Time from sending a message to receiving its ACK", ("type",))
+ack_timer = AckTimer(ack_rtt_seconds)
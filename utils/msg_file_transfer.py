@@ -1,7 +1,24 @@
 from typing import Generator
+import binascii
+import hashlib
 import mimetypes
+import struct
+import zlib
 import os
 
+# Binary FILE_CHUNK frame: magic, frame kind, transfer handle, chunk index, total chunks, CRC32 (0 unless the
+# CRC feature was negotiated), then the raw chunk bytes
+BINARY_CHUNK_HEADER = struct.Struct(">BBIIII")
+
+# MIME types whose contents are already compressed, so compressing them again only costs CPU
+COMPRESSED_FILETYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/x-7z-compressed", "application/x-rar-compressed",
+    "application/vnd.rar", "application/zstd", "application/pdf", "application/epub+zip",
+    "application/java-archive", "application/vnd.android.package-archive",
+}
+COMPRESSIBLE_MEDIA_TYPES = {"image/svg+xml", "image/bmp", "image/x-ms-bmp", "audio/x-wav", "audio/wav"}
+
 def chunk_file(filepath: str, chunk_size: int = 1024) -> Generator[bytes, None, None]:
     """Generator that yields file chunks of specified size"""
     with open(filepath, 'rb') as f:
@@ -11,9 +28,141 @@ def chunk_file(filepath: str, chunk_size: int = 1024) -> Generator[bytes, None,
                 break
             yield chunk
 
+def read_chunks_into(filepath: str, chunk_size: int = 1024) -> Generator[memoryview, None, None]:
+    """
+    Generator that reads file chunks into a single reusable buffer.
+    Yields a memoryview over the filled part of the buffer, which is only valid until the next iteration.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            yield view if n == chunk_size else view[:n]
+
+def read_chunk(filepath: str, chunk_index: int, chunk_size: int) -> bytes:
+    """Reads a single chunk, used to serve FILE_RESEND requests"""
+    with open(filepath, 'rb') as f:
+        f.seek(chunk_index * chunk_size)
+        return f.read(chunk_size)
+
+def file_digest(filepath: str) -> str:
+    """Returns the SHA-256 hex digest of the file, sent as DIGEST in FILE_OFFER"""
+    with open(filepath, 'rb') as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def transfer_handle(fileid) -> int:
+    """Returns the 32-bit handle both peers use to refer to `fileid` in binary chunk frames"""
+    return int(str(fileid)[:8], 16)
+
+def is_compressible(filename: str, filetype: str) -> bool:
+    """Returns False for files that are already compressed, judging by their MIME type and encoding"""
+    _, encoding = mimetypes.guess_type(filename)
+    if encoding is not None:  # e.g. .tar.gz, .svgz
+        return False
+    if filetype in COMPRESSIBLE_MEDIA_TYPES:
+        return True
+    if filetype.split("/", 1)[0] in ("image", "audio", "video"):
+        return False
+    if filetype in COMPRESSED_FILETYPES or filetype.startswith("application/vnd.openxmlformats"):
+        return False
+    return True
+
+def compress_chunk(chunk: memoryview, level: int = 6) -> bytes:
+    """Compresses one chunk on its own, so chunks can still be lost, resent and reordered independently"""
+    return zlib.compress(chunk, level)
+
+def decompress_chunk(data: bytes, max_size: int) -> bytes:
+    """Decompresses one chunk, refusing to inflate it past `max_size` bytes"""
+    decompressor = zlib.decompressobj()
+    # A max_length of 0 means unlimited to zlib, allow one byte more and reject it below instead
+    chunk = decompressor.decompress(data, max_size + 1)
+    if len(chunk) > max_size or decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError(f"Compressed chunk is truncated or larger than {max_size} bytes")
+    return chunk
+
 def get_file_info(filepath: str) -> tuple[str, int, str]:
     """Returns (filename, filesize, filetype)"""
     filename = os.path.basename(filepath)
     filesize = os.path.getsize(filepath)
     filetype, _ = mimetypes.guess_type(filename)
     return filename, filesize, filetype or 'application/octet-stream'
+
+class ChunkFramer:
+    """
+    Builds FILE_CHUNK datagrams for one file inside a single preallocated buffer.
+
+    The serialized message is split once into `head` (every field up to the CHUNK_INDEX value),
+    `middle` (the fields between CHUNK_INDEX and the DATA value) and `tail` (the terminator),
+    so framing a chunk only writes its index and base64 data.
+    When `crc_middle` is given, `middle` ends at the CRC value and `crc_middle` runs from there to the DATA value.
+    """
+
+    def __init__(self, head: bytes, middle: bytes, tail: bytes, total_chunks: int, chunk_size: int,
+                 crc_middle: bytes = None):
+        self._head_len = len(head)
+        self._middle = middle
+        self._crc_middle = crc_middle
+        self._tail = tail
+        self._head = head
+        self._fixed_len = self._head_len + len(str(max(total_chunks - 1, 0))) + len(middle) + len(tail)
+        if crc_middle is not None:
+            self._fixed_len += 8 + len(crc_middle)
+        self._allocate(chunk_size)
+
+    def _allocate(self, chunk_size: int):
+        self._capacity = chunk_size
+        self._buffer = bytearray(self._fixed_len + 4 * ((chunk_size + 2) // 3))
+        self._buffer[:self._head_len] = self._head
+        self._view = memoryview(self._buffer)
+
+    def frame(self, chunk_index: int, chunk: memoryview, crc: int = None) -> memoryview:
+        """Writes chunk `chunk_index` into the buffer and returns a view over the finished datagram"""
+        if len(chunk) > self._capacity:  # compressed chunks can end up slightly larger than chunk_size
+            self._allocate(len(chunk))
+        buffer = self._buffer
+        pos = self._head_len
+        index = b"%d" % chunk_index
+        end = pos + len(index)
+        buffer[pos:end] = index
+        pos, end = end, end + len(self._middle)
+        buffer[pos:end] = self._middle
+        if self._crc_middle is not None:
+            pos, end = end, end + 8
+            buffer[pos:end] = b"%08x" % crc
+            pos, end = end, end + len(self._crc_middle)
+            buffer[pos:end] = self._crc_middle
+        # b2a_base64 is the only allocation proportional to the chunk size
+        data = binascii.b2a_base64(chunk, newline=False)
+        pos, end = end, end + len(data)
+        buffer[pos:end] = data
+        pos, end = end, end + len(self._tail)
+        buffer[pos:end] = self._tail
+        return self._view[:end]
+
+class BinaryChunkFramer:
+    """
+    Builds binary FILE_CHUNK frames for one file inside a single preallocated buffer.
+    Each frame is a BINARY_CHUNK_HEADER followed by the raw chunk bytes, so no encoding is needed.
+    """
+
+    def __init__(self, magic: int, kind: int, handle: int, total_chunks: int, chunk_size: int):
+        self._magic = magic
+        self._kind = kind
+        self._handle = handle
+        self._total_chunks = total_chunks
+        self._buffer = bytearray(BINARY_CHUNK_HEADER.size + chunk_size)
+        self._view = memoryview(self._buffer)
+
+    def frame(self, chunk_index: int, chunk: memoryview, crc: int = None) -> memoryview:
+        """Writes chunk `chunk_index` into the buffer and returns a view over the finished frame"""
+        if BINARY_CHUNK_HEADER.size + len(chunk) > len(self._buffer):
+            self._buffer = bytearray(BINARY_CHUNK_HEADER.size + len(chunk))
+            self._view = memoryview(self._buffer)
+        BINARY_CHUNK_HEADER.pack_into(self._buffer, 0, self._magic, self._kind, self._handle,
+                                      chunk_index, self._total_chunks, crc or 0)
+        end = BINARY_CHUNK_HEADER.size + len(chunk)
+        self._buffer[BINARY_CHUNK_HEADER.size:end] = chunk
+        return self._view[:end]
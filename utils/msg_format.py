@@ -1,5 +1,10 @@
 import re
-from states.game import game_session_manager
+from utils import tracing
+from states.game import game_session_manager, MAX_GAME_IDS
+
+# Binary frames start with a NUL byte, which can never begin a text message ("TYPE: ...").
+# The second byte selects the message class that registered that frame kind (see router.load_messages).
+BINARY_MAGIC = 0x00
 
 def serialize_message(msg: dict) -> str:
   """Serializes `msg` into a string, ready to be encoded and sent over the network"""
@@ -24,23 +29,24 @@ def deserialize_message(raw: str) -> dict:
     ValueError: If the does not end with the proper terminator
     ValueError: If a field is malformed (no ":" as separator)
   """
-  # Terminator Check
-  raw = raw.replace('\r\n', '\n')   # Case for windows style
-  if not raw.endswith('\n\n'):
-    raise ValueError(f"Invalid terminator: {raw}")
-  
-  # Field and Separator Parsing (OWC allowed)
-  msg = {}
-  raw = raw.strip()
-  lines = raw.split("\n")
-  for line in lines:
-    if not line.strip():
-      continue
-    if ':' not in line:
-      raise ValueError(f"Invalid field (missing colon): {line}")
-    key, value = line.split(":", 1)
-    msg[key.strip()] = value.strip()
-  return msg
+  with tracing.span("deserialize_message"):
+    # Terminator Check
+    raw = raw.replace('\r\n', '\n')   # Case for windows style
+    if not raw.endswith('\n\n'):
+      raise ValueError(f"Invalid terminator: {raw}")
+    
+    # Field and Separator Parsing (OWC allowed)
+    msg = {}
+    raw = raw.strip()
+    lines = raw.split("\n")
+    for line in lines:
+      if not line.strip():
+        continue
+      if ':' not in line:
+        raise ValueError(f"Invalid field (missing colon): {line}")
+      key, value = line.split(":", 1)
+      msg[key.strip()] = value.strip()
+    return msg
 
 def validate_message(msg: dict, schema: dict):
   """
@@ -102,13 +108,18 @@ def sanitize_turn(turn: int):
 
 
 def check_game_id(game_id: str) -> str:
-    pattern = r"g(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])"
-    if re.fullmatch(pattern, game_id):
+    # g0-g255 is the short form every peer accepts, wider IDs go up to g65535
+    pattern = r"g(?:0|[1-9][0-9]{0,4})"
+    if re.fullmatch(pattern, game_id) and int(game_id[1:]) < MAX_GAME_IDS:
             return game_id
 
 
     raise ValueError(f"Invalid GAMEID format: {game_id}")
 
+def is_binary_frame(raw: bytes) -> bool:
+  """Returns True if `raw` is a binary frame rather than a key-value text message"""
+  return len(raw) >= 2 and raw[0] == BINARY_MAGIC
+
 def extract_message_type(msg: str) -> str:
   type_field = msg.split("\n", 1)[0]
 
@@ -0,0 +1,97 @@
+import time
+import threading
+from typing import Dict
+import config
+
+
+class TokenBucket:
+    """
+    Token bucket that lets a sender go into debt.
+
+    `consume` always succeeds and may take the balance below zero, so a datagram larger than the burst can still
+    be sent. `delay` then reports how long the sender must hold off until the balance is back to zero.
+    A rate of 0 or less disables the bucket.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, now: float) -> float:
+        """Returns the seconds left until the bucket allows sending again"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def consume(self, nbytes: int, now: float):
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self._tokens -= nbytes
+
+    def is_full(self, now: float) -> bool:
+        """Returns True once the bucket is back to its burst, where it behaves exactly like a new one"""
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self._tokens >= self.burst
+
+
+class Pacer:
+    """
+    Paces bulk traffic (FILE_CHUNK datagrams) with a token bucket per destination IP and one shared by all of them.
+    Interactive messages are never paced, the bulk sender leaves them room by staying under the configured rates.
+    Every PACE_PRUNE_INTERVAL seconds the buckets that refilled completely are dropped, so peers sent to once
+    do not stay in memory; a dropped bucket is recreated full, just as it was.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(config.PACE_GLOBAL_RATE, config.PACE_BURST)
+        self._destinations: Dict[str, TokenBucket] = {}
+        self._next_prune = time.monotonic() + config.PACE_PRUNE_INTERVAL
+
+    def _prune(self, now: float):
+        # Called with the lock held
+        self._destinations = {ip: bucket for ip, bucket in self._destinations.items() if not bucket.is_full(now)}
+        self._next_prune = now + config.PACE_PRUNE_INTERVAL
+
+    def _bucket(self, ip: str, now: float) -> TokenBucket:
+        if now >= self._next_prune:
+            self._prune(now)
+        bucket = self._destinations.get(ip)
+        if bucket is None:
+            bucket = TokenBucket(config.PACE_PEER_RATE, config.PACE_BURST)
+            self._destinations[ip] = bucket
+        return bucket
+
+    def delay(self, ip: str) -> float:
+        """Returns the seconds until bulk data may be sent to `ip` again, 0 if it may be sent now"""
+        with self._lock:
+            now = time.monotonic()
+            return max(self._global.delay(now), self._bucket(ip, now).delay(now))
+
+    def consume(self, ip: str, nbytes: int):
+        """Records `nbytes` of bulk data sent to `ip`"""
+        with self._lock:
+            now = time.monotonic()
+            self._global.consume(nbytes, now)
+            self._bucket(ip, now).consume(nbytes, now)
+
+    def wait(self, ip: str, nbytes: int):
+        """Blocks until bulk data may be sent to `ip`, then records `nbytes` sent"""
+        while (delay := self.delay(ip)) > 0:
+            time.sleep(delay)
+        self.consume(ip, nbytes)
+
+
+pacer = Pacer()
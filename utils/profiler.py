@@ -0,0 +1,137 @@
+import marshal
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import config
+from client_logger import client_logger
+
+# A frame is identified the way pstats does it: (filename, first line of the function, function name)
+FrameKey = Tuple[str, int, str]
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every client thread (receive loops, processing loop, keep-alive, writers, ...)
+    every PROF_INTERVAL seconds from a background thread with sys._current_frames(), so the profiled code
+    runs unmodified and the client keeps its live state. Between start() and stop() each distinct stack is
+    counted once per sample; stop() writes the counts under PROF_DIR as collapsed stacks (for flamegraph.pl
+    or speedscope) and/or a pstats file (for `python -m pstats` or snakeviz), as chosen by PROF_FORMAT.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Dict[Tuple[str, Tuple[FrameKey, ...]], int] = {}  # (thread name, frames root first) -> samples
+        self._samples = 0
+        self._started_at = 0.0
+        self._stopped_at = 0.0
+
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                raise ValueError("The profiler is already running, stop it with prof_stop")
+            self._stacks = {}
+            self._samples = 0
+            self._stop.clear()
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._thread.start()
+        client_logger.success(f"Profiling all threads every {config.PROF_INTERVAL * 1000:g}ms, stop with prof_stop")
+
+    def stop(self) -> List[str]:
+        """Stops sampling and writes the results, returning the paths written"""
+        with self._lock:
+            if self._thread is None:
+                raise ValueError("The profiler is not running, start it with prof_start")
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._stopped_at = time.perf_counter()
+        paths = self._write()
+        client_logger.success(f"Profiled {self._samples} samples over {self._stopped_at - self._started_at:.1f}s: {', '.join(paths)}")
+        return paths
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        interval = config.PROF_INTERVAL
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                key = (names.get(thread_id, str(thread_id)), tuple(reversed(frames)))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self._samples += 1
+            # Sleep to the next tick rather than a full interval, so sampling does not drift with its own cost
+            next_sample += interval
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                next_sample = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+
+    def _write(self) -> List[str]:
+        project_root = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+        directory = os.path.join(project_root, config.PROF_DIR)
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, "profile-" + time.strftime("%Y%m%d-%H%M%S"))
+        paths = []
+        if config.PROF_FORMAT in ("collapsed", "both"):
+            paths.append(base + ".collapsed")
+            self._write_collapsed(paths[-1])
+        if config.PROF_FORMAT in ("pstats", "both"):
+            paths.append(base + ".pstats")
+            self._write_pstats(paths[-1])
+        return paths
+
+    def _write_collapsed(self, path: str):
+        """One line per distinct stack: the thread name, then each frame from the root, then the sample count"""
+        lines = []
+        for (thread_name, frames), count in sorted(self._stacks.items(), key=lambda item: item[1], reverse=True):
+            names = [thread_name.replace(";", ":").replace(" ", "_")]
+            names.extend(f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in frames)
+            lines.append(f"{';'.join(names)} {count}\n")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _write_pstats(self, path: str):
+        """
+        Writes the samples in the marshalled format pstats.Stats loads, turning sample counts into seconds.
+        A function's calls are the samples it was on the stack in, so call counts are sample counts too.
+        """
+        seconds = (self._stopped_at - self._started_at) / self._samples if self._samples else config.PROF_INTERVAL
+        own: Dict[FrameKey, int] = {}  # samples with the function running itself
+        total: Dict[FrameKey, int] = {}  # samples with the function anywhere on the stack
+        callers: Dict[FrameKey, Dict[FrameKey, int]] = {}
+        for (_, frames), count in self._stacks.items():
+            if not frames:
+                continue
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for func in set(frames):
+                total[func] = total.get(func, 0) + count
+            for caller, callee in set(zip(frames, frames[1:])):
+                edges = callers.setdefault(callee, {})
+                edges[caller] = edges.get(caller, 0) + count
+        stats = {}
+        for func, count in total.items():
+            stats[func] = (
+                count, count, own.get(func, 0) * seconds, count * seconds,
+                {caller: (n, n, 0.0, n * seconds) for caller, n in callers.get(func, {}).items()},
+            )
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,199 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+import config
+
+
+class Span:
+    """
+    A timed stage of the pipeline. Used as a context manager it measures the enclosed block with
+    perf_counter and hands itself to every sink once it ends. `args` are shown with the span in trace viewers.
+    """
+
+    __slots__ = ("name", "start", "end", "thread_id", "args")
+
+    def __init__(self, name: str, args: Optional[dict] = None, start: float = 0.0, end: float = 0.0):
+        self.name = name
+        self.args = args
+        self.start = start
+        self.end = end
+        self.thread_id = threading.get_ident()
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        tracer.emit(self)
+        return False
+
+
+class _NullSpan:
+    """Returned by span() while no sink is registered, so an untraced stage costs one call and a `with`"""
+
+    __slots__ = ()
+    args = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+Sink = Callable[[Span], None]
+
+
+class Tracer:
+    """
+    Hands finished spans to the registered sinks. A sink is any callable taking a Span; it is called on the
+    thread that ran the span, so it should only queue the span. Sinks are kept in a tuple replaced on every
+    change, so emitting never takes a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sinks: tuple = ()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._sinks)
+
+    def add_sink(self, sink: Sink):
+        with self._lock:
+            self._sinks = self._sinks + (sink,)
+
+    def remove_sink(self, sink: Sink):
+        with self._lock:
+            self._sinks = tuple(s for s in self._sinks if s is not sink)
+
+    def emit(self, span: Span):
+        for sink in self._sinks:
+            try:
+                sink(span)
+            except Exception:
+                pass  # a broken sink must not break the stage it traced
+
+
+tracer = Tracer()
+
+
+def span(name: str, **args):
+    """Returns a context manager timing the enclosed block as the stage `name`"""
+    if not tracer._sinks:
+        return NULL_SPAN
+    return Span(name, args or None)
+
+
+def record(name: str, start: float, end: float, **args):
+    """Emits a span that has already ended, timed by perf_counter values taken elsewhere (e.g. on another thread)"""
+    if tracer._sinks:
+        tracer.emit(Span(name, args or None, start, end))
+
+
+class ChromeTraceSink:
+    """
+    Writes spans as Chrome trace events ("X" complete events, timestamps in microseconds) to `path`, which
+    can be opened in chrome://tracing or https://ui.perfetto.dev. Spans are queued and written in batches by a
+    background thread; spans arriving while TRACE_QUEUE are already waiting are dropped and counted.
+    The file is valid JSON once close() has run, and viewers also accept one cut short by a crash.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=config.TRACE_QUEUE)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._thread_names = {}
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write("[\n")
+        self._first = True
+        self._closed = False
+        threading.Thread(target=self._write_loop, name="trace_writer", daemon=True).start()
+
+    def __call__(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def _events(self, spans: List[Span]) -> List[dict]:
+        events = []
+        for s in spans:
+            if s.thread_id not in self._thread_names:
+                thread_name = next((t.name for t in threading.enumerate() if t.ident == s.thread_id), str(s.thread_id))
+                self._thread_names[s.thread_id] = thread_name
+                events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": s.thread_id, "args": {"name": thread_name}})
+            event = {
+                "name": s.name, "ph": "X", "pid": self._pid, "tid": s.thread_id,
+                "ts": round((s.start - self._origin) * 1e6, 3), "dur": round((s.end - s.start) * 1e6, 3),
+            }
+            if s.args:
+                event["args"] = {k: str(v) for k, v in s.args.items()}
+            events.append(event)
+        return events
+
+    def _write(self, events: List[dict]):
+        for event in events:
+            self._file.write(("" if self._first else ",\n") + json.dumps(event, separators=(",", ":")))
+            self._first = False
+        self._file.flush()
+
+    def _write_loop(self):
+        from client_logger import client_logger
+        while True:
+            spans = [self._queue.get()]
+            while True:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    dropped, self._dropped = self._dropped, 0
+                    if not self._closed:
+                        self._write(self._events([s for s in spans if s is not None]))
+                if dropped:
+                    client_logger.warn(f"Trace queue full, {dropped} spans not written")
+            except Exception as e:
+                # Keep draining the queue, close() waits on it
+                client_logger.error(f"Error writing trace to {self.path}: {e}")
+            finally:
+                for _ in spans:
+                    self._queue.task_done()
+
+    def close(self):
+        """Writes every queued span and closes the JSON array"""
+        self._queue.put(None)
+        self._queue.join()
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._file.write("\n]\n")
+                self._file.close()
+
+
+def start_chrome_trace(path: str) -> ChromeTraceSink:
+    sink = ChromeTraceSink(path)
+    tracer.add_sink(sink)
+    return sink
+
+
+def stop_chrome_trace(sink: ChromeTraceSink):
+    tracer.remove_sink(sink)
+    sink.close()